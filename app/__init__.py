@@ -5,11 +5,12 @@ from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_login import LoginManager # Added
 from dotenv import load_dotenv
+from .routing import RoutingSession, replica_binds, init_replica_router
 
 # Load environment variables from .env file
 load_dotenv()
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession}) # Sends eligible reads to replicas
 migrate = Migrate()
 jwt = JWTManager()
 login_manager = LoginManager() # Added
@@ -21,26 +22,147 @@ def create_app():
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a_default_secret_key')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///./test.db') # Default to SQLite for easy setup if DATABASE_URL is not set
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Read replicas (comma-separated URLs). GET requests read from them unless they lag or the user just wrote.
+    app.config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    # Video metadata shards (comma-separated URLs), see app/sharding.py. Empty: everything on DATABASE_URL.
+    from .sharding import shard_binds, init_shard_router
+    app.config['VIDEO_SHARD_URLS'] = [url.strip() for url in os.environ.get('VIDEO_SHARD_URLS', '').split(',') if url.strip()]
+    app.config['SHARD_DIRECTORY_TTL_SECONDS'] = float(os.environ.get('SHARD_DIRECTORY_TTL_SECONDS', 5))
+    app.config['SQLALCHEMY_BINDS'] = {**replica_binds(app.config['DATABASE_REPLICA_URLS']),
+                                      **shard_binds(app.config['VIDEO_SHARD_URLS'])}
+    # Engine tuning: 'tuned' (SQLite WAL pragmas / sized Postgres pool, see app/engine.py) or 'default'
+    app.config['DB_PROFILE'] = os.environ.get('DB_PROFILE', 'tuned')
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'a_default_jwt_secret_key')
     app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads') # For local file storage
     app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB max upload size (for now)
+    # Upload disk-space admission (see app/uploads.py): uploads that would leave less than this free get a 507
+    app.config['UPLOAD_MIN_FREE_BYTES'] = int(os.environ.get('UPLOAD_MIN_FREE_BYTES', 1024 * 1024 * 1024))
+    app.config['UPLOAD_RESERVATION_STORE'] = os.environ.get('UPLOAD_RESERVATION_STORE', 'sqlite') # 'sqlite' (all workers) or 'memory'
+    app.config['UPLOAD_RESERVATION_PATH'] = os.environ.get('UPLOAD_RESERVATION_PATH') # Defaults to instance/upload_reservations.db
+    # Concurrent uploads on this host and per user; over the cap an upload waits this long for a slot, then gets a 429
+    app.config['UPLOAD_MAX_CONCURRENT'] = int(os.environ.get('UPLOAD_MAX_CONCURRENT', 8))
+    app.config['UPLOAD_MAX_CONCURRENT_PER_USER'] = int(os.environ.get('UPLOAD_MAX_CONCURRENT_PER_USER', 2))
+    app.config['UPLOAD_QUEUE_TIMEOUT_SECONDS'] = float(os.environ.get('UPLOAD_QUEUE_TIMEOUT_SECONDS', 2))
+    # Metadata response cache: 'lru' (per process), 'sqlite' (shared by all workers on the host) or 'none'
+    app.config['METADATA_CACHE_BACKEND'] = os.environ.get('METADATA_CACHE_BACKEND', 'lru')
+    app.config['METADATA_CACHE_MAX_BYTES'] = int(os.environ.get('METADATA_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    app.config['METADATA_CACHE_PATH'] = os.environ.get('METADATA_CACHE_PATH') # Defaults to instance/metadata_cache.db
+    # With 'lru', how long a worker may serve metadata that another worker has since changed
+    app.config['METADATA_CACHE_TTL_SECONDS'] = float(os.environ.get('METADATA_CACHE_TTL_SECONDS', 30))
+    # User lookups for JWT/session auth: 'lru' (per process), 'sqlite' (shared by all workers on the host) or 'none'
+    app.config['IDENTITY_CACHE_BACKEND'] = os.environ.get('IDENTITY_CACHE_BACKEND', 'lru')
+    app.config['IDENTITY_CACHE_TTL_SECONDS'] = float(os.environ.get('IDENTITY_CACHE_TTL_SECONDS', 60))
+    app.config['IDENTITY_CACHE_PATH'] = os.environ.get('IDENTITY_CACHE_PATH') # Defaults to instance/identity_cache.db
+    # JWT revocation (see app/revocation.py): how often each worker picks up other workers' revocations
+    app.config['JWT_REVOCATION_SYNC_SECONDS'] = float(os.environ.get('JWT_REVOCATION_SYNC_SECONDS', 1))
+    app.config['JWT_REVOCATION_BLOOM_CAPACITY'] = int(os.environ.get('JWT_REVOCATION_BLOOM_CAPACITY', 100000))
+    # Rate limiting (see app/ratelimit.py): 'memory' (per worker), 'sqlite' (shared by all workers on the host) or 'none'.
+    # RATE_LIMITS overrides per-endpoint policies, e.g. "auth.login=20/minute @ip,videos.stream_video=" (empty disables).
+    app.config['RATE_LIMIT_STORE'] = os.environ.get('RATE_LIMIT_STORE', 'memory')
+    app.config['RATE_LIMIT_PATH'] = os.environ.get('RATE_LIMIT_PATH') # Defaults to instance/rate_limits.db
+    app.config['RATE_LIMITS'] = dict(item.strip().split('=', 1) for item in os.environ.get('RATE_LIMITS', '').split(',') if '=' in item)
+    # Password hashing pool (see app/passwords.py). Workers=0 hashes inline in the request worker.
+    from .passwords import default_workers
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt') # Changing it rehashes on next login
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', default_workers()))
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 16))
+    # Storage scrubber (`flask storage scrub`, see app/storage.py): read rate cap and where a pass's progress is kept
+    app.config['SCRUB_MAX_BYTES_PER_SECOND'] = int(os.environ.get('SCRUB_MAX_BYTES_PER_SECOND', 20 * 1024 * 1024))
+    app.config['SCRUB_STATE_PATH'] = os.environ.get('SCRUB_STATE_PATH') # Defaults to instance/scrub_state.json
+    # `flask storage reconcile`: orphaned files younger than this are never touched; --action quarantine moves the rest here
+    app.config['RECONCILE_GRACE_HOURS'] = float(os.environ.get('RECONCILE_GRACE_HOURS', 24))
+    app.config['RECONCILE_QUARANTINE_DIR'] = os.environ.get('RECONCILE_QUARANTINE_DIR') # Defaults to instance/quarantine
+    # Storage tiering (see app/tiering.py): `flask tiering run` moves files not streamed for TIER_COLD_AFTER_DAYS
+    # to COLD_STORAGE_FOLDER (unset: no tiering). Streams are sampled at ACCESS_SAMPLE_RATE and flushed in batches.
+    app.config['COLD_STORAGE_FOLDER'] = os.environ.get('COLD_STORAGE_FOLDER')
+    app.config['TIER_COLD_AFTER_DAYS'] = float(os.environ.get('TIER_COLD_AFTER_DAYS', 30))
+    app.config['ACCESS_SAMPLE_RATE'] = float(os.environ.get('ACCESS_SAMPLE_RATE', 0.1))
+    app.config['ACCESS_FLUSH_SECONDS'] = float(os.environ.get('ACCESS_FLUSH_SECONDS', 30))
+    # Stream block cache (see app/blockcache.py): per-process memory for hot byte ranges; 0 disables it
+    app.config['BLOCK_CACHE_MAX_BYTES'] = int(os.environ.get('BLOCK_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+    app.config['BLOCK_CACHE_BLOCK_SIZE'] = int(os.environ.get('BLOCK_CACHE_BLOCK_SIZE', 1024 * 1024))
+    # Stream pacing (see app/pacing.py): per-connection rate of STREAM_PACE_FACTOR x bitrate after a
+    # STREAM_BURST_SECONDS head start, a per-user cap and a per-process egress ceiling (0: none).
+    # Each paced stream holds a worker thread; at most STREAM_MAX_PACED_STREAMS per process (0: no cap)
+    app.config['STREAM_PACING'] = os.environ.get('STREAM_PACING', '').lower() in ('1', 'true', 'yes')
+    app.config['STREAM_BITRATE_BPS'] = int(os.environ.get('STREAM_BITRATE_BPS', 8_000_000))
+    app.config['STREAM_PACE_FACTOR'] = float(os.environ.get('STREAM_PACE_FACTOR', 1.5))
+    app.config['STREAM_BURST_SECONDS'] = float(os.environ.get('STREAM_BURST_SECONDS', 10))
+    app.config['STREAM_USER_MAX_BYTES_PER_SECOND'] = int(os.environ.get('STREAM_USER_MAX_BYTES_PER_SECOND', 4 * 1024 * 1024))
+    app.config['STREAM_MAX_EGRESS_BYTES_PER_SECOND'] = int(os.environ.get('STREAM_MAX_EGRESS_BYTES_PER_SECOND', 0))
+    app.config['STREAM_MAX_PACED_STREAMS'] = int(os.environ.get('STREAM_MAX_PACED_STREAMS', 16))
+    # /videos/changes withholds changes younger than this, so slow transactions can't commit behind a mirror's cursor
+    app.config['CHANGE_FEED_SETTLE_SECONDS'] = float(os.environ.get('CHANGE_FEED_SETTLE_SECONDS', 5))
+    # Processed videos older than this are moved to videos_archive by `flask archive run`
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
 
     # Ensure upload folder exists
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
 
     # Initialize extensions
+    from .engine import configure_engine_options, apply_engine_profile
+    configure_engine_options(app)
     db.init_app(app)
+    with app.app_context():
+        apply_engine_profile(app, db.engines.values())
+    init_replica_router(app)
+    init_shard_router(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     login_manager.init_app(app) # Added
     login_manager.login_view = 'auth.login' # Or wherever your login route is
 
+    from .cache import metadata_cache, register_invalidation_hooks
+    metadata_cache.init_app(app)
+    from .passwords import password_hasher
+    password_hasher.init_app(app)
+    from .revocation import token_denylist
+    token_denylist.init_app(app) # After jwt.init_app, which fills in JWT_ACCESS_TOKEN_EXPIRES
+    from .ratelimit import rate_limiter
+    rate_limiter.init_app(app)
+    from .uploads import disk_space, upload_slots
+    disk_space.init_app(app)
+    upload_slots.init_app(app)
+    from .tiering import access_stats
+    access_stats.init_app(app)
+    from .blockcache import block_cache
+    block_cache.init_app(app)
+    from .pacing import stream_pacer
+    stream_pacer.init_app(app)
+
     # User loader function for Flask-Login
-    from .models import User # Ensure User model is imported
+    from .models import Video # Ensure models are imported
+    from .identity import identity_cache, register_identity_hooks
+    identity_cache.init_app(app)
+    register_identity_hooks()
+    register_invalidation_hooks(Video)
+    from .search import register_search_hooks, search_cli
+    register_search_hooks(Video)
+    app.cli.add_command(search_cli)
+    from .changes import register_change_hooks
+    register_change_hooks(Video)
+    from .export import export_cli
+    app.cli.add_command(export_cli)
+    from .stats import register_stats_hooks, stats_cli
+    register_stats_hooks(Video)
+    app.cli.add_command(stats_cli)
+    from .sharding import register_sharding_hooks, shards_cli
+    register_sharding_hooks()
+    app.cli.add_command(shards_cli)
+    from .archive import archive_cli
+    app.cli.add_command(archive_cli)
+    from .users import users_cli
+    app.cli.add_command(users_cli)
+    from .storage import storage_cli
+    app.cli.add_command(storage_cli)
+    from .tiering import tiering_cli
+    app.cli.add_command(tiering_cli)
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity_cache.get_user(int(user_id))
 
     # Register Blueprints (we'll create these later)
     # from .auth import auth_bp
@@ -0,0 +1,153 @@
+import datetime
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, delete, insert, literal, literal_column, select, union_all
+from . import db
+from .models import ArchivedVideo, Video
+from .search import index_video
+from .serializers import video_metadata_query
+from .sharding import on_shard, scatter, video_binds
+
+# Time-based archival of old video rows.
+#
+# Most reads are for recent videos, so processed videos older than ARCHIVE_AFTER_DAYS are moved
+# from `videos` to `videos_archive` by `flask archive run`. Each batch is one short transaction
+# (INSERT ... SELECT, then DELETE) followed by a pause, so the job never holds locks for long
+# or competes with requests for I/O. Rows keep their IDs.
+#
+# The move uses Core statements, so the Video mapper hooks do not fire: as far as the change
+# log, usage counters and search index are concerned the video still exists. (The search index
+# has no foreign key to `videos` for this reason, and restore_video reindexes what it brings
+# back.) Readers look in the archive only when the hot table misses (fetch_video_rows,
+# find_video_anywhere); user listings read both tables in one UNION ALL (user_video_rows).
+
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE_SECONDS = 0.5
+# Columns shared by `videos` and `videos_archive`
+VIDEO_COLUMNS = [column.name for column in Video.__table__.columns]
+
+def archive_batch(cutoff, batch_size=None):
+    """Move up to `batch_size` processed videos created before `cutoff` to the archive.
+
+    Returns the number of rows moved (0 when there is nothing left to archive).
+    """
+    videos, archive = Video.__table__, ArchivedVideo.__table__
+    eligible = (videos.c.is_processed.is_(True), videos.c.created_at < cutoff)
+    # FOR UPDATE (PostgreSQL) keeps the rows from being edited between the copy and the delete;
+    # SKIP LOCKED lets the job step around rows a request is writing right now
+    video_ids = [row[0] for row in db.session.execute(
+        select(videos.c.id).where(*eligible).order_by(videos.c.id)
+        .limit(batch_size or ARCHIVE_BATCH_SIZE).with_for_update(skip_locked=True))]
+    if not video_ids:
+        db.session.rollback()
+        return 0
+    now = literal(datetime.datetime.utcnow(), DateTime)
+    db.session.execute(insert(archive).from_select(
+        VIDEO_COLUMNS + ['archived_at'],
+        select(*[videos.c[name] for name in VIDEO_COLUMNS], now).where(videos.c.id.in_(video_ids))))
+    db.session.execute(delete(videos).where(videos.c.id.in_(video_ids)))
+    db.session.commit()
+    return len(video_ids)
+
+def run_archival(cutoff, batch_size=None, pause=None, max_batches=None, echo=lambda message: None):
+    """Archive everything eligible on every video database, one throttled batch at a time."""
+    pause = ARCHIVE_PAUSE_SECONDS if pause is None else pause
+    total = 0
+    for bind_key in video_binds():
+        batches = 0
+        with on_shard(bind_key):
+            while max_batches is None or batches < max_batches:
+                moved = archive_batch(cutoff, batch_size)
+                if not moved:
+                    break
+                total += moved
+                batches += 1
+                echo(f"Archived {total} videos")
+                time.sleep(pause)
+    return total
+
+def restore_video(video_id):
+    """Move an archived video back to `videos` (e.g. before editing it). Returns True if found."""
+    videos, archive = Video.__table__, ArchivedVideo.__table__
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            row = db.session.execute(select(archive.c.title, archive.c.description).where(archive.c.id == video_id)).first()
+            db.session.execute(insert(videos).from_select(
+                VIDEO_COLUMNS, select(*[archive.c[name] for name in VIDEO_COLUMNS]).where(archive.c.id == video_id)))
+            restored = db.session.execute(delete(archive).where(archive.c.id == video_id)).rowcount
+            if restored:
+                # Core inserts skip the mapper hooks; make sure the restored row is searchable
+                index_video(db.session.connection(), video_id, row.title, row.description)
+            db.session.commit()
+        if restored:
+            return True
+    return False
+
+
+# --- Reads with archive fallback ---
+
+def fetch_video_rows(video_ids, fields):
+    """Metadata rows `(id, *fields)` for the given IDs, from `videos` and then the archive.
+
+    The archive is only queried for IDs the hot table did not have.
+    """
+    rows = scatter(video_metadata_query(['id'] + fields).filter(Video.id.in_(video_ids)).statement)
+    missing = set(video_ids) - {row[0] for row in rows}
+    if missing:
+        rows += scatter(video_metadata_query(['id'] + fields, ArchivedVideo)
+                        .filter(ArchivedVideo.id.in_(missing)).statement)
+    return rows
+
+def _user_rows(model, user_id, fields):
+    # Trailing sort columns let hot and archived rows be merged newest first
+    return video_metadata_query(fields, model) \
+        .add_columns(model.created_at.label('_created_at'), model.id.label('_id')) \
+        .filter(model.user_id == user_id).statement
+
+def user_video_rows(user_id, fields):
+    """A user's videos newest first, including archived ones. Run on the user's shard.
+
+    Hot and archived rows come back from one UNION ALL; for a user with nothing archived the
+    second half is a single probe of the archive's user index.
+    """
+    hot, archived = (_user_rows(model, user_id, fields) for model in (Video, ArchivedVideo))
+    # Same order as the index: created_at descending, then id ascending
+    statement = union_all(hot, archived).order_by(literal_column('_created_at').desc(), literal_column('_id'))
+    return [row[:-2] for row in db.session.execute(statement)]
+
+def find_video_anywhere(video_id):
+    """Like sharding.find_video, falling back to the archive. Returns `(video, bind_key)`.
+
+    Archived videos come back as read-only ArchivedVideo objects.
+    """
+    from .sharding import find_video
+    video, bind_key = find_video(video_id)
+    if video is not None:
+        return video, bind_key
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            video = db.session.get(ArchivedVideo, video_id)
+        if video is not None:
+            return video, bind_key
+    return None, None
+
+
+# --- CLI ---
+
+archive_cli = AppGroup('archive', help='Move old video rows to the archive table.')
+
+@archive_cli.command('run')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive processed videos created more than this many days ago (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Videos moved per transaction.')
+@click.option('--pause', default=ARCHIVE_PAUSE_SECONDS, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per database.')
+def run_command(older_than_days, batch_size, pause, max_batches):
+    """Archive old, processed videos in throttled batches. Safe to stop and re-run at any time."""
+    days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    started = time.monotonic()
+    total = run_archival(cutoff, batch_size, pause, max_batches, echo=click.echo)
+    click.echo(f"Done. {total} videos created before {cutoff:%Y-%m-%d} archived in {time.monotonic() - started:.1f}s.")
@@ -1,12 +1,32 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from .models import User
 from . import db, jwt
-from werkzeug.security import check_password_hash
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from .passwords import password_hasher, PasswordHashingBusy
+from .identity import identity_cache
+from .revocation import token_denylist
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from flask_login import login_user, logout_user, current_user # Added for Flask-Login
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.errorhandler(PasswordHashingBusy)
+def hashing_busy(e):
+    # Shed load quickly instead of queueing logins until every client has timed out
+    return jsonify({"msg": "Too many sign-in attempts in progress, please retry shortly"}), 503, {'Retry-After': '1'}
+
+def _check_login(user, password):
+    """Verify a password, upgrading the stored hash if it was made with older settings."""
+    if not user or not user.check_password(password):
+        return False
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.set_password(password)
+            db.session.commit()
+            password_hasher.rehashed += 1
+        except PasswordHashingBusy:
+            pass # The login itself succeeded; upgrade the hash next time
+    return True
+
 @auth_bp.route('/signup', methods=['GET', 'POST']) # Added GET method
 def signup():
     if request.method == 'POST':
@@ -60,7 +80,7 @@ def login():
 
             user = User.query.filter((User.username == identifier) | (User.email == identifier)).first()
 
-            if user and user.check_password(password):
+            if _check_login(user, password):
                 # For JWT API login
                 additional_claims = {'username': user.username, 'email': user.email}
                 access_token = create_access_token(identity=str(user.id), additional_claims=additional_claims)
@@ -83,7 +103,7 @@ def login():
 
             user = User.query.filter((User.username == identifier) | (User.email == identifier)).first()
 
-            if user and user.check_password(password):
+            if _check_login(user, password):
                 login_user(user, remember=remember)
                 next_page = request.args.get('next')
                 flash('Logged in successfully!', 'success')
@@ -126,6 +146,28 @@ def protected():
     # Return the same structure as before for compatibility with current tests
     return jsonify(logged_in_as={'id': user.id, 'username': user.username, 'email': user.email}), 200
 
+@auth_bp.route('/hashing/stats', methods=['GET'])
+@jwt_required()
+def hashing_stats():
+    return jsonify(password_hasher.stats()), 200
+
+@auth_bp.route('/revoke', methods=['POST'])
+@jwt_required()
+def revoke_token():
+    # Revokes the access token used for this request (API logout)
+    token_denylist.revoke(get_jwt())
+    return jsonify({"msg": "Token revoked"}), 200
+
+@auth_bp.route('/revocation/stats', methods=['GET'])
+@jwt_required()
+def revocation_stats():
+    return jsonify(token_denylist.stats()), 200
+
+@auth_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def identity_cache_stats():
+    return jsonify(identity_cache.stats()), 200
+
 # Callback for loading a user from an access token
 # This is used by Flask-JWT-Extended to check if a user exists in the database
 @jwt.user_lookup_loader
@@ -137,7 +179,20 @@ def user_lookup_callback(_jwt_header, jwt_data):
         user_id = int(user_id_str)
     except ValueError: # If subject is not a valid integer string
         return None
-    return User.query.get(user_id)
+    return identity_cache.get_user(user_id)
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    # Bloom filter first; the database is only asked when the filter reports a possible match
+    return token_denylist.is_revoked(jwt_payload)
+
+@jwt.revoked_token_loader
+def revoked_token_callback(jwt_header, jwt_payload):
+    return jsonify({
+        'status': 401,
+        'sub_status': 45, # Custom sub-status code for revoked token
+        'msg': 'The token has been revoked'
+    }), 401
 
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
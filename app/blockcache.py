@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Byte-range block cache for video streams.
+#
+# stream_video serves files through `block_cache.iter_range()`, which splits every requested
+# byte range into fixed-size blocks aligned to BLOCK_CACHE_BLOCK_SIZE and keeps recently read
+# blocks in memory, up to BLOCK_CACHE_MAX_BYTES per process. When one video goes viral, the
+# thousands of requests for its first megabytes are then served from memory instead of disk.
+#
+# Blocks are keyed by (video ID, file version, block index); the version is the file's mtime, so
+# a file replaced under a reused ID never serves the old bytes. Tier moves keep the mtime, so a
+# video stays cached across them.
+#
+# Admission follows TinyLFU: a small count-min sketch estimates how often each block was asked
+# for recently, and a block read from disk only enters a full cache if it is wanted more often
+# than the least recently used blocks it would evict. A one-off read (a scrubber, a viewer
+# seeking through an old video) therefore never pushes out the hot set. The sketch's counters
+# are halved every few thousand requests so yesterday's hits fade.
+#
+# Concurrent misses on the same block are coalesced: the first request reads it, the others
+# wait for that read instead of issuing their own.
+
+SKETCH_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93) # One row per seed
+SKETCH_MAX_COUNT = 15 # Counters saturate, as in TinyLFU's 4-bit counters
+COALESCED_WAIT_SECONDS = 30 # Longest a coalesced request waits for another request's read
+
+def _next_power_of_two(n):
+    return 1 << max(n - 1, 1).bit_length()
+
+
+class FrequencySketch:
+    """Count-min sketch of recent block requests, aged by halving every `sample_size` additions."""
+
+    def __init__(self, capacity):
+        self.width = _next_power_of_two(max(capacity * 4, 64))
+        self.sample_size = max(capacity * 10, 1000)
+        self._shift = 64 - self.width.bit_length() + 1
+        self._rows = [bytearray(self.width) for _ in SKETCH_SEEDS]
+        self._additions = 0
+
+    def _slots(self, key):
+        # Multiply-shift hashing: the top bits of hash * odd seed are independent enough per row
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        return [((h * seed) & 0xFFFFFFFFFFFFFFFF) >> self._shift for seed in SKETCH_SEEDS]
+
+    def increment(self, key):
+        for row, slot in zip(self._rows, self._slots(key)):
+            if row[slot] < SKETCH_MAX_COUNT:
+                row[slot] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._rows = [bytearray(count >> 1 for count in row) for row in self._rows]
+            self._additions //= 2
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self._rows, self._slots(key)))
+
+
+class _PendingRead:
+    def __init__(self):
+        self.done = threading.Event()
+        self.block = None
+
+
+class BlockCache:
+    def __init__(self, app=None):
+        self.max_bytes = 0
+        self.block_size = 1024 * 1024
+        self._blocks = OrderedDict() # key -> bytes, least recently used first
+        self._inflight = {} # key -> _PendingRead
+        self._size = 0
+        self._lock = threading.Lock()
+        self.sketch = FrequencySketch(1)
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('BLOCK_CACHE_MAX_BYTES', 128 * 1024 * 1024)
+        self.block_size = app.config.get('BLOCK_CACHE_BLOCK_SIZE', 1024 * 1024)
+        self.clear()
+        app.extensions['block_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _reset_stats(self):
+        self.hits = 0
+        self.coalesced = 0 # Misses that waited for another request's read of the same block
+        self.misses = 0
+        self.bytes_saved = 0 # Bytes served without a read of their own
+        self.bytes_read = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def get_block(self, key, read):
+        """Return the block at `key`, calling `read()` to fetch it unless it is cached or being read."""
+        with self._lock:
+            self.sketch.increment(key)
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += len(block)
+                return block
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = _PendingRead()
+        if not leader:
+            if pending.done.wait(COALESCED_WAIT_SECONDS) and pending.block is not None:
+                with self._lock:
+                    self.coalesced += 1
+                    self.bytes_saved += len(pending.block)
+                return pending.block
+            return self._read(key, read, None) # The first read failed; try our own
+        return self._read(key, read, pending)
+
+    def _read(self, key, read, pending):
+        try:
+            block = read()
+            if pending is not None:
+                pending.block = block
+        finally:
+            if pending is not None:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                pending.done.set()
+        with self._lock:
+            self.misses += 1
+            self.bytes_read += len(block)
+            self._admit(key, block)
+        return block
+
+    def _admit(self, key, block):
+        # Called with the lock held
+        if key in self._blocks or len(block) > self.max_bytes:
+            return
+        frequency = self.sketch.estimate(key)
+        victims, freed = [], 0
+        candidates = iter(self._blocks.items())
+        while self._size - freed + len(block) > self.max_bytes:
+            victim, victim_block = next(candidates)
+            if self.sketch.estimate(victim) >= frequency: # The cached block is at least as popular
+                self.rejected += 1
+                return
+            victims.append(victim)
+            freed += len(victim_block)
+        for victim in victims:
+            del self._blocks[victim]
+        self._size -= freed
+        self.evictions += len(victims)
+        self._blocks[key] = block
+        self._size += len(block)
+        self.admitted += 1
+
+    def iter_range(self, f, version, start, stop):
+        """Yield bytes `start` to `stop` (exclusive) of the open file `f`, block by block.
+
+        `version` identifies the file's content, usually (video ID, mtime). With the cache
+        disabled the blocks are read straight from the file.
+        """
+        fd = f.fileno()
+        while start < stop:
+            index = start // self.block_size
+            offset = index * self.block_size
+            if self.enabled:
+                block = self.get_block((version, index), lambda: os.pread(fd, self.block_size, offset))
+            else:
+                block = os.pread(fd, self.block_size, offset)
+            chunk = block[start - offset:stop - offset]
+            if not chunk: # The file is shorter than it was when the range was computed
+                return
+            yield chunk
+            start += len(chunk)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+            self.sketch = FrequencySketch(max(self.max_bytes // self.block_size, 1))
+        self._reset_stats()
+
+    def stats(self):
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "block_size": self.block_size,
+            "blocks": len(self._blocks),
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_ratio": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_read": self.bytes_read,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+block_cache = BlockCache()
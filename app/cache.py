@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+# Response cache for video metadata.
+#
+# Entries hold already-encoded JSON bodies. Single videos are keyed by (video ID, version)
+# and per-user listings by (user, catalog version). A write bumps both versions, which
+# makes every cached variant (any ?fields= combination) unreachable at once; the stale
+# entries then age out of the LRU.
+
+class LRUBackend:
+    """In-process LRU bounded by the total size of the cached values in bytes.
+
+    Version counters live in this process only, so writes handled by other workers never bump
+    them. With a `ttl`, entries expire that many seconds after they were stored, which bounds
+    how long another worker's write can go unnoticed. It also bounds the counters: once a
+    namespace has not been bumped for `ttl` seconds every entry stored under its older versions
+    has expired, so its counter can be forgotten (it reads as 0 again).
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (value, expires or None)
+        self._versions = OrderedDict() # namespace -> (version, last bumped), least recently bumped first
+        self._bumps = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self._size -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value` and return the number of entries evicted to make room for it."""
+        if len(value) > self.max_bytes:
+            return 0
+        evicted = 0
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (value, expires)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, (dropped, _) = self._entries.popitem(last=False)
+                self._size -= len(dropped)
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, (0, None))[0]
+
+    def bump(self, namespace):
+        now = time.monotonic()
+        with self._lock:
+            self._versions.pop(namespace, None)
+            self._bumps += 1 # Versions come from one counter, so a forgotten namespace never reuses one
+            self._versions[namespace] = (self._bumps, now)
+            if self.ttl:
+                while True: # Forget counters whose older entries have all expired
+                    oldest, (_, bumped) = next(iter(self._versions.items()))
+                    if bumped > now - self.ttl:
+                        break
+                    del self._versions[oldest]
+
+    def size(self):
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+
+
+class SQLiteBackend:
+    """Cache shared by every worker on the host, stored in a local SQLite file."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                         "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_versions (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections must not be shared across threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET accessed = ? WHERE key = ?", (time.time(), key))
+        return bytes(row[0])
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return 0
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO cache_entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                     (key, value, len(value), time.time()))
+        evicted = 0
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        while total > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (row[0],))
+            total -= row[1]
+            evicted += 1
+        return evicted
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def version(self, namespace):
+        row = self._connect().execute("SELECT version FROM cache_versions WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._connect().execute(
+            "INSERT INTO cache_versions (namespace, version) VALUES (?, 1) "
+            "ON CONFLICT(namespace) DO UPDATE SET version = version + 1", (namespace,))
+
+    def size(self):
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM cache_entries")
+        conn.execute("DELETE FROM cache_versions")
+
+
+class MetadataCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('METADATA_CACHE_BACKEND', 'lru')
+        max_bytes = app.config.get('METADATA_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        if backend == 'lru':
+            self.backend = LRUBackend(max_bytes, ttl=app.config.get('METADATA_CACHE_TTL_SECONDS', 30.0))
+        elif backend == 'sqlite':
+            path = app.config.get('METADATA_CACHE_PATH') or os.path.join(app.instance_path, 'metadata_cache.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path, max_bytes)
+        elif backend == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown METADATA_CACHE_BACKEND: {backend}")
+        app.extensions['metadata_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def video_key(self, video_id, fields):
+        return f"video:{video_id}:v{self.backend.version(f'video:{video_id}')}:{','.join(fields)}"
+
+    def user_key(self, user_id, fields):
+        return f"user:{user_id}:v{self.backend.version(f'user:{user_id}')}:{','.join(fields)}"
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.evictions += self.backend.set(key, value)
+
+    def invalidate_video(self, video_id, user_id):
+        """Drop everything that may contain this video: its own entries and its owner's listings."""
+        if not self.enabled:
+            return
+        self.backend.bump(f'video:{video_id}')
+        self.backend.bump(f'user:{user_id}')
+
+    def invalidate_user(self, user_id):
+        if self.enabled:
+            self.backend.bump(f'user:{user_id}')
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.enabled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "size_bytes": self.backend.size() if self.enabled else 0,
+            "max_bytes": self.backend.max_bytes if self.enabled else 0,
+        }
+
+
+metadata_cache = MetadataCache()
+
+
+# --- Write-through invalidation ---
+# Video writes are recorded on the session as they are flushed and applied once the
+# transaction commits, so a rolled-back upload never evicts anything.
+
+def _record_video_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('metadata_cache_dirty', set()).add((target.id, target.user_id))
+
+def _apply_invalidations(session):
+    for video_id, user_id in session.info.pop('metadata_cache_dirty', ()):
+        metadata_cache.invalidate_video(video_id, user_id)
+
+def _discard_invalidations(session):
+    session.info.pop('metadata_cache_dirty', None)
+
+def register_invalidation_hooks(video_model):
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        if not event.contains(video_model, name, _record_video_write):
+            event.listen(video_model, name, _record_video_write)
+    if not event.contains(Session, 'after_commit', _apply_invalidations):
+        event.listen(Session, 'after_commit', _apply_invalidations)
+        event.listen(Session, 'after_rollback', _discard_invalidations)
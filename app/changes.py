@@ -0,0 +1,96 @@
+import datetime
+from sqlalchemy import event, func
+from . import db
+from .models import ArchivedVideo, Video, User, VideoChange
+from .serializers import VIDEO_METADATA_COLUMNS, video_metadata_query, serialize_row, dumps
+
+# Change feed for catalog mirrors.
+#
+# Every insert, update and delete of a Video appends a row to `video_changes` on the same
+# connection, so the log commits atomically with the write. Consumers page through it by
+# `seq`, which only ever grows.
+#
+# Sequence values (and `changed_at`) are handed out at insert time, so a slow transaction can
+# commit a lower seq after a higher one is already visible, and a mirror that had moved past the
+# higher one would never see it. The feed therefore stops short of any change younger than
+# CHANGE_FEED_SETTLE_SECONDS: every write transaction shorter than that has committed by the
+# time the feed hands out a cursor beyond it. Changes show up that much later in exchange.
+
+FEED_BATCH_SIZE = 500
+FEED_MAX_LIMIT = 10000
+FEED_SETTLE_SECONDS = 5.0
+
+def _log_change(connection, target, deleted=False):
+    connection.execute(VideoChange.__table__.insert().values(
+        video_id=target.id, user_id=target.user_id, deleted=deleted, changed_at=datetime.datetime.utcnow()))
+
+def _after_insert(mapper, connection, target):
+    _log_change(connection, target)
+
+def _after_update(mapper, connection, target):
+    _log_change(connection, target)
+
+def _after_delete(mapper, connection, target):
+    _log_change(connection, target, deleted=True)
+
+def register_change_hooks(video_model):
+    for name, listener in (('after_insert', _after_insert), ('after_update', _after_update), ('after_delete', _after_delete)):
+        if not event.contains(video_model, name, listener):
+            event.listen(video_model, name, listener)
+
+def _settled_horizon(cursor, settle_seconds):
+    """The lowest seq past `cursor` that is too recent to hand out, or None."""
+    if settle_seconds <= 0:
+        return None
+    settled_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=settle_seconds)
+    return db.session.query(func.min(VideoChange.seq)) \
+        .filter(VideoChange.seq > cursor, VideoChange.changed_at > settled_before).scalar()
+
+def iter_changes(since, limit, batch_size=None, settle_seconds=None):
+    """Yield NDJSON lines for settled changes with `seq > since`, at most `limit` of them.
+
+    Rows are read in batches of `batch_size`, so memory stays bounded by the batch rather than
+    the size of the backlog. Only the newest change per video within a batch is emitted.
+    """
+    batch_size = batch_size or FEED_BATCH_SIZE
+    settle_seconds = FEED_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+    fields = list(VIDEO_METADATA_COLUMNS)
+    columns = [VIDEO_METADATA_COLUMNS[name].label(name) for name in fields]
+    remaining = limit
+    cursor = since
+    horizon = _settled_horizon(cursor, settle_seconds)
+    while remaining > 0:
+        query = db.session.query(VideoChange.seq, VideoChange.video_id, VideoChange.deleted, *columns) \
+            .select_from(VideoChange) \
+            .outerjoin(Video, Video.id == VideoChange.video_id) \
+            .outerjoin(User, User.id == Video.user_id) \
+            .filter(VideoChange.seq > cursor)
+        if horizon is not None:
+            query = query.filter(VideoChange.seq < horizon)
+        batch = query.order_by(VideoChange.seq).limit(min(batch_size, remaining)).all()
+        if not batch:
+            return
+        latest = {}
+        for row in batch:
+            latest[row[1]] = row # Later rows overwrite earlier ones for the same video
+        # Videos missing from `videos` may just have been archived; look those up in one query
+        unseen = [row[1] for row in latest.values() if not row[2] and row[3] is None]
+        archived = {}
+        if unseen:
+            archived = {row[0]: row for row in video_metadata_query(fields, ArchivedVideo)
+                        .filter(ArchivedVideo.id.in_(unseen))}
+        for row in batch:
+            seq, video_id, deleted = row[0], row[1], row[2]
+            if latest[video_id] is not row:
+                continue
+            metadata = row[3:] if row[3] is not None else archived.get(video_id, row[3:])
+            if deleted or metadata[0] is None: # Deleted, or the row is gone from `videos` and the archive
+                yield dumps({"seq": seq, "op": "delete", "id": video_id}) + b'\n'
+            else:
+                yield dumps({"seq": seq, "op": "upsert", "video": serialize_row(metadata, fields)}) + b'\n'
+        cursor = batch[-1][0]
+        remaining -= len(batch)
+        # Don't hold the transaction (and its snapshot) open between batches
+        db.session.rollback()
+        if len(batch) < batch_size:
+            return
@@ -0,0 +1,85 @@
+import os
+from sqlalchemy import event
+
+# Database engine tuning profiles.
+#
+# SQLite: pragmas applied to every new DBAPI connection. WAL lets readers run alongside the
+# single writer and makes commits an append to the log instead of a rollback-journal rewrite;
+# busy_timeout makes concurrent writers wait for the lock instead of failing immediately.
+#
+# PostgreSQL: connection pool sizing passed through SQLALCHEMY_ENGINE_OPTIONS.
+
+SQLITE_PROFILES = {
+    # SQLite's own defaults: rollback journal, full fsync on every commit, no lock wait
+    'default': {},
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL', # Durable across app crashes; only an OS crash can lose the last commits
+        'busy_timeout': 5000, # ms
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -16000, # Negative means KiB, i.e. 16 MB of page cache per connection
+        'temp_store': 'MEMORY',
+    },
+}
+
+POSTGRES_PROFILES = {
+    'default': {},
+    'tuned': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10, # Seconds to wait for a pooled connection before erroring
+        'pool_recycle': 1800, # Recycle before server/proxy idle timeouts kill the connection
+        'pool_pre_ping': True,
+    },
+}
+
+# Environment overrides for the PostgreSQL pool, applied on top of the profile
+POOL_ENV_OVERRIDES = {
+    'pool_size': ('DB_POOL_SIZE', int),
+    'max_overflow': ('DB_MAX_OVERFLOW', int),
+    'pool_timeout': ('DB_POOL_TIMEOUT', int),
+    'pool_recycle': ('DB_POOL_RECYCLE', int),
+    'pool_pre_ping': ('DB_POOL_PRE_PING', lambda value: value.lower() in ('1', 'true', 'yes')),
+}
+
+def is_sqlite(url):
+    return str(url).startswith('sqlite')
+
+def is_postgres(url):
+    return str(url).startswith(('postgresql', 'postgres'))
+
+def postgres_engine_options(profile):
+    options = dict(POSTGRES_PROFILES[profile])
+    for option, (env_name, convert) in POOL_ENV_OVERRIDES.items():
+        if os.environ.get(env_name):
+            options[option] = convert(os.environ[env_name])
+    return options
+
+def configure_engine_options(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS for the selected profile. Call before db.init_app."""
+    profile = app.config.get('DB_PROFILE', 'tuned')
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE: {profile}")
+    if is_postgres(app.config['SQLALCHEMY_DATABASE_URI']):
+        options = postgres_engine_options(profile)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+def apply_sqlite_pragmas(engine, profile):
+    pragmas = SQLITE_PROFILES[profile]
+    if not pragmas or not is_sqlite(engine.url):
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+def apply_engine_profile(app, engines):
+    """Attach connect-time hooks to already-created engines. Call after db.init_app."""
+    profile = app.config.get('DB_PROFILE', 'tuned')
+    for engine in engines:
+        apply_sqlite_pragmas(engine, profile)
@@ -0,0 +1,102 @@
+import csv
+import io
+import sys
+import time
+import zlib
+import click
+from flask.cli import AppGroup
+from .models import ArchivedVideo, Video
+from .serializers import parse_fields, video_metadata_query, serialize_row, dumps
+from .sharding import on_shard, video_binds
+
+# Streaming export of the whole video catalog.
+#
+# Rows are pulled with yield_per (a server-side cursor on PostgreSQL), encoded one at a time
+# and flushed in fixed-size chunks, so memory use does not depend on the number of rows.
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_YIELD_PER = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def iter_export_rows(fields, yield_per=None):
+    # One shard after another, hot rows then archived ones (in id order within each)
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            for model in (Video, ArchivedVideo):
+                query = video_metadata_query(fields, model).order_by(model.id)
+                for row in query.yield_per(yield_per or EXPORT_YIELD_PER):
+                    yield serialize_row(row, fields)
+
+def _encode_ndjson(rows, fields):
+    for row in rows:
+        yield dumps(row) + b'\n'
+
+def _encode_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(['' if row[name] is None else row[name] for name in fields])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def iter_export(fields, fmt='ndjson', compress=False, chunk_size=None):
+    """Yield the encoded (and optionally gzipped) export in chunks of about `chunk_size` bytes."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    encode = _encode_csv if fmt == 'csv' else _encode_ndjson
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None # wbits=31 writes a gzip header
+
+    pending = []
+    pending_size = 0
+    for piece in encode(iter_export_rows(fields), fields):
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= chunk_size:
+            data = b''.join(pending)
+            pending, pending_size = [], 0
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = b''.join(pending)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+# --- CLI ---
+
+export_cli = AppGroup('export', help='Export catalog data.')
+
+@export_cli.command('videos')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='ndjson', show_default=True)
+@click.option('--fields', default=None, help='Comma-separated metadata fields (default: all).')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Output file (default: stdout).')
+def export_videos_command(fmt, fields, compress, output):
+    """Stream every video's metadata as NDJSON or CSV."""
+    try:
+        fields = parse_fields(fields)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--fields')
+
+    out = open(output, 'wb') if output else sys.stdout.buffer
+    written = 0
+    started = time.monotonic()
+    try:
+        for chunk in iter_export(fields, fmt, compress):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+    click.echo(f"Exported {written} bytes in {time.monotonic() - started:.1f}s", err=True)
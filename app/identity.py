@@ -0,0 +1,146 @@
+import datetime
+import json
+import os
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from . import db
+from .cache import LRUBackend, SQLiteBackend
+from .models import User
+from .serializers import dumps
+
+# Identity cache for request authentication.
+#
+# Every JWT request resolves its user in user_lookup_callback and every session request in
+# load_user. Both go through identity_cache.get_user, which keeps the user's columns (never
+# the password hash) under a versioned key with a TTL. Any committed insert, update or delete
+# of the User row bumps its version, so the next lookup misses. With the per-process LRU
+# backend other workers only notice the bump once their copy expires, which is what
+# IDENTITY_CACHE_TTL_SECONDS bounds; the SQLite backend shares versions across workers.
+#
+# Cached users come back as instances merged into db.session without a query, so lazy
+# attributes (videos, password_hash) still load on demand.
+
+CACHED_COLUMNS = ('id', 'username', 'email', 'created_at')
+
+class IdentityCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 60.0
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('IDENTITY_CACHE_BACKEND', 'lru')
+        max_bytes = app.config.get('IDENTITY_CACHE_MAX_BYTES', 1024 * 1024)
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL_SECONDS', 60.0)
+        if backend == 'lru':
+            self.backend = LRUBackend(max_bytes, ttl=self.ttl)
+        elif backend == 'sqlite':
+            path = app.config.get('IDENTITY_CACHE_PATH') or os.path.join(app.instance_path, 'identity_cache.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path, max_bytes)
+        elif backend == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown IDENTITY_CACHE_BACKEND: {backend}")
+        self._reset_stats()
+        app.extensions['identity_cache'] = self
+
+    def _reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.query_seconds = 0.0 # Time spent loading users on misses
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _key(self, user_id):
+        return f"identity:{user_id}:v{self.backend.version(f'identity:{user_id}')}"
+
+    def get_user(self, user_id):
+        """Return the User with this ID (or None), from the cache when possible."""
+        if not self.enabled:
+            return db.session.get(User, user_id)
+        key = self._key(user_id)
+        raw = self.backend.get(key)
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry['expires'] > time.time():
+                self.hits += 1
+                return self._attach(entry['user'])
+        self.misses += 1
+        started = time.perf_counter()
+        user = db.session.get(User, user_id)
+        self.query_seconds += time.perf_counter() - started
+        if user is not None:
+            values = {name: getattr(user, name) for name in CACHED_COLUMNS}
+            values['created_at'] = values['created_at'].isoformat() if values['created_at'] else None
+            self.backend.set(key, dumps({"expires": time.time() + self.ttl, "user": values}))
+        return user
+
+    def _attach(self, values):
+        user = User.__mapper__.class_manager.new_instance()
+        for name in CACHED_COLUMNS:
+            value = values[name]
+            if name == 'created_at' and value is not None:
+                value = datetime.datetime.fromisoformat(value)
+            set_committed_value(user, name, value)
+        make_transient_to_detached(user)
+        # load=False trusts the cached state instead of re-selecting it; the session returns its
+        # own instance if this user is already loaded
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        if self.enabled:
+            self.backend.bump(f'identity:{user_id}')
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+        self._reset_stats()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        average_query = self.query_seconds / self.misses if self.misses else 0.0
+        return {
+            "backend": type(self.backend).__name__ if self.enabled else None,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "avg_query_ms": average_query * 1000,
+            # Estimate: each hit skipped one lookup costing the average miss
+            "saved_query_ms": self.hits * average_query * 1000,
+        }
+
+
+identity_cache = IdentityCache()
+
+
+# --- Invalidation ---
+# Like the metadata cache: User writes are recorded at flush and applied once they commit.
+# Inserts count too, because SQLite can hand a deleted user's ID to the next signup.
+
+def _record_user_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('identity_cache_dirty', set()).add(target.id)
+
+def _apply_invalidations(session):
+    for user_id in session.info.pop('identity_cache_dirty', ()):
+        identity_cache.invalidate(user_id)
+
+def _discard_invalidations(session):
+    session.info.pop('identity_cache_dirty', None)
+
+def register_identity_hooks():
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        if not event.contains(User, name, _record_user_write):
+            event.listen(User, name, _record_user_write)
+    if not event.contains(Session, 'after_commit', _apply_invalidations):
+        event.listen(Session, 'after_commit', _apply_invalidations)
+        event.listen(Session, 'after_rollback', _discard_invalidations)
@@ -1,5 +1,5 @@
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from .passwords import password_hasher
 import datetime
 from flask_login import UserMixin # Added
 
@@ -18,10 +18,10 @@ class User(db.Model, UserMixin): # Added UserMixin
         self.set_password(password)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password) # May raise PasswordHashingBusy
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -43,6 +43,13 @@ class Video(db.Model):
     file_path = db.Column(db.String(512), nullable=False)
     total_size = db.Column(db.BigInteger, nullable=True) # Total size of the video in bytes
     is_processed = db.Column(db.Boolean, default=False) # Flag to indicate if video processing (encoding) is done
+    # Storage integrity (see app/storage.py): SHA-256 of the stored file and the scrubber's last verdict
+    content_digest = db.Column(db.String(64), nullable=True)
+    integrity_status = db.Column(db.String(16), nullable=True) # 'ok', 'missing', 'size_mismatch' or 'corrupt'
+    verified_at = db.Column(db.DateTime, nullable=True)
+    # Sampled streaming statistics for storage tiering (see app/tiering.py)
+    last_accessed_at = db.Column(db.DateTime, nullable=True)
+    access_count = db.Column(db.BigInteger, default=0, nullable=True)
     # Future fields for chunking:
     # upload_id = db.Column(db.String(100), nullable=True, unique=True) # Unique ID for this upload session
     # total_chunks = db.Column(db.Integer, nullable=True)
@@ -51,3 +58,102 @@ class Video(db.Model):
 
     def __repr__(self):
         return f'<Video {self.title}>'
+
+# Serves "a user's videos, newest first" (get_user_videos, my_videos) as an index range scan
+# with no sort step; `id` makes the order total and lets keyset pagination use it too.
+db.Index('ix_videos_user_id_created_at', Video.user_id, Video.created_at.desc(), Video.id)
+# Path-ordered scans for `flask storage reconcile`, and its exact lookups
+db.Index('ix_videos_file_path', Video.file_path)
+
+class ArchivedVideo(db.Model):
+    # Old, processed videos moved out of `videos` by the archival job (app/archive.py).
+    # Same columns and IDs as Video, so reads can fall back here when the hot table misses.
+    __tablename__ = 'videos_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    filename = db.Column(db.String(200), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    file_path = db.Column(db.String(512), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=True)
+    is_processed = db.Column(db.Boolean, default=True)
+    content_digest = db.Column(db.String(64), nullable=True)
+    integrity_status = db.Column(db.String(16), nullable=True)
+    verified_at = db.Column(db.DateTime, nullable=True)
+    last_accessed_at = db.Column(db.DateTime, nullable=True)
+    access_count = db.Column(db.BigInteger, default=0, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedVideo {self.title}>'
+
+db.Index('ix_videos_archive_user_id_created_at', ArchivedVideo.user_id, ArchivedVideo.created_at.desc(), ArchivedVideo.id)
+db.Index('ix_videos_archive_file_path', ArchivedVideo.file_path)
+
+class VideoChange(db.Model):
+    # Append-only log of video writes; `seq` is the cursor for the change feed
+    __tablename__ = 'video_changes'
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    video_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, default=False, nullable=False) # Tombstone for a removed video
+    changed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<VideoChange {self.seq} video={self.video_id}>'
+
+class VideoTombstone(db.Model):
+    # A deleted video whose files are still on disk. Written in the same transaction that
+    # deletes the Video row; `flask storage reclaim` removes the files and then this row.
+    __tablename__ = 'video_tombstones'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    video_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    file_path = db.Column(db.String(512), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<VideoTombstone video={self.video_id}>'
+
+class UserStats(db.Model):
+    # Per-user usage counters, maintained in the same transaction as every Video write
+    # (see app/stats.py) so quota checks never have to aggregate over `videos`.
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    video_count = db.Column(db.Integer, default=0, nullable=False)
+    total_bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    processed_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UserStats user={self.user_id} videos={self.video_count}>'
+
+class UserShard(db.Model):
+    # Shard directory (primary database only): which video shard holds a user's rows
+    __tablename__ = 'user_shards'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    bind_key = db.Column(db.String(64), nullable=False)
+    moving = db.Column(db.Boolean, default=False, nullable=False) # Writes are paused while a rebalance cuts over
+
+    def __repr__(self):
+        return f'<UserShard user={self.user_id} {self.bind_key}>'
+
+class VideoIdAllocation(db.Model):
+    # Hands out video IDs that are unique across all shards (primary database only)
+    __tablename__ = 'video_id_allocations'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+class RevokedToken(db.Model):
+    # Revoked JWT access tokens (see app/revocation.py); `id` is the cursor workers sync from
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False, index=True) # Syncs re-read recent rows
+    expires_at = db.Column(db.DateTime, nullable=True, index=True) # When the token would have expired anyway
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
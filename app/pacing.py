@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import deque
+from functools import partial
+from werkzeug.wsgi import ClosingIterator
+
+# Bandwidth shaping for video streams.
+#
+# stream_video sends every response body (whole files and byte ranges alike) through
+# `stream_pacer.pace()`. With STREAM_PACING on, it holds each chunk back until three token
+# buckets allow it:
+#
+#   - one per connection: a burst of STREAM_BURST_SECONDS of video goes out at once so playback
+#     starts fast, then the stream is paced to STREAM_PACE_FACTOR x the video's bitrate, enough
+#     to keep the player's buffer growing and no more;
+#   - one per user, shared by all of their streams (STREAM_USER_MAX_BYTES_PER_SECOND), so
+#     opening many connections or re-requesting ranges doesn't buy extra bandwidth;
+#   - one for the whole process (STREAM_MAX_EGRESS_BYTES_PER_SECOND), the egress ceiling.
+#
+# The buckets let their balance go negative: a chunk is charged up front and its sender sleeps
+# off the debt, so concurrent streams sharing a bucket queue behind one another in order.
+#
+# Sleeping happens in the response generator, so a paced stream holds the thread serving it for
+# the whole transfer. Pacing is meant for threaded or async workers (gunicorn `gthread` with
+# enough `--threads`, or `gevent`); a sync worker serves nothing else while it paces. At most
+# STREAM_MAX_PACED_STREAMS paced streams are open per process; further streams are rejected with
+# PacingBusy (503) instead of tying up the remaining threads. Keep it below the threads per process.
+#
+# Videos have no recorded bitrate, so STREAM_BITRATE_BPS stands in for it. All limits are per
+# app process; divide the host's ceiling by the number of workers. Egress is metered whether or
+# not pacing (or the block cache) is on (`/videos/stream/pacing/stats`).
+
+PACE_CHUNK_SIZE = 64 * 1024 # Largest piece sent between bucket checks
+EGRESS_WINDOW_SECONDS = 10 # Span the current egress rate is averaged over
+PACING_RETRY_AFTER_SECONDS = 5
+
+class PacingBusy(Exception):
+    """Raised when STREAM_MAX_PACED_STREAMS paced streams are already open."""
+
+
+class TokenBucket:
+    """`rate` bytes per second, of which up to `burst` bytes can be spent at once (no limit when falsy)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, nbytes, now):
+        """Charge `nbytes` and return how many seconds to wait before sending them."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_full(self, now):
+        return not self.rate or self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class StreamPacer:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.bitrate = 8_000_000
+        self.pace_factor = 1.5
+        self.burst_seconds = 10.0
+        self.user_rate = 0
+        self.max_egress = 0
+        self.max_paced = 16
+        self._users = {} # user ID -> [TokenBucket, open streams]
+        self._egress = TokenBucket(0, 0)
+        self._window = deque() # [second, bytes sent in it]
+        self._lock = threading.Lock()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('STREAM_PACING', False)
+        self.bitrate = app.config.get('STREAM_BITRATE_BPS', 8_000_000)
+        self.pace_factor = app.config.get('STREAM_PACE_FACTOR', 1.5)
+        self.burst_seconds = app.config.get('STREAM_BURST_SECONDS', 10.0)
+        self.user_rate = app.config.get('STREAM_USER_MAX_BYTES_PER_SECOND', 4 * 1024 * 1024)
+        self.max_egress = app.config.get('STREAM_MAX_EGRESS_BYTES_PER_SECOND', 0)
+        self.max_paced = app.config.get('STREAM_MAX_PACED_STREAMS', 16)
+        self.clear()
+        app.extensions['stream_pacer'] = self
+
+    def _reset_stats(self):
+        self.streams = 0
+        self.active = 0
+        self.paced = 0 # Open streams holding a paced slot
+        self.rejected = 0
+        self.bytes_sent = 0
+        self.paced_seconds = 0.0 # Total time streams spent waiting for their buckets
+
+    def connection_rate(self, bitrate=None):
+        return (bitrate or self.bitrate) / 8 * self.pace_factor
+
+    def _user_bucket(self, user_id, now):
+        with self._lock:
+            for idle in [u for u, (bucket, open_streams) in self._users.items() if not open_streams and bucket.is_full(now)]:
+                del self._users[idle] # Dropped only once full again, so reconnecting earns no new burst
+            entry = self._users.setdefault(user_id, [TokenBucket(self.user_rate, self.user_rate * self.burst_seconds), 0])
+            entry[1] += 1
+            return entry
+
+    def _meter(self, nbytes, now):
+        second = int(now)
+        with self._lock:
+            self.bytes_sent += nbytes
+            if self._window and self._window[-1][0] == second:
+                self._window[-1][1] += nbytes
+            else:
+                self._window.append([second, nbytes])
+            while self._window[0][0] <= second - EGRESS_WINDOW_SECONDS:
+                self._window.popleft()
+
+    def egress_rate(self):
+        """Bytes per second sent over the last EGRESS_WINDOW_SECONDS."""
+        horizon = int(time.monotonic()) - EGRESS_WINDOW_SECONDS
+        with self._lock:
+            return sum(nbytes for second, nbytes in self._window if second > horizon) / EGRESS_WINDOW_SECONDS
+
+    def pace(self, body, user_id, bitrate=None):
+        """Return an iterable of the chunks of `body`, metered, and paced when STREAM_PACING is on.
+
+        Raises PacingBusy if pacing would take one stream too many; the slot is given back when
+        the returned iterable is closed, as the WSGI server does once the response is done.
+        """
+        if not self.enabled:
+            return self._send(body, [])
+        with self._lock:
+            if self.max_paced and self.paced >= self.max_paced:
+                self.rejected += 1
+                raise PacingBusy()
+            self.paced += 1
+        rate = self.connection_rate(bitrate)
+        user = self._user_bucket(user_id, time.monotonic())
+        buckets = [TokenBucket(rate, rate * self.burst_seconds), user[0], self._egress]
+        return ClosingIterator(self._send(body, buckets), partial(self._release, user))
+
+    def _release(self, user):
+        with self._lock:
+            self.paced -= 1
+            user[1] -= 1
+
+    def _send(self, body, buckets):
+        with self._lock:
+            self.streams += 1
+            self.active += 1
+        try:
+            for chunk in body:
+                step = PACE_CHUNK_SIZE if buckets else max(len(chunk), 1)
+                for offset in range(0, len(chunk), step):
+                    piece = chunk[offset:offset + step]
+                    now = time.monotonic()
+                    delay = max((bucket.take(len(piece), now) for bucket in buckets), default=0.0)
+                    if delay > 0:
+                        with self._lock:
+                            self.paced_seconds += delay
+                        time.sleep(delay)
+                    self._meter(len(piece), time.monotonic())
+                    yield piece
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def clear(self):
+        with self._lock:
+            self._users = {}
+            self._window.clear()
+            self._egress = TokenBucket(self.max_egress, self.max_egress) # At most one second's worth at once
+        self._reset_stats()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "connection_bytes_per_second": self.connection_rate() if self.enabled else None,
+            "user_max_bytes_per_second": self.user_rate if self.enabled else None,
+            "max_egress_bytes_per_second": self.max_egress if self.enabled else None,
+            "egress_bytes_per_second": self.egress_rate(),
+            "bytes_sent": self.bytes_sent,
+            "streams": self.streams,
+            "active_streams": self.active,
+            "paced_streams": self.paced,
+            "max_paced_streams": self.max_paced if self.enabled else None,
+            "rejected_streams": self.rejected,
+            "paced_seconds": self.paced_seconds,
+        }
+
+
+stream_pacer = StreamPacer()
@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing off the request workers.
+#
+# scrypt/PBKDF2 cost tens of milliseconds of pure CPU per call. Running them inline lets a
+# burst of logins occupy every request worker, so they run on a small process pool instead.
+# Admission is bounded: at most PASSWORD_HASH_WORKERS hashes run and PASSWORD_HASH_QUEUE_SIZE
+# wait; anything beyond that is rejected immediately with PasswordHashingBusy (503), rather
+# than queueing until every client has timed out.
+#
+# With PASSWORD_HASH_WORKERS=0 hashing runs inline (still admission-controlled), which is
+# what CLI commands and tests without a pool want.
+
+LATENCY_SAMPLES = 1000 # Most recent calls kept for the latency percentiles
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+def _run(operation, args):
+    # Executed in a pool process; returns the result and the time spent hashing
+    started = time.perf_counter()
+    result = generate_password_hash(*args) if operation == 'hash' else check_password_hash(*args)
+    return result, time.perf_counter() - started
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.method = 'scrypt'
+        self.workers = 0
+        self.queue_size = 0
+        self.timeout = 10.0
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        self.queue_size = app.config.get('PASSWORD_HASH_QUEUE_SIZE', 16)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10.0)
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._prefix = None
+        self._reset_stats()
+        app.extensions['password_hasher'] = self
+
+    def _reset_stats(self):
+        self.calls = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.rehashed = 0
+        self._hash_times = deque(maxlen=LATENCY_SAMPLES)
+        self._wait_times = deque(maxlen=LATENCY_SAMPLES)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: never fork a worker that holds copies of the app's locks and DB connections
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _call(self, operation, args):
+        if self._slots is None: # Not initialised (e.g. models used outside an app): plain inline call
+            return _run(operation, args)[0]
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHashingBusy()
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            if self.workers > 0:
+                try:
+                    result, hash_seconds = self._get_pool().submit(_run, operation, args).result(timeout=self.timeout)
+                except BrokenProcessPool: # A worker died (e.g. OOM-killed); start a fresh pool next time
+                    self.shutdown()
+                    raise PasswordHashingBusy()
+                except FutureTimeout:
+                    raise PasswordHashingBusy()
+            else:
+                result, hash_seconds = _run(operation, args)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+        self.calls += 1
+        self._hash_times.append(hash_seconds)
+        self._wait_times.append(time.perf_counter() - started - hash_seconds)
+        return result
+
+    def hash(self, password):
+        return self._call('hash', (password, self.method))
+
+    def verify(self, password_hash, password):
+        return self._call('verify', (password_hash, password))
+
+    @property
+    def prefix(self):
+        """The parameter part of hashes made with the current settings, e.g. `scrypt:32768:8:1`."""
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method, salt_length=1).split('$', 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def stats(self):
+        def percentiles(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+            pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+            return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": ordered[-1] * 1000}
+        return {
+            "method": self.prefix,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "hash": percentiles(self._hash_times),
+            "queue_wait": percentiles(self._wait_times),
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+def default_workers():
+    # Leave most cores to the request workers; hashing only needs to keep up with logins
+    return max(1, (os.cpu_count() or 2) // 4)
@@ -0,0 +1,197 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from flask import current_app, jsonify, request, session as flask_session
+from flask_jwt_extended import decode_token
+
+# Per-route rate limiting with GCRA (generic cell rate algorithm).
+#
+# A policy allows `limit` requests per `period` seconds with bursts of up to `burst`. For each
+# client key the store keeps one number, the theoretical arrival time (TAT) of the next
+# request: every allowed request pushes it forward by period/limit, and a request is refused
+# while the TAT is more than burst * period/limit ahead of now. That is a smooth sliding
+# limit with O(1) state per key and a single read-modify-write per check.
+#
+# Stores: 'memory' (default) keeps the state in the process, so each worker enforces the limit
+# on its own share of the traffic; 'sqlite' shares it between all workers on the host through a
+# small SQLite file, at the cost of a write lock per check; 'none' disables limiting. If the
+# store errors the request is allowed (fail open) and the error is counted.
+#
+# The check runs before the view and must stay cheap: `@user` keys on the subject of the bearer
+# token after only a signature check. Expiry, revocation and the user lookup are left to the
+# view, which rejects such requests anyway.
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+POLICY_RE = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*(?:burst\s*(\d+))?\s*(?:@\s*(user|ip))?\s*$')
+
+# Endpoint -> policy. `@user` keys on the authenticated user (falling back to the IP for
+# anonymous requests), `@ip` on the client address.
+DEFAULT_POLICIES = {
+    'auth.login': '10/minute burst 5 @ip',
+    'auth.signup': '5/minute @ip',
+    'videos.upload_video_route': '30/hour burst 10 @user',
+    'videos.stream_video': '120/minute burst 60 @user',
+}
+
+class Policy:
+    def __init__(self, limit, period, burst=None, key_by='user'):
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+        self.key_by = key_by
+        self.interval = period / limit # Seconds each request "costs"
+        self.tolerance = self.interval * self.burst
+
+    @classmethod
+    def parse(cls, spec, default_key_by='user'):
+        """Parse e.g. `10/minute`, `30/hour burst 10 @user` or `5/second @ip`."""
+        match = POLICY_RE.match(spec)
+        if not match:
+            raise ValueError(f"Invalid rate limit: {spec!r}")
+        limit, period, burst, key_by = match.groups()
+        return cls(int(limit), PERIODS[period], int(burst) if burst else None, key_by or default_key_by)
+
+def gcra(tat, now, policy):
+    """Return `(allowed, new_tat, retry_after)` for one request given the stored TAT."""
+    tat = max(tat or now, now)
+    new_tat = tat + policy.interval
+    if new_tat - now > policy.tolerance:
+        return False, tat, new_tat - policy.tolerance - now
+    return True, new_tat, 0.0
+
+
+class MemoryStore:
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, policy, now):
+        with self._lock:
+            allowed, tat, retry_after = gcra(self._tats.get(key), now, policy)
+            self._tats[key] = tat
+            if len(self._tats) > 100000: # Keys whose TAT has passed carry no state worth keeping
+                self._tats = {k: t for k, t in self._tats.items() if t > now}
+        return allowed, retry_after
+
+
+class SQLiteStore:
+    def __init__(self, path, timeout=0.05):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Short lock timeout: under contention we'd rather fail open than stall the request
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF") # Losing a few counters in an OS crash is fine
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, policy, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            allowed, tat, retry_after = gcra(row[0] if row else None, now, policy)
+            if allowed:
+                conn.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, tat))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % 10000 == 0:
+            conn.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+        return allowed, retry_after
+
+
+def _token_subject():
+    """The identity in the request's bearer token, if its signature is valid; None otherwise."""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        claims = decode_token(header[len('Bearer '):], allow_expired=True)
+    except Exception: # Bad token: the view will reject it; limit by address meanwhile
+        return None
+    return claims.get(current_app.config['JWT_IDENTITY_CLAIM'])
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.store = None
+        self.policies = {}
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        store = app.config.get('RATE_LIMIT_STORE', 'memory')
+        if store == 'sqlite':
+            path = app.config.get('RATE_LIMIT_PATH') or os.path.join(app.instance_path, 'rate_limits.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.store = SQLiteStore(path)
+        elif store == 'memory':
+            self.store = MemoryStore()
+        elif store == 'none':
+            self.store = None
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_STORE: {store}")
+        policies = dict(DEFAULT_POLICIES, **app.config.get('RATE_LIMITS', {}))
+        self.policies = {endpoint: Policy.parse(spec) for endpoint, spec in policies.items() if spec}
+        self._reset_stats()
+        app.extensions['rate_limiter'] = self
+        if self.check not in app.before_request_funcs.get(None, []):
+            app.before_request(self.check)
+
+    def _reset_stats(self):
+        self.allowed = 0
+        self.limited = 0
+        self.store_errors = 0
+
+    def _client_key(self, policy):
+        if policy.key_by == 'user':
+            identity = _token_subject()
+            if identity is None:
+                identity = flask_session.get('_user_id') # Flask-Login session
+            if identity is not None:
+                return f"user:{identity}"
+        return f"ip:{request.remote_addr}"
+
+    def check(self):
+        """before_request hook: answer 429 when the endpoint's policy is exhausted."""
+        policy = self.policies.get(request.endpoint)
+        if policy is None or self.store is None:
+            return None
+        key = f"{request.endpoint}:{self._client_key(policy)}"
+        try:
+            allowed, retry_after = self.store.hit(key, policy, time.time())
+        except Exception as e:
+            self.store_errors += 1
+            current_app.logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return None
+        if allowed:
+            self.allowed += 1
+            return None
+        self.limited += 1
+        return jsonify({"msg": "Too many requests, please slow down"}), 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+    def stats(self):
+        return {
+            "store": type(self.store).__name__ if self.store else None,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "store_errors": self.store_errors,
+        }
+
+
+rate_limiter = RateLimiter()
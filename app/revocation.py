@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import math
+import threading
+import time
+from sqlalchemy import delete, or_, select
+from . import db
+from .models import RevokedToken
+
+# JWT revocation.
+#
+# Revoked tokens are stored in `revoked_tokens` until they would have expired. Checking that
+# table on every @jwt_required() request would add a query to all of them, so each worker
+# keeps a Bloom filter of the revoked JTIs: a token the filter has never seen is accepted
+# with no I/O, and only a possible match (a revoked token, or a rare false positive) is
+# confirmed with an exact lookup.
+#
+# Workers pick up each other's revocations by reading rows past their last-seen `id` at most
+# every JWT_REVOCATION_SYNC_SECONDS, so a revocation can take that long to apply everywhere.
+# IDs are handed out before commit, so a revocation can become visible after a higher ID
+# already has; each sync therefore also re-reads the rows revoked in the last
+# JWT_REVOCATION_SYNC_OVERLAP_SECONDS, which covers any transaction shorter than that.
+# Bloom filters cannot forget, so the filter is rebuilt from the unexpired rows once per
+# access-token lifetime, which is also when expired rows are deleted.
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)) # bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        if item in self: # Re-read by an overlapping sync; don't count it twice
+            return
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenDenylist:
+    def __init__(self, app=None):
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.sync_interval = 1.0
+        self.sync_overlap = 60.0
+        self.rebuild_interval = 900.0
+        self._lock = threading.Lock()
+        self._filter = None
+        self._cursor = 0
+        self._synced_at = None
+        self._built_at = None
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.capacity = app.config.get('JWT_REVOCATION_BLOOM_CAPACITY', 100000)
+        self.error_rate = app.config.get('JWT_REVOCATION_BLOOM_ERROR_RATE', 0.001)
+        self.sync_interval = app.config.get('JWT_REVOCATION_SYNC_SECONDS', 1.0)
+        self.sync_overlap = app.config.get('JWT_REVOCATION_SYNC_OVERLAP_SECONDS', 60.0)
+        lifetime = app.config.get('JWT_ACCESS_TOKEN_EXPIRES')
+        self.rebuild_interval = lifetime.total_seconds() if isinstance(lifetime, datetime.timedelta) else 3600.0
+        self._filter = None
+        self._reset_stats()
+        app.extensions['token_denylist'] = self
+
+    def _reset_stats(self):
+        self.checks = 0
+        self.possible_matches = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.rebuilds = 0
+
+    # --- Filter maintenance ---
+
+    def _load(self, bloom, since_id, now, revoked_since=None):
+        # Straight to the primary: a lagging replica would hide fresh revocations
+        table = RevokedToken.__table__
+        newer = table.c.id > since_id
+        if revoked_since is not None:
+            newer = or_(newer, table.c.revoked_at >= revoked_since)
+        with db.engines[None].connect() as connection:
+            rows = connection.execute(select(table.c.id, table.c.jti).where(
+                newer, or_(table.c.expires_at.is_(None), table.c.expires_at > now))
+                .order_by(table.c.id)).all()
+        for _, jti in rows:
+            bloom.add(jti)
+        return max(since_id, rows[-1][0]) if rows else since_id
+
+    def _rebuild(self):
+        capacity = self.capacity
+        if self._filter is not None and self._filter.count > capacity:
+            capacity = self._filter.count * 2 # More revocations than planned for: keep the error rate down
+        bloom = BloomFilter(capacity, self.error_rate)
+        now = datetime.datetime.utcnow()
+        with db.engines[None].begin() as connection:
+            connection.execute(delete(RevokedToken.__table__).where(RevokedToken.__table__.c.expires_at <= now))
+        self._cursor = self._load(bloom, 0, now)
+        self._filter = bloom
+        self._built_at = self._synced_at = time.monotonic()
+        self.rebuilds += 1
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._filter is not None and now - self._synced_at < self.sync_interval:
+            return # Hot path: nothing to do between syncs
+        with self._lock:
+            if self._filter is None or now - self._built_at >= self.rebuild_interval \
+                    or self._filter.count > self._filter.capacity:
+                self._rebuild()
+            elif now - self._synced_at >= self.sync_interval:
+                utcnow = datetime.datetime.utcnow()
+                self._cursor = self._load(self._filter, self._cursor, utcnow,
+                                          utcnow - datetime.timedelta(seconds=self.sync_overlap))
+                self._synced_at = now
+                self.syncs += 1
+
+    # --- API ---
+
+    def is_revoked(self, jwt_payload):
+        self.checks += 1
+        self._refresh()
+        jti = jwt_payload['jti']
+        if jti not in self._filter:
+            return False
+        self.possible_matches += 1
+        with db.engines[None].connect() as connection:
+            revoked = connection.execute(select(RevokedToken.id).where(RevokedToken.jti == jti)).first() is not None
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    def revoke(self, jwt_payload):
+        """Revoke the token with this payload. Takes effect in this worker immediately."""
+        expires = jwt_payload.get('exp')
+        table = RevokedToken.__table__
+        with db.engines[None].begin() as connection:
+            exists = connection.execute(select(table.c.id).where(table.c.jti == jwt_payload['jti'])).first()
+            if exists is None:
+                connection.execute(table.insert().values(
+                    jti=jwt_payload['jti'], user_id=int(jwt_payload['sub']) if jwt_payload.get('sub') else None,
+                    revoked_at=datetime.datetime.utcnow(),
+                    expires_at=datetime.datetime.utcfromtimestamp(expires) if expires else None))
+        self._refresh()
+        with self._lock:
+            self._filter.add(jwt_payload['jti'])
+
+    def clear(self):
+        """Forget the filter and sync cursor; the next check rebuilds from the table."""
+        with self._lock:
+            self._filter = None
+            self._cursor = 0
+        self._reset_stats()
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            "checks": self.checks,
+            "possible_matches": self.possible_matches,
+            "false_positives": self.false_positives,
+            "entries": bloom.count if bloom else 0,
+            "filter_bytes": len(bloom.bits) if bloom else 0,
+            "hash_functions": bloom.hashes if bloom else 0,
+            "syncs": self.syncs,
+            "rebuilds": self.rebuilds,
+        }
+
+
+token_denylist = TokenDenylist()
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user # Added current_user
 from app.models import Video # Import Video model
 from app import db # Import db instance if needed for complex queries, not for simple filter_by
+from app.sharding import on_user_shard
 
 frontend_bp = Blueprint('frontend', __name__)
 
@@ -14,5 +15,6 @@ def index():
 @frontend_bp.route('/my-videos')
 @login_required
 def my_videos():
-    user_videos = Video.query.filter_by(user_id=current_user.id).order_by(Video.created_at.desc()).all()
-    return render_template('videos.html', videos=user_videos, title="My Videos")
+    with on_user_shard(current_user.id):
+        user_videos = Video.query.filter_by(user_id=current_user.id).order_by(Video.created_at.desc()).all()
+        return render_template('videos.html', videos=user_videos, title="My Videos")
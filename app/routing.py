@@ -0,0 +1,173 @@
+import random
+import threading
+import time
+from flask import current_app, has_request_context, request, session as flask_session
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+# Read/write splitting.
+#
+# Replica URLs are registered as Flask-SQLAlchemy binds named `replica_<n>`. RoutingSession
+# sends a query to a replica only when all of these hold:
+#   - the request is a GET/HEAD,
+#   - this session has not written anything in the current transaction,
+#   - the requesting user has not written anything in the last REPLICA_STICKY_SECONDS
+#     (read-your-writes after an upload),
+#   - the replica's measured lag is under REPLICA_MAX_LAG_SECONDS.
+# Everything else (writes, CLI jobs, lagging or unreachable replicas) uses the primary.
+# Code that must see the primary regardless can set `db.session.info['force_primary'] = True`.
+#
+# Stickiness is tracked per worker process, so a client whose next read lands on another
+# worker can still see replica lag. Keep REPLICA_STICKY_SECONDS above the typical lag.
+
+READ_METHODS = ('GET', 'HEAD')
+
+def _request_user_id():
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError: # No JWT verified for this request (yet)
+        identity = None
+    if identity is None:
+        identity = flask_session.get('_user_id') # Flask-Login session, no query needed
+    return str(identity) if identity is not None else None
+
+def replication_lag(engine):
+    """Seconds the replica is behind its primary, 0 if it cannot lag (e.g. SQLite)."""
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as connection:
+        lag = connection.execute(text(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END")).scalar()
+    return float(lag or 0)
+
+
+class ReplicaRouter:
+    def __init__(self, bind_keys, max_lag, sticky_seconds, lag_check_interval=1.0, lag_probe=replication_lag):
+        self.bind_keys = list(bind_keys)
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.lag_check_interval = lag_check_interval
+        self.lag_probe = lag_probe
+        self._lag = {} # bind key -> (checked_at, lag or None if unreachable)
+        self._recent_writers = {} # user id -> monotonic time of their last commit
+        self._lock = threading.Lock()
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def mark_write(self, user_id):
+        if user_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._recent_writers[user_id] = now
+            if len(self._recent_writers) > 10000: # Drop expired entries now and then
+                cutoff = now - self.sticky_seconds
+                self._recent_writers = {u: t for u, t in self._recent_writers.items() if t > cutoff}
+
+    def is_sticky(self, user_id):
+        if user_id is None:
+            return False
+        wrote_at = self._recent_writers.get(user_id)
+        return wrote_at is not None and time.monotonic() - wrote_at < self.sticky_seconds
+
+    def _lag_for(self, bind_key, engine):
+        now = time.monotonic()
+        checked_at, lag = self._lag.get(bind_key, (None, None))
+        if checked_at is None or now - checked_at >= self.lag_check_interval:
+            try:
+                lag = self.lag_probe(engine)
+            except Exception as e:
+                current_app.logger.warning(f"Replica {bind_key} unavailable: {e}")
+                lag = None
+            self._lag[bind_key] = (now, lag)
+        return lag
+
+    def healthy_replicas(self, engines):
+        healthy = []
+        for bind_key in self.bind_keys:
+            lag = self._lag_for(bind_key, engines[bind_key])
+            if lag is not None and lag <= self.max_lag:
+                healthy.append(bind_key)
+        return healthy
+
+    def choose(self, session, engines, clause):
+        """Return the replica engine for this query, or None to use the primary."""
+        if not self.bind_keys or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if isinstance(clause, UpdateBase) or session._flushing or session.info.get('wrote'):
+            return None
+        bind_key = session.info.get('replica')
+        if bind_key is None:
+            if self.is_sticky(_request_user_id()):
+                self.primary_reads += 1
+                return None
+            healthy = self.healthy_replicas(engines)
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            # Pin the replica for the rest of the transaction so reads are mutually consistent
+            bind_key = session.info['replica'] = random.choice(healthy)
+            self.replica_reads += 1
+        return engines[bind_key]
+
+    def stats(self):
+        return {
+            "replicas": {key: self._lag.get(key, (None, None))[1] for key in self.bind_keys},
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # Inside sharding.on_shard() everything goes to that shard (see app/sharding.py)
+        shard = self.info.get('shard')
+        if bind is None and shard is not None:
+            return self._db.engines[shard]
+        if bind is None and not self.info.get('force_primary'):
+            router = current_app.extensions.get('replica_router')
+            if router is not None:
+                engine = router.choose(self, self._db.engines, clause)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    wrote = session.info.pop('wrote', False)
+    session.info.pop('replica', None)
+    router = current_app.extensions.get('replica_router')
+    if wrote and router is not None and has_request_context():
+        router.mark_write(_request_user_id())
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('wrote', None)
+    session.info.pop('replica', None)
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None: # Outermost transaction: the replica pin ends with it
+        session.info.pop('replica', None)
+
+
+def replica_binds(urls):
+    return {f'replica_{i}': url for i, url in enumerate(urls)}
+
+def init_replica_router(app):
+    urls = app.config.get('DATABASE_REPLICA_URLS') or []
+    if not urls:
+        app.extensions.pop('replica_router', None)
+        return None
+    router = ReplicaRouter(replica_binds(urls), max_lag=app.config['REPLICA_MAX_LAG_SECONDS'],
+                           sticky_seconds=app.config['REPLICA_STICKY_SECONDS'])
+    app.extensions['replica_router'] = router
+    return router
@@ -0,0 +1,168 @@
+import re
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, text
+from . import db
+
+# Full-text search over video titles and descriptions.
+#
+# The index lives in a side table keyed by video ID: an FTS5 virtual table on SQLite, and a
+# tsvector column with a GIN index on PostgreSQL. It is maintained from Video mapper events
+# on the same connection as the write, so it commits or rolls back together with the row.
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(title, description, tokenize='unicode61')",
+]
+POSTGRES_DDL = [
+    # No foreign key to `videos`: archived videos (videos_archive) keep their entries
+    "CREATE TABLE IF NOT EXISTS video_search ("
+    "video_id INTEGER PRIMARY KEY, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_video_search_document ON video_search USING GIN (document)",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS videos_fts"]
+POSTGRES_DROP = ["DROP TABLE IF EXISTS video_search"]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+REINDEX_BATCH_SIZE = 1000
+
+def create_search_index(connection):
+    statements = POSTGRES_DDL if connection.dialect.name == 'postgresql' else SQLITE_DDL
+    for statement in statements:
+        connection.execute(text(statement))
+
+def drop_search_index(connection):
+    statements = POSTGRES_DROP if connection.dialect.name == 'postgresql' else SQLITE_DROP
+    for statement in statements:
+        connection.execute(text(statement))
+
+def index_video(connection, video_id, title, description):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            "INSERT INTO video_search (video_id, document) "
+            "VALUES (:id, setweight(to_tsvector('english', :title), 'A') || to_tsvector('english', :description)) "
+            "ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document"),
+            {"id": video_id, "title": title or '', "description": description or ''})
+    else:
+        # FTS5 has no upsert; replace the row under the same rowid
+        connection.execute(text("DELETE FROM videos_fts WHERE rowid = :id"), {"id": video_id})
+        connection.execute(text("INSERT INTO videos_fts (rowid, title, description) VALUES (:id, :title, :description)"),
+                           {"id": video_id, "title": title or '', "description": description or ''})
+
+def unindex_video(connection, video_id):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("DELETE FROM video_search WHERE video_id = :id"), {"id": video_id})
+    else:
+        connection.execute(text("DELETE FROM videos_fts WHERE rowid = :id"), {"id": video_id})
+
+def search_video_ids(query, limit, offset):
+    """Return `(video_id, rank)` pairs for `query`, best match first.
+
+    Higher rank is better on both backends. Returns an empty list when the query has no words.
+    """
+    tokens = TOKEN_RE.findall(query or '')
+    if not tokens:
+        return []
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        rows = connection.execute(text(
+            "SELECT video_id, ts_rank(document, q) AS rank "
+            "FROM video_search, plainto_tsquery('english', :q) AS q "
+            "WHERE document @@ q ORDER BY rank DESC, video_id DESC LIMIT :limit OFFSET :offset"),
+            {"q": ' '.join(tokens), "limit": limit, "offset": offset})
+    else:
+        # Quote every token so user input can never be parsed as FTS5 query syntax;
+        # the last one is a prefix match so results show up while the user is still typing.
+        match = ' '.join(f'"{token}"' for token in tokens) + '*'
+        # bm25() is lower-is-better; the 10.0 weights title matches above description matches
+        rows = connection.execute(text(
+            "SELECT rowid, -bm25(videos_fts, 10.0, 1.0) AS rank FROM videos_fts "
+            "WHERE videos_fts MATCH :match ORDER BY rank DESC, rowid DESC LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": limit, "offset": offset})
+    return [(row[0], row[1]) for row in rows]
+
+
+def search_all_shards(query, limit, offset):
+    """`search_video_ids` across every shard, merged by rank.
+
+    Each shard returns its own top `offset + limit` hits, which is enough to cut the global
+    page out of the merged list.
+    """
+    from .sharding import on_shard, video_binds
+    binds = video_binds()
+    if len(binds) == 1:
+        with on_shard(binds[0]):
+            return search_video_ids(query, limit, offset)
+    hits = []
+    for bind_key in binds:
+        with on_shard(bind_key):
+            hits.extend(search_video_ids(query, limit + offset, 0))
+    hits.sort(key=lambda hit: (hit[1], hit[0]), reverse=True)
+    return hits[offset:offset + limit]
+
+
+# --- Incremental maintenance ---
+
+def _after_insert(mapper, connection, target):
+    index_video(connection, target.id, target.title, target.description)
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes():
+        index_video(connection, target.id, target.title, target.description)
+
+def _after_delete(mapper, connection, target):
+    unindex_video(connection, target.id)
+
+def register_search_hooks(video_model):
+    for name, listener in (('after_insert', _after_insert), ('after_update', _after_update), ('after_delete', _after_delete)):
+        if not event.contains(video_model, name, listener):
+            event.listen(video_model, name, listener)
+    # Let db.create_all()/drop_all() manage the index alongside the mapped tables
+    table = video_model.__table__
+    if not event.contains(table, 'after_create', _create_ddl):
+        event.listen(table, 'after_create', _create_ddl)
+        event.listen(table, 'before_drop', _drop_ddl)
+
+def _create_ddl(target, connection, **kw):
+    create_search_index(connection)
+
+def _drop_ddl(target, connection, **kw):
+    drop_search_index(connection)
+
+
+# --- CLI ---
+
+search_cli = AppGroup('search', help='Manage the video full-text search index.')
+
+@search_cli.command('reindex')
+@click.option('--batch-size', default=REINDEX_BATCH_SIZE, show_default=True, help='Videos indexed per transaction.')
+def reindex_command(batch_size):
+    """Build (or rebuild) the search index for every existing video."""
+    from .sharding import on_shard, video_binds
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            _reindex(batch_size, label=bind_key or 'default')
+
+def _reindex(batch_size, label):
+    from .models import Video
+    connection = db.session.connection()
+    create_search_index(connection)
+    db.session.commit()
+
+    last_id = 0
+    indexed = 0
+    while True:
+        # Keyset pagination keeps each batch an index range scan, however large the catalog
+        batch = db.session.query(Video.id, Video.title, Video.description) \
+            .filter(Video.id > last_id).order_by(Video.id).limit(batch_size).all()
+        if not batch:
+            break
+        connection = db.session.connection()
+        for video_id, title, description in batch:
+            index_video(connection, video_id, title, description)
+        db.session.commit()
+        indexed += len(batch)
+        last_id = batch[-1][0]
+        click.echo(f"[{label}] Indexed {indexed} videos")
+    click.echo(f"[{label}] Done. {indexed} videos indexed.")
@@ -0,0 +1,90 @@
+import datetime
+import json
+from flask import current_app
+from .models import Video, User
+from . import db
+
+try:
+    import orjson # Optional fast JSON encoder
+except ImportError: # pragma: no cover - exercised only when orjson is not installed
+    orjson = None
+
+# Public metadata fields, in response order, mapped to the column that backs each one.
+# Keep this in sync with format_video_metadata in videos.py.
+VIDEO_METADATA_COLUMNS = {
+    "id": Video.id,
+    "title": Video.title,
+    "description": Video.description,
+    "filename": Video.filename,
+    "file_path": Video.file_path,
+    "total_size": Video.total_size,
+    "user_id": Video.user_id,
+    "uploader_username": User.username,
+    "created_at": Video.created_at,
+    "updated_at": Video.updated_at,
+    "is_processed": Video.is_processed,
+}
+
+def parse_fields(raw_fields):
+    """Turn a `?fields=a,b,c` value into a list of field names.
+
+    Returns every field when `raw_fields` is empty. Raises ValueError naming any unknown fields.
+    """
+    if not raw_fields:
+        return list(VIDEO_METADATA_COLUMNS)
+    fields = []
+    for name in raw_fields.split(','):
+        name = name.strip()
+        if name and name not in fields:
+            fields.append(name)
+    unknown = [name for name in fields if name not in VIDEO_METADATA_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    if not fields:
+        return list(VIDEO_METADATA_COLUMNS)
+    return fields
+
+def metadata_column(model, name):
+    """The column backing field `name` on `model` (Video, or ArchivedVideo which mirrors it)."""
+    if model is Video or name == "uploader_username":
+        return VIDEO_METADATA_COLUMNS[name]
+    return getattr(model, name)
+
+def video_metadata_query(fields=None, model=Video):
+    """Build a column-projected query for the given fields.
+
+    Only the requested columns are selected, and `users` is joined in only when
+    `uploader_username` is requested, so no ORM objects or lazy loads are involved.
+    Pass `model=ArchivedVideo` to read the same fields from the archive table.
+    """
+    fields = fields or list(VIDEO_METADATA_COLUMNS)
+    columns = [metadata_column(model, name).label(name) for name in fields]
+    query = db.session.query(*columns).select_from(model)
+    if "uploader_username" in fields:
+        query = query.join(User, model.user_id == User.id)
+    return query
+
+def serialize_row(row, fields):
+    data = {}
+    for name, value in zip(fields, row):
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        data[name] = value
+    return data
+
+def serialize_rows(rows, fields):
+    return [serialize_row(row, fields) for row in rows]
+
+def dumps(payload):
+    """Encode `payload` to JSON bytes, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def json_response(payload, status=200):
+    """Like `jsonify`, but skips Flask's JSON provider in favour of the fast encoder.
+
+    `payload` may also be an already-encoded body, e.g. one served from the metadata cache.
+    """
+    body = payload if isinstance(payload, bytes) else dumps(payload)
+    return current_app.response_class(body, status=status, mimetype='application/json')
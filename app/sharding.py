@@ -0,0 +1,401 @@
+import datetime
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import case, delete, event, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from . import db
+from .models import ArchivedVideo, User, Video, VideoChange, VideoTombstone, UserStats, UserShard, VideoIdAllocation
+
+# User-ID sharding of video metadata.
+#
+# With VIDEO_SHARD_URLS set, every user's videos (and the per-video side tables: change log,
+# usage counters, search index) live on one shard bind, `shard_<n>`. The primary keeps the
+# users table, the shard directory and the global video ID allocator.
+#
+# - Routing: `on_shard(bind_key)` pins db.session to a shard for everything inside the block
+#   (see RoutingSession.get_bind). Single-user paths enter the owner's shard.
+# - Cross-user lookups by video ID run the same statement on every shard in parallel
+#   (`scatter`) and merge the results; IDs are global, so at most one shard matches.
+# - `users` is a reference table: each new user is copied to every shard after it commits,
+#   so the existing uploader joins keep working on a single shard.
+# - Placement: a user is pinned to `crc32(user_id) % N` when they sign up and stays there until
+#   `flask shards move-user` moves them, so adding shards never remaps existing users.
+#
+# Without VIDEO_SHARD_URLS none of this is active and all helpers fall back to the default bind.
+
+SHARDED_TABLES = [User.__table__, Video.__table__, ArchivedVideo.__table__, VideoChange.__table__, UserStats.__table__,
+                  VideoTombstone.__table__]
+MOVE_BATCH_SIZE = 500
+SCATTER_MAX_WORKERS = 32 # Threads shared by all scatter queries in this process
+VIDEO_TABLES = (Video.__table__, ArchivedVideo.__table__) # Hot and archived rows move together
+
+def shard_binds(urls):
+    return {f'shard_{i}': url for i, url in enumerate(urls)}
+
+
+class ShardRouter:
+    def __init__(self, bind_keys, directory_ttl):
+        self.bind_keys = list(bind_keys)
+        self.directory_ttl = directory_ttl
+        self._directory = {} # user id -> (looked_up_at, bind_key, moving)
+        self._lock = threading.Lock()
+
+    def placement_for(self, user_id):
+        return self.bind_keys[zlib.crc32(str(user_id).encode()) % len(self.bind_keys)]
+
+    def lookup(self, user_id, fresh=False):
+        """Return `(bind_key, moving)` for a user from the directory, cached for `directory_ttl`."""
+        now = time.monotonic()
+        cached = self._directory.get(user_id)
+        if cached is not None and not fresh and now - cached[0] < self.directory_ttl:
+            return cached[1], cached[2]
+        # Straight to the primary engine: the directory must never be read from a replica or shard
+        with db.engines[None].connect() as connection:
+            row = connection.execute(select(UserShard.bind_key, UserShard.moving)
+                                     .where(UserShard.user_id == user_id)).first()
+        bind_key, moving = (row[0], row[1]) if row else (self.placement_for(user_id), False)
+        with self._lock:
+            self._directory[user_id] = (now, bind_key, moving)
+        return bind_key, moving
+
+    def assign(self, user_id, bind_key, moving=False, connection=None):
+        values = {"user_id": user_id, "bind_key": bind_key, "moving": moving}
+        if connection is None:
+            with db.engines[None].begin() as connection:
+                _upsert(connection, UserShard.__table__, values, ['user_id'])
+        else:
+            _upsert(connection, UserShard.__table__, values, ['user_id'])
+        self.forget(user_id)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._directory.pop(user_id, None)
+
+
+def _router():
+    return current_app.extensions.get('shard_router')
+
+def is_sharded():
+    return _router() is not None
+
+def video_binds():
+    """Every database that holds videos: all shards, or just the default bind."""
+    router = _router()
+    return router.bind_keys if router else [None]
+
+def bind_for_user(user_id):
+    router = _router()
+    return router.lookup(user_id)[0] if router else None
+
+def is_user_moving(user_id):
+    router = _router()
+    return router.lookup(user_id)[1] if router else False
+
+def placement_changed(user_id, bind_key):
+    """True if the user started moving or left `bind_key`, read from the directory bypassing the cache.
+
+    Writes that began before a move call this just before committing, so they never land on a
+    source shard after the move's final sync.
+    """
+    router = _router()
+    return router is not None and router.lookup(user_id, fresh=True) != (bind_key, False)
+
+@contextmanager
+def on_shard(bind_key):
+    """Send every db.session statement inside the block to `bind_key` (no-op for None)."""
+    if bind_key is None:
+        yield
+        return
+    info = db.session.info
+    previous = info.get('shard')
+    info['shard'] = bind_key
+    try:
+        yield
+    finally:
+        if previous is None:
+            info.pop('shard', None)
+        else:
+            info['shard'] = previous
+
+@contextmanager
+def on_user_shard(user_id):
+    with on_shard(bind_for_user(user_id)):
+        yield
+
+def scatter(statement):
+    """Run a read-only statement on every video database and return all rows.
+
+    Shards are queried in parallel, each on its own connection, so latency is that of the
+    slowest shard rather than the sum. Unsharded, this is a plain db.session execute.
+    """
+    router = _router()
+    if router is None:
+        return db.session.execute(statement).all()
+    engines = [db.engines[key] for key in router.bind_keys]
+
+    def run(engine):
+        with engine.connect() as connection:
+            return connection.execute(statement).all()
+
+    return [row for rows in _scatter_pool.map(run, engines) for row in rows]
+
+_scatter_pool = ThreadPoolExecutor(max_workers=SCATTER_MAX_WORKERS, thread_name_prefix='scatter')
+
+def find_video(video_id):
+    """Load a Video by global ID from whichever shard has it.
+
+    Returns `(video, bind_key)`, or `(None, None)` if no shard has it. Further writes to the
+    video must happen inside `on_shard(bind_key)`.
+    """
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            video = db.session.get(Video, video_id)
+        if video is not None:
+            return video, bind_key
+    return None, None
+
+def allocate_video_id():
+    """Reserve a cross-shard unique video ID on the primary, or None when unsharded."""
+    if not is_sharded():
+        return None
+    with db.engines[None].begin() as connection:
+        return connection.execute(insert(VideoIdAllocation.__table__)).inserted_primary_key[0]
+
+
+# --- Helpers ---
+
+def _upsert(connection, table, values, index_elements):
+    rows = values if isinstance(values, list) else [values]
+    if not rows:
+        return
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table).values(rows)
+    update_columns = {c.name: stmt.excluded[c.name] for c in table.columns if c.name not in index_elements}
+    connection.execute(stmt.on_conflict_do_update(index_elements=index_elements, set_=update_columns))
+
+def _insert_missing(connection, table, rows, index_elements):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    connection.execute(dialect.insert(table).values(rows).on_conflict_do_nothing(index_elements=index_elements))
+
+def create_shard_schema(engine):
+    # Creating `videos` also fires the search index DDL hook (app/search.py)
+    db.metadata.create_all(engine, tables=SHARDED_TABLES)
+
+def replicate_users(user_ids):
+    """Copy users rows from the primary to every shard (insert or update)."""
+    router = _router()
+    if router is None or not user_ids:
+        return
+    with db.engines[None].connect() as primary:
+        rows = [dict(row._mapping) for row in primary.execute(select(User.__table__).where(User.id.in_(user_ids)))]
+    for bind_key in router.bind_keys:
+        with db.engines[bind_key].begin() as connection:
+            _upsert(connection, User.__table__, rows, ['id'])
+
+
+# --- Hooks: place and replicate new users once their signup commits ---
+
+def _record_new_user(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('new_users', set()).add(target.id)
+
+def place_users(user_ids):
+    """Pin newly created users to their hash shard, copy them to every shard and create their counters there."""
+    router = _router()
+    if not user_ids or router is None:
+        return
+    placed = {}
+    for user_id in user_ids:
+        bind_key = router.placement_for(user_id)
+        router.assign(user_id, bind_key)
+        placed.setdefault(bind_key, []).append(user_id)
+    replicate_users(list(user_ids))
+    for bind_key, ids in placed.items(): # Usage counters live with the user's videos (app/stats.py)
+        with db.engines[bind_key].begin() as connection:
+            _insert_missing(connection, UserStats.__table__, [{"user_id": user_id} for user_id in ids], ['user_id'])
+
+def _place_new_users(session):
+    place_users(session.info.pop('new_users', None))
+
+def _discard_new_users(session):
+    session.info.pop('new_users', None)
+
+def register_sharding_hooks():
+    if not event.contains(User, 'after_insert', _record_new_user):
+        event.listen(User, 'after_insert', _record_new_user)
+        event.listen(Session, 'after_commit', _place_new_users)
+        event.listen(Session, 'after_rollback', _discard_new_users)
+
+def init_shard_router(app):
+    urls = app.config.get('VIDEO_SHARD_URLS') or []
+    if not urls:
+        app.extensions.pop('shard_router', None)
+        return None
+    router = ShardRouter(shard_binds(urls), directory_ttl=app.config['SHARD_DIRECTORY_TTL_SECONDS'])
+    app.extensions['shard_router'] = router
+    return router
+
+
+# --- Rebalancing ---
+
+def _copy_videos(source, target, user_id, since=None, videos=Video.__table__, also_ids=(), only_ids=None):
+    """Upsert a user's videos (or archived videos) from source to target in keyset batches.
+
+    With `since`, only rows changed (or archived) since then, plus `also_ids`, are copied; with
+    `only_ids`, just those rows. Returns the IDs copied.
+    """
+    from .search import index_video
+    copied = []
+    last_id = 0
+    while True:
+        query = select(videos).where(videos.c.user_id == user_id, videos.c.id > last_id)
+        if since is not None:
+            changed_at = videos.c.archived_at if 'archived_at' in videos.c else videos.c.updated_at
+            query = query.where(or_(changed_at >= since, videos.c.id.in_(list(also_ids))))
+        if only_ids is not None:
+            query = query.where(videos.c.id.in_(list(only_ids)))
+        with source.connect() as src:
+            rows = [dict(row._mapping) for row in src.execute(query.order_by(videos.c.id).limit(MOVE_BATCH_SIZE))]
+        if not rows:
+            return copied
+        with target.begin() as dst:
+            _upsert(dst, videos, rows, ['id'])
+            for row in rows:
+                index_video(dst, row['id'], row['title'], row['description'])
+        copied.extend(row['id'] for row in rows)
+        last_id = rows[-1]['id']
+
+def _user_video_ids(engine, user_id, videos=Video.__table__):
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(select(videos.c.id).where(videos.c.user_id == user_id))}
+
+def _delete_videos(engine, video_ids, videos=Video.__table__, keep_indexed=()):
+    from .search import unindex_video
+    video_ids = sorted(video_ids)
+    for start in range(0, len(video_ids), MOVE_BATCH_SIZE):
+        batch = video_ids[start:start + MOVE_BATCH_SIZE]
+        with engine.begin() as connection:
+            for video_id in batch:
+                if video_id not in keep_indexed: # Still present in the other video table
+                    unindex_video(connection, video_id)
+            connection.execute(delete(videos).where(videos.c.id.in_(batch)))
+
+def _rebuild_stats(engine, user_id):
+    stats = UserStats.__table__
+    with engine.begin() as connection:
+        count = total = processed = 0
+        for videos in VIDEO_TABLES:
+            row = connection.execute(select(
+                func.count(videos.c.id), func.coalesce(func.sum(videos.c.total_size), 0),
+                func.coalesce(func.sum(case((videos.c.is_processed.is_(True), 1), else_=0)), 0))
+                .where(videos.c.user_id == user_id)).one()
+            count, total, processed = count + row[0], total + row[1], processed + row[2]
+        _upsert(connection, stats, {"user_id": user_id, "video_count": count, "total_bytes": total,
+                                    "processed_count": processed}, ['user_id'])
+
+def move_user(user_id, target_key, echo=lambda message: None):
+    """Move a user's videos to another shard while the app keeps serving.
+
+    1. Bulk copy to the target while reads and writes continue on the source.
+    2. Pause the user's writes (directory `moving` flag) and wait out the directory cache.
+    3. Re-copy rows modified since step 1 began and drop any deleted in the meantime.
+    4. Flip the directory to the target and resume writes.
+    5. After another cache period, copy over any upload that committed to the source after its
+       final directory check, then purge the rows from the source.
+    """
+    from .cache import metadata_cache
+    router = _router()
+    if router is None:
+        raise click.ClickException("Sharding is not enabled (VIDEO_SHARD_URLS is empty)")
+    if target_key not in router.bind_keys:
+        raise click.ClickException(f"Unknown shard: {target_key}")
+    router.forget(user_id)
+    source_key, moving = router.lookup(user_id)
+    if moving:
+        raise click.ClickException(f"User {user_id} is already being moved")
+    if source_key == target_key:
+        echo(f"User {user_id} is already on {target_key}")
+        return
+    source, target = db.engines[source_key], db.engines[target_key]
+    replicate_users([user_id])
+
+    # updated_at is stamped by the app (utcnow), so compare against the app's clock; the slack
+    # covers writes that read their timestamp just before this line and commit just after
+    copy_started = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    echo(f"Copying videos of user {user_id} from {source_key} to {target_key}")
+    echo(f"  copied {sum(len(_copy_videos(source, target, user_id, videos=videos)) for videos in VIDEO_TABLES)} videos")
+
+    router.assign(user_id, source_key, moving=True)
+    time.sleep(router.directory_ttl) # Every worker now sees `moving` and rejects writes for this user
+    recopied = stale = ()
+    live = set().union(*(_user_video_ids(source, user_id, videos) for videos in VIDEO_TABLES))
+    for videos in VIDEO_TABLES: # The archival job may also have moved rows between the tables meanwhile
+        source_ids, target_ids = _user_video_ids(source, user_id, videos), _user_video_ids(target, user_id, videos)
+        recopied += tuple(_copy_videos(source, target, user_id, since=copy_started, videos=videos,
+                                       also_ids=source_ids - target_ids)) # e.g. restored from the archive
+        removed = target_ids - source_ids
+        _delete_videos(target, removed, videos, keep_indexed=live)
+        stale += tuple(removed - live)
+    _rebuild_stats(target, user_id)
+    echo(f"  final sync: {len(recopied)} re-copied, {len(stale)} removed")
+
+    router.assign(user_id, target_key, moving=False)
+    metadata_cache.invalidate_user(user_id)
+    echo(f"User {user_id} now on {target_key}")
+
+    time.sleep(router.directory_ttl) # Let cached directory entries pointing at the source expire
+    late = ()
+    for videos in VIDEO_TABLES: # Passed placement_changed() just before `moving` was set, committed after the sync
+        late_ids = _user_video_ids(source, user_id, videos) - live
+        if late_ids:
+            late += tuple(_copy_videos(source, target, user_id, videos=videos, only_ids=late_ids))
+    if late:
+        _rebuild_stats(target, user_id)
+        echo(f"  {len(late)} late uploads copied")
+    for videos in VIDEO_TABLES:
+        _delete_videos(source, _user_video_ids(source, user_id, videos), videos)
+    with source.begin() as connection:
+        connection.execute(delete(UserStats.__table__).where(UserStats.__table__.c.user_id == user_id))
+    echo(f"Purged user {user_id} from {source_key}")
+
+
+# --- CLI ---
+
+shards_cli = AppGroup('shards', help='Manage video metadata shards.')
+
+@shards_cli.command('init')
+@click.option('--existing-shard', default=None, help='Pin users that have no directory entry to this shard '
+              '(use the shard that already holds their videos). Default: hash placement.')
+def init_command(existing_shard):
+    """Create shard schemas, copy users to every shard and pin unplaced users."""
+    router = _router()
+    if router is None:
+        raise click.ClickException("Sharding is not enabled (VIDEO_SHARD_URLS is empty)")
+    for bind_key in router.bind_keys:
+        create_shard_schema(db.engines[bind_key])
+    with db.engines[None].connect() as connection:
+        user_ids = [row[0] for row in connection.execute(
+            select(User.id).where(~User.id.in_(select(UserShard.user_id))).order_by(User.id))]
+    with db.engines[None].begin() as connection:
+        for user_id in user_ids:
+            router.assign(user_id, existing_shard or router.placement_for(user_id), connection=connection)
+    with db.engines[None].connect() as connection:
+        all_ids = [row[0] for row in connection.execute(select(User.id))]
+    for start in range(0, len(all_ids), MOVE_BATCH_SIZE):
+        replicate_users(all_ids[start:start + MOVE_BATCH_SIZE])
+    click.echo(f"{len(router.bind_keys)} shards ready, {len(user_ids)} users placed, {len(all_ids)} users replicated.")
+
+@shards_cli.command('move-user')
+@click.argument('user_id', type=int)
+@click.argument('target')
+def move_user_command(user_id, target):
+    """Move USER_ID's videos to shard TARGET (e.g. shard_1) without downtime."""
+    move_user(user_id, target, echo=click.echo)
@@ -0,0 +1,142 @@
+import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from . import db
+from .models import ArchivedVideo, User, Video, UserStats
+
+# Materialized per-user usage counters.
+#
+# Each Video insert, update or delete applies a delta to the owner's `user_stats` row on the
+# same connection, so the counters commit or roll back with the write itself. Deltas are
+# applied as an upsert with `col = col + :delta`, so concurrent uploads by the same user never
+# lose updates or collide on creating the row.
+
+RECONCILE_BATCH_SIZE = 500
+
+def _contribution(user_id, total_size, is_processed):
+    return user_id, 1, total_size or 0, 1 if is_processed else 0
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, name)
+
+def apply_delta(connection, user_id, videos, total_bytes, processed):
+    if not (videos or total_bytes or processed):
+        return
+    table = UserStats.__table__
+    now = datetime.datetime.utcnow()
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    # The insert covers users that predate the counters (the reconciler folds in their older rows).
+    # One statement, so two first writes for the same user can't both insert
+    stmt = dialect.insert(table).values(
+        user_id=user_id, video_count=max(videos, 0), total_bytes=max(total_bytes, 0),
+        processed_count=max(processed, 0), updated_at=now)
+    connection.execute(stmt.on_conflict_do_update(index_elements=['user_id'], set_={
+        'video_count': table.c.video_count + videos,
+        'total_bytes': table.c.total_bytes + total_bytes,
+        'processed_count': table.c.processed_count + processed,
+        'updated_at': now}))
+
+def _after_insert(mapper, connection, target):
+    user_id, videos, total_bytes, processed = _contribution(target.user_id, target.total_size, target.is_processed)
+    apply_delta(connection, user_id, videos, total_bytes, processed)
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    old = _contribution(_old_value(state, 'user_id'), _old_value(state, 'total_size'), _old_value(state, 'is_processed'))
+    new = _contribution(target.user_id, target.total_size, target.is_processed)
+    if old == new:
+        return
+    if old[0] != new[0]: # Video moved to another owner
+        apply_delta(connection, old[0], -old[1], -old[2], -old[3])
+        apply_delta(connection, new[0], new[1], new[2], new[3])
+    else:
+        apply_delta(connection, new[0], 0, new[2] - old[2], new[3] - old[3])
+
+def _after_delete(mapper, connection, target):
+    user_id, videos, total_bytes, processed = _contribution(target.user_id, target.total_size, target.is_processed)
+    apply_delta(connection, user_id, -videos, -total_bytes, -processed)
+
+def _after_user_insert(mapper, connection, target):
+    from .sharding import is_sharded
+    if is_sharded(): # The row belongs on the user's shard; sharding.place_users creates it there
+        return
+    connection.execute(UserStats.__table__.insert().values(user_id=target.id, updated_at=datetime.datetime.utcnow()))
+
+def register_stats_hooks(video_model):
+    for name, listener in (('after_insert', _after_insert), ('after_update', _after_update), ('after_delete', _after_delete)):
+        if not event.contains(video_model, name, listener):
+            event.listen(video_model, name, listener)
+    if not event.contains(User, 'after_insert', _after_user_insert):
+        event.listen(User, 'after_insert', _after_user_insert)
+
+def get_user_stats(user_id):
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        return {"video_count": 0, "total_bytes": 0, "processed_count": 0}
+    return {"video_count": stats.video_count, "total_bytes": stats.total_bytes, "processed_count": stats.processed_count}
+
+def reconcile_user_stats(batch_size=None, bind_key=None):
+    """Recompute counters from `videos` and `videos_archive` for every user and repair any that drifted.
+
+    Walks users in keyset batches with one aggregate query per table per batch. With `bind_key`, only
+    users placed on that shard are checked, against that shard's tables. Returns
+    `(users_checked, users_repaired)`.
+    """
+    from .sharding import bind_for_user, on_shard
+    with on_shard(bind_key):
+        return _reconcile(batch_size or RECONCILE_BATCH_SIZE, bind_key, bind_for_user)
+
+def _reconcile(batch_size, bind_key, bind_for_user):
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        user_ids = [row[0] for row in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(batch_size).all()]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        if bind_key is not None:
+            user_ids = [user_id for user_id in user_ids if bind_for_user(user_id) == bind_key]
+        actual = {}
+        for model in (Video, ArchivedVideo): # Archived videos still count towards their owner's usage
+            for row in db.session.query(
+                    model.user_id, func.count(model.id), func.sum(model.total_size),
+                    func.sum(case((model.is_processed.is_(True), 1), else_=0))) \
+                    .filter(model.user_id.in_(user_ids)).group_by(model.user_id):
+                videos, total_bytes, processed = actual.get(row[0], (0, 0, 0))
+                actual[row[0]] = (videos + row[1], total_bytes + (row[2] or 0), processed + (row[3] or 0))
+        stored = {stats.user_id: stats for stats in UserStats.query.filter(UserStats.user_id.in_(user_ids))}
+
+        for user_id in user_ids:
+            videos, total_bytes, processed = actual.get(user_id, (0, 0, 0))
+            stats = stored.get(user_id)
+            if stats is None:
+                db.session.add(UserStats(user_id=user_id, video_count=videos, total_bytes=total_bytes, processed_count=processed))
+                repaired += 1
+            elif (stats.video_count, stats.total_bytes, stats.processed_count) != (videos, total_bytes, processed):
+                stats.video_count, stats.total_bytes, stats.processed_count = videos, total_bytes, processed
+                repaired += 1
+        # One short transaction per batch; uploads racing with it are corrected on the next run
+        db.session.commit()
+        checked += len(user_ids)
+    return checked, repaired
+
+
+# --- CLI ---
+
+stats_cli = AppGroup('stats', help='Maintain per-user usage counters.')
+
+@stats_cli.command('reconcile')
+@click.option('--batch-size', default=RECONCILE_BATCH_SIZE, show_default=True, help='Users checked per transaction.')
+def reconcile_command(batch_size):
+    """Recompute per-user counters from the videos table and fix drift."""
+    from .sharding import video_binds
+    for bind_key in video_binds():
+        checked, repaired = reconcile_user_stats(batch_size, bind_key)
+        prefix = f"[{bind_key}] " if bind_key else ''
+        click.echo(f"{prefix}Checked {checked} users, repaired {repaired}.")
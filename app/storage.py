@@ -0,0 +1,439 @@
+import datetime
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, delete, or_, select, update
+from . import db
+from .archive import fetch_video_rows, restore_video
+from .models import ArchivedVideo, Video, VideoTombstone
+from .sharding import on_shard, on_user_shard, video_binds
+
+# Storage integrity scrubbing.
+#
+# `flask storage scrub` walks every video row (hot and archived, on every shard) in keyset
+# batches by ID and checks the stored file against the row: it must exist, have `total_size`
+# bytes and hash to `content_digest`. Rows uploaded before digests were recorded get one on
+# their first scrub. The verdict goes in `integrity_status` / `verified_at` (a Core update, so
+# the row's `updated_at`, change feed and caches are untouched); anything but 'ok' is reported.
+#
+# File reads are paced to SCRUB_MAX_BYTES_PER_SECOND so a pass never competes with streaming.
+# The position of the pass is saved after every batch in SCRUB_STATE_PATH, so a stopped or
+# restarted scrub continues where it left off; a finished pass starts over on the next run.
+#
+# `flask storage reconcile` finds files under UPLOAD_FOLDER (and COLD_STORAGE_FOLDER) that no
+# video row points to (orphans: failed uploads, crashes between saving and committing) and rows
+# whose file is gone (dangling). It merge-joins two streams in byte order of the path: the directory tree read
+# with os.scandir, one directory at a time, and `file_path` values read from every video table
+# in keyset batches. Memory stays bounded by one batch plus the largest directory. Orphans
+# younger than RECONCILE_GRACE_HOURS are left alone, since they may be uploads in progress.
+#
+# Deleting videos (DELETE /videos/<id>, POST /videos/delete) only swaps each Video row for a
+# VideoTombstone in one transaction: the ORM delete fires the usual hooks, so usage counters,
+# the change feed, the search index and the metadata cache are all updated with the commit, and
+# the request never waits on the filesystem. `flask storage reclaim` then removes the files in
+# paced batches: the video file plus any derived files stored next to it under the same name
+# stem (`<stem>.*`, `<stem>_*`: renditions, thumbnails, analysis output).
+
+SCRUB_BATCH_SIZE = 100
+SCRUB_READ_SIZE = 1024 * 1024
+STATUS_OK = 'ok'
+STATUS_MISSING = 'missing'
+STATUS_SIZE_MISMATCH = 'size_mismatch'
+STATUS_CORRUPT = 'corrupt'
+SCRUBBED_TABLES = (Video.__table__, ArchivedVideo.__table__)
+
+class Throttle:
+    """Paces reads to `bytes_per_second` on average (no limit when falsy)."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.started = time.monotonic()
+        self.consumed = 0
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        self.consumed += nbytes
+        ahead = self.consumed / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def file_digest(path, throttle=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(SCRUB_READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if throttle is not None:
+                throttle.consume(len(chunk))
+    return digest.hexdigest()
+
+def check_file(path, expected_size, expected_digest, throttle=None):
+    """Return `(status, digest)` for one stored file; digest is None when it was not read."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return STATUS_MISSING, None
+    if expected_size is not None and size != expected_size:
+        return STATUS_SIZE_MISMATCH, None # No need to read it to know it's wrong
+    try:
+        digest = file_digest(path, throttle)
+    except OSError: # Vanished or unreadable mid-read
+        return STATUS_MISSING, None
+    if expected_digest is not None and digest != expected_digest:
+        return STATUS_CORRUPT, digest
+    return STATUS_OK, digest
+
+
+# --- Progress ---
+
+def _state_path():
+    return current_app.config.get('SCRUB_STATE_PATH') or os.path.join(current_app.instance_path, 'scrub_state.json')
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError): # No state yet (or unreadable): start a fresh pass
+        return {"cursors": {}}
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path) # Atomic: a crash leaves the old or the new state, never half of one
+
+
+# --- Scrubbing ---
+
+def scrub_batch(table, after_id, batch_size=None, throttle=None):
+    """Check the files of up to `batch_size` rows of `table` with IDs above `after_id`.
+
+    Returns `(last ID seen or None when there are no more rows, [(id, file_path, status)])`.
+    """
+    rows = db.session.execute(
+        select(table.c.id, table.c.file_path, table.c.total_size, table.c.content_digest)
+        .where(table.c.id > after_id).order_by(table.c.id).limit(batch_size or SCRUB_BATCH_SIZE)).all()
+    db.session.rollback() # No transaction held open while reading files
+    if not rows:
+        return None, []
+    now = datetime.datetime.utcnow()
+    results, params = [], []
+    for video_id, file_path, total_size, content_digest in rows:
+        status, digest = check_file(file_path, total_size, content_digest, throttle)
+        results.append((video_id, file_path, status))
+        params.append({"_id": video_id, "_status": status, "_verified_at": now,
+                       # First successful read records the baseline digest; never overwrite one
+                       "_digest": content_digest or (digest if status == STATUS_OK else None)})
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('_id'))
+        .values(integrity_status=bindparam('_status'), verified_at=bindparam('_verified_at'),
+                content_digest=bindparam('_digest'), updated_at=table.c.updated_at),
+        params)
+    db.session.commit()
+    return rows[-1][0], results
+
+def run_scrub(state_path, batch_size=None, bytes_per_second=None, max_batches=None, on_problem=lambda *args: None):
+    """Continue the current pass over all video databases. Returns `(checked, problems, finished)`."""
+    state = load_state(state_path)
+    state.setdefault('pass_started_at', datetime.datetime.utcnow().isoformat())
+    cursors = state['cursors']
+    throttle = Throttle(bytes_per_second)
+    checked = problems = batches = 0
+    for bind_key in video_binds():
+        for table in SCRUBBED_TABLES:
+            key = f"{bind_key or 'default'}/{table.name}"
+            if cursors.get(key) == 'done':
+                continue
+            with on_shard(bind_key):
+                while True:
+                    if max_batches is not None and batches >= max_batches:
+                        return checked, problems, False
+                    last_id, results = scrub_batch(table, cursors.get(key, 0), batch_size, throttle)
+                    cursors[key] = 'done' if last_id is None else last_id
+                    save_state(state_path, state)
+                    if last_id is None:
+                        break
+                    batches += 1
+                    checked += len(results)
+                    for video_id, file_path, status in results:
+                        if status != STATUS_OK:
+                            problems += 1
+                            on_problem(video_id, file_path, status)
+    save_state(state_path, {"cursors": {}, "last_pass_started_at": state['pass_started_at'],
+                            "last_pass_finished_at": datetime.datetime.utcnow().isoformat()})
+    return checked, problems, True
+
+
+# --- Reconciliation ---
+
+RECONCILE_BATCH_SIZE = 1000
+RECONCILE_ACTIONS = ('report', 'quarantine', 'delete')
+
+def _sorted_files(directory, skip=()):
+    """Yield the files under `directory` as DirEntry objects, in byte order of their full path."""
+    with os.scandir(directory) as entries:
+        # A directory sorts as if its name ended in the separator, which is where its files
+        # fall among full path strings ('a-b' < 'a/x' although 'a' < 'a-b')
+        entries = sorted(entries, key=lambda e: e.name + os.sep if e.is_dir(follow_symlinks=False) else e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if entry.path not in skip:
+                yield from _sorted_files(entry.path, skip)
+        elif entry.is_file(follow_symlinks=False):
+            yield entry
+
+def _path_column(table, engine):
+    # Compare paths bytewise, as Python does; PostgreSQL would otherwise sort by locale
+    return table.c.file_path.collate('C') if engine.dialect.name == 'postgresql' else table.c.file_path
+
+def _stored_paths(engine, table, root, batch_size=None):
+    """Yield `(file_path, video_id)` for the rows of `table` stored under `root`, in path order."""
+    path = _path_column(table, engine)
+    prefix = root.rstrip(os.sep) + os.sep
+    # Every path starting with the prefix, as a range the file_path index can serve
+    under_root = and_(path >= prefix, path < prefix[:-1] + chr(ord(os.sep) + 1))
+    after = None
+    while True:
+        query = select(table.c.file_path, table.c.id).where(under_root)
+        if after is not None:
+            query = query.where(or_(path > after[0], and_(path == after[0], table.c.id > after[1])))
+        with engine.connect() as connection:
+            rows = connection.execute(query.order_by(path, table.c.id).limit(batch_size or RECONCILE_BATCH_SIZE)).all()
+        yield from (tuple(row) for row in rows)
+        if len(rows) < (batch_size or RECONCILE_BATCH_SIZE):
+            return
+        after = rows[-1]
+
+def _is_referenced(file_path):
+    # Exact re-check before touching an orphan, in case its row moved table or shard mid-scan
+    for bind_key in video_binds():
+        with db.engines[bind_key].connect() as connection:
+            for table in SCRUBBED_TABLES:
+                if connection.execute(select(table.c.id).where(table.c.file_path == file_path).limit(1)).first():
+                    return True
+    return False
+
+def reconcile(root, grace_seconds, action='report', quarantine_dir=None, batch_size=None,
+              on_orphan=lambda path, size, action: None, on_dangling=lambda video_id, path: None):
+    """Match the files under `root` against video rows. Returns counts by outcome."""
+    counts = {"files": 0, "orphans": 0, "recent_orphans": 0, "dangling_rows": 0, "orphan_bytes": 0}
+    now = time.time()
+    files = _sorted_files(root, skip={quarantine_dir} if quarantine_dir else ())
+    rows = heapq.merge(*(_stored_paths(db.engines[bind_key], table, root, batch_size)
+                         for bind_key in video_binds() for table in SCRUBBED_TABLES))
+    file, row = next(files, None), next(rows, None)
+    while file is not None or row is not None:
+        if row is None or (file is not None and file.path < row[0]):
+            counts['files'] += 1
+            try:
+                stat = file.stat(follow_symlinks=False)
+            except OSError: # Removed since the directory was listed
+                stat = None
+            if stat is not None and now - stat.st_mtime < grace_seconds:
+                counts['recent_orphans'] += 1
+            elif stat is not None and not _is_referenced(file.path):
+                counts['orphans'] += 1
+                counts['orphan_bytes'] += stat.st_size
+                on_orphan(file.path, stat.st_size, action)
+                if action == 'quarantine':
+                    target = os.path.join(quarantine_dir, os.path.relpath(file.path, root))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(file.path, target)
+                elif action == 'delete':
+                    os.remove(file.path)
+            file = next(files, None)
+        elif file is None or row[0] < file.path:
+            counts['dangling_rows'] += 1
+            on_dangling(row[1], row[0])
+            row = next(rows, None)
+        else:
+            counts['files'] += 1
+            path = row[0]
+            while row is not None and row[0] == path: # The same file may be referenced more than once
+                row = next(rows, None)
+            file = next(files, None)
+    return counts
+
+
+# --- Deletion and reclamation ---
+
+RECLAIM_BATCH_SIZE = 100
+RECLAIM_PAUSE_SECONDS = 0.5
+
+def tombstone_videos(user_id, video_ids):
+    """Delete `user_id`'s videos among `video_ids`, leaving their files to the reclaimer.
+
+    Returns `(deleted, forbidden, not_found)` lists of IDs.
+    """
+    owners = {row[0]: row[1] for row in fetch_video_rows(video_ids, ['user_id'])} # Hot or archived, any shard
+    forbidden = [video_id for video_id in video_ids if video_id in owners and owners[video_id] != user_id]
+    not_found = [video_id for video_id in video_ids if video_id not in owners]
+    owned = [video_id for video_id in video_ids if owners.get(video_id) == user_id]
+    if not owned:
+        return [], forbidden, not_found
+    with on_user_shard(user_id):
+        videos = Video.query.filter(Video.id.in_(owned)).all()
+        hot_ids = {video.id for video in videos}
+        # Archived rows bypass the Video hooks; bring them back so deleting them updates everything the same way
+        if any(video_id not in hot_ids for video_id in owned):
+            for video_id in owned:
+                if video_id not in hot_ids:
+                    restore_video(video_id)
+            videos = Video.query.filter(Video.id.in_(owned)).all()
+        for video in videos:
+            db.session.add(VideoTombstone(video_id=video.id, user_id=video.user_id,
+                                          file_path=video.file_path, total_size=video.total_size))
+            db.session.delete(video)
+        db.session.commit()
+    deleted = {video.id for video in videos}
+    return [video_id for video_id in owned if video_id in deleted], forbidden, \
+        not_found + [video_id for video_id in owned if video_id not in deleted]
+
+def remove_video_files(file_path):
+    """Remove a stored video and its derived files. Returns the number of bytes freed."""
+    directory, name = os.path.split(file_path)
+    stem = os.path.splitext(name)[0]
+    freed = 0
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            if entry.name == name or entry.name.startswith((stem + '.', stem + '_')):
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                    os.remove(entry.path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+    return freed
+
+def reclaim_batch(batch_size=None):
+    """Remove the files of up to `batch_size` tombstoned videos. Returns `(videos, bytes freed)`."""
+    table = VideoTombstone.__table__
+    rows = db.session.execute(select(table.c.id, table.c.file_path).order_by(table.c.id)
+                              .limit(batch_size or RECLAIM_BATCH_SIZE)).all()
+    db.session.rollback() # No transaction held open while unlinking
+    if not rows:
+        return 0, 0
+    freed = 0
+    for _, file_path in rows:
+        if not _is_referenced(file_path): # Never pull a file out from under a live row
+            freed += remove_video_files(file_path)
+    db.session.execute(delete(table).where(table.c.id.in_([row[0] for row in rows])))
+    db.session.commit()
+    return len(rows), freed
+
+def run_reclaim(batch_size=None, pause=None, max_batches=None, echo=lambda message: None):
+    """Reclaim every tombstoned video on every video database. Returns `(videos, bytes freed)`."""
+    pause = RECLAIM_PAUSE_SECONDS if pause is None else pause
+    videos = freed = 0
+    for bind_key in video_binds():
+        batches = 0
+        with on_shard(bind_key):
+            while max_batches is None or batches < max_batches:
+                reclaimed, batch_freed = reclaim_batch(batch_size)
+                if not reclaimed:
+                    break
+                videos += reclaimed
+                freed += batch_freed
+                batches += 1
+                echo(f"Reclaimed {videos} videos ({freed} bytes)")
+                time.sleep(pause)
+    return videos, freed
+
+
+# --- CLI ---
+
+storage_cli = AppGroup('storage', help='Check and maintain stored video files.')
+
+@storage_cli.command('scrub')
+@click.option('--batch-size', default=SCRUB_BATCH_SIZE, show_default=True, help='Videos checked per batch.')
+@click.option('--rate', type=float, default=None,
+              help='Maximum read rate in MB/s (default: SCRUB_MAX_BYTES_PER_SECOND; 0 for unlimited).')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches (the next run resumes).')
+@click.option('--restart', is_flag=True, help='Discard saved progress and start a new pass.')
+def scrub_command(batch_size, rate, max_batches, restart):
+    """Verify stored files against their size and digest, flagging missing or corrupt ones."""
+    state_path = _state_path()
+    if restart and os.path.exists(state_path):
+        os.remove(state_path)
+    bytes_per_second = rate * 1024 * 1024 if rate is not None else current_app.config['SCRUB_MAX_BYTES_PER_SECOND']
+    started = time.monotonic()
+
+    def report_problem(video_id, file_path, status):
+        click.echo(f"video {video_id}: {status} ({file_path})", err=True)
+
+    checked, problems, finished = run_scrub(state_path, batch_size, bytes_per_second, max_batches, report_problem)
+    outcome = "Pass complete" if finished else "Paused; the next run resumes"
+    click.echo(f"{outcome}. {checked} videos checked, {problems} problems found in {time.monotonic() - started:.1f}s.")
+
+@storage_cli.command('problems')
+def problems_command():
+    """List videos whose last scrub found a problem."""
+    found = 0
+    for bind_key in video_binds():
+        with on_shard(bind_key):
+            for table in SCRUBBED_TABLES:
+                for video_id, file_path, status, verified_at in db.session.execute(
+                        select(table.c.id, table.c.file_path, table.c.integrity_status, table.c.verified_at)
+                        .where(table.c.integrity_status != STATUS_OK).order_by(table.c.id)):
+                    found += 1
+                    click.echo(f"video {video_id}: {status} at {verified_at:%Y-%m-%d %H:%M} ({file_path})")
+    click.echo(f"{found} videos with problems.")
+
+@storage_cli.command('reconcile')
+@click.option('--action', type=click.Choice(RECONCILE_ACTIONS), default='report', show_default=True,
+              help='What to do with orphaned files.')
+@click.option('--grace-hours', type=float, default=None,
+              help='Ignore orphans modified more recently than this (default: RECONCILE_GRACE_HOURS).')
+@click.option('--batch-size', default=RECONCILE_BATCH_SIZE, show_default=True, help='Paths read per query.')
+def reconcile_command(action, grace_hours, batch_size):
+    """Find files without a video row and video rows without a file."""
+    roots = [root for root in (current_app.config['UPLOAD_FOLDER'], current_app.config.get('COLD_STORAGE_FOLDER')) if root]
+    quarantine_dir = current_app.config.get('RECONCILE_QUARANTINE_DIR') or os.path.join(current_app.instance_path, 'quarantine')
+    grace_hours = grace_hours if grace_hours is not None else current_app.config['RECONCILE_GRACE_HOURS']
+    started = time.monotonic()
+
+    def report_orphan(path, size, action):
+        click.echo(f"orphan ({action}): {path} ({size} bytes)")
+
+    def report_dangling(video_id, path):
+        click.echo(f"dangling: video {video_id} has no file at {path}")
+
+    counts = {}
+    for root in roots: # The hot upload folder and, with tiering, the cold one
+        for name, count in reconcile(root, grace_hours * 3600, action, quarantine_dir, batch_size,
+                                     report_orphan, report_dangling).items():
+            counts[name] = counts.get(name, 0) + count
+    click.echo(f"Done. {counts['files']} files checked: {counts['orphans']} orphans ({counts['orphan_bytes']} bytes), "
+               f"{counts['recent_orphans']} within the grace period, {counts['dangling_rows']} dangling rows "
+               f"in {time.monotonic() - started:.1f}s.")
+
+@storage_cli.command('reclaim')
+@click.option('--batch-size', default=RECLAIM_BATCH_SIZE, show_default=True, help='Deleted videos reclaimed per batch.')
+@click.option('--pause', default=RECLAIM_PAUSE_SECONDS, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per database.')
+@click.option('--watch', type=float, default=None, help='Keep running, checking for new deletions every this many seconds.')
+def reclaim_command(batch_size, pause, max_batches, watch):
+    """Remove the files of deleted videos in throttled batches."""
+    while True:
+        started = time.monotonic()
+        videos, freed = run_reclaim(batch_size, pause, max_batches, echo=click.echo)
+        if videos or watch is None: # Stay quiet while idle in --watch mode
+            click.echo(f"Done. {videos} deleted videos reclaimed, {freed} bytes freed in {time.monotonic() - started:.1f}s.")
+        if watch is None:
+            return
+        time.sleep(watch)
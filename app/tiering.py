@@ -0,0 +1,292 @@
+import datetime
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from . import db
+from .cache import metadata_cache
+from .models import ArchivedVideo, Video
+from .sharding import on_shard, video_binds
+
+# Hot/cold storage tiering.
+#
+# Uploads land under UPLOAD_FOLDER (the fast, expensive "hot" root). `flask tiering run`
+# moves files of videos nobody has streamed for TIER_COLD_AFTER_DAYS to COLD_STORAGE_FOLDER
+# (a cheaper disk or a mounted object store) under the same relative path, and the first
+# stream of a cold video moves it back in the background. A video's tier is simply the root
+# its `file_path` is under.
+#
+# Moves never break a stream: the file is copied to the other root and synced, then the row's
+# `file_path` is switched with a compare-and-swap UPDATE (only if it still points at the old
+# copy), and only then is the old copy unlinked. Streams that already opened the old file keep
+# reading it; a stream that read the row just before the switch finds the old path gone and
+# re-reads the row (see stream_video).
+#
+# Access statistics (`last_accessed_at`, `access_count`) are cheap by design: stream_video
+# records only a sample of requests (ACCESS_SAMPLE_RATE, each sample counting for 1/rate hits)
+# in a per-process buffer, written out in one batched UPDATE per table every
+# ACCESS_FLUSH_SECONDS. The counts are estimates and a rarely-streamed video may miss its last
+# access; the worst case is a demotion followed by a promotion on its next stream.
+
+TIER_BATCH_SIZE = 100
+TIER_PAUSE_SECONDS = 0.5
+MAX_PENDING_ACCESSES = 10000 # Flush early rather than let the buffer grow without bound
+TIERED_TABLES = {table.name: table for table in (Video.__table__, ArchivedVideo.__table__)}
+
+def _under(path, root):
+    return bool(root) and path.startswith(root.rstrip(os.sep) + os.sep)
+
+def _relocate(path, from_root, to_root):
+    return os.path.join(to_root, os.path.relpath(path, from_root))
+
+
+class AccessStats:
+    def __init__(self, app=None):
+        self.sample_rate = 0.1
+        self.flush_interval = 30.0
+        self._pending = {} # (bind key, table name, video ID) -> (estimated hits, last access)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('ACCESS_SAMPLE_RATE', 0.1)
+        self.flush_interval = app.config.get('ACCESS_FLUSH_SECONDS', 30.0)
+        self._pending = {}
+        self._reset_stats()
+        app.extensions['access_stats'] = self
+
+    def _reset_stats(self):
+        self.recorded = 0
+        self.sampled = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def record(self, video, bind_key):
+        """Note one stream of `video` (a Video or ArchivedVideo on `bind_key`)."""
+        self.recorded += 1
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        key = (bind_key, video.__table__.name, video.id)
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            hits, _ = self._pending.get(key, (0.0, None))
+            self._pending[key] = (hits + 1 / self.sample_rate, now)
+            self.sampled += 1
+            due = time.monotonic() - self._flushed_at >= self.flush_interval or len(self._pending) >= MAX_PENDING_ACCESSES
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered accesses out, one executemany per (database, table)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        groups = {}
+        for (bind_key, table_name, video_id), (hits, accessed_at) in pending.items():
+            groups.setdefault((bind_key, table_name), []).append(
+                {"_id": video_id, "_hits": round(hits), "_accessed_at": accessed_at})
+        for (bind_key, table_name), params in groups.items():
+            table = TIERED_TABLES[table_name]
+            try:
+                with db.engines[bind_key].begin() as connection:
+                    connection.execute(update(table).where(table.c.id == bindparam('_id')).values(
+                        access_count=func.coalesce(table.c.access_count, 0) + bindparam('_hits'),
+                        # Another worker may have flushed a later access already
+                        last_accessed_at=case((table.c.last_accessed_at > bindparam('_accessed_at'), table.c.last_accessed_at),
+                                              else_=bindparam('_accessed_at')),
+                        updated_at=table.c.updated_at), params)
+            except SQLAlchemyError as e: # Statistics are best effort; never fail a stream over them
+                self.flush_errors += 1
+                current_app.logger.warning(f"Could not write access statistics: {e}")
+        if pending:
+            self.flushes += 1
+
+    def clear(self):
+        """Drop buffered accesses without writing them."""
+        with self._lock:
+            self._pending = {}
+        self._reset_stats()
+
+    def stats(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "sampled": self.sampled,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+access_stats = AccessStats()
+
+
+# --- Moving files between tiers ---
+
+def move_video_file(table, video_id, user_id, old_path, new_path):
+    """Copy a video's file to `new_path` and point its row there. Run on the video's shard.
+
+    Returns True if the row now points at `new_path`, False if it changed meanwhile (the copy
+    is then discarded).
+    """
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    temp_path = f"{new_path}.{uuid.uuid4().hex[:8]}.moving"
+    try:
+        shutil.copy2(old_path, temp_path)
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno()) # The bytes must be durable before the row points at them
+        os.replace(temp_path, new_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    switched = db.session.execute(
+        update(table).where(table.c.id == video_id, table.c.file_path == old_path)
+        .values(file_path=new_path, updated_at=table.c.updated_at)).rowcount == 1
+    db.session.commit()
+    if not switched: # Deleted, or moved by someone else
+        os.remove(new_path)
+        return False
+    metadata_cache.invalidate_video(video_id, user_id) # `file_path` is part of the metadata
+    os.remove(old_path)
+    return True
+
+def demote_batch(table, after_id, cutoff, hot_root, cold_root, batch_size=None):
+    """Move files of up to `batch_size` videos idle since `cutoff` to the cold root.
+
+    Returns `(last ID seen or None when done, videos moved, bytes moved)`.
+    """
+    last_activity = func.coalesce(table.c.last_accessed_at, table.c.created_at)
+    rows = db.session.execute(
+        select(table.c.id, table.c.user_id, table.c.file_path, table.c.total_size)
+        .where(table.c.id > after_id, last_activity < cutoff, table.c.file_path.startswith(hot_root.rstrip(os.sep) + os.sep))
+        .order_by(table.c.id).limit(batch_size or TIER_BATCH_SIZE)).all()
+    db.session.rollback() # No transaction held open while copying
+    if not rows:
+        return None, 0, 0
+    moved = moved_bytes = 0
+    for video_id, user_id, file_path, total_size in rows:
+        try:
+            if move_video_file(table, video_id, user_id, file_path, _relocate(file_path, hot_root, cold_root)):
+                moved += 1
+                moved_bytes += total_size or 0
+        except OSError as e: # Missing or unreadable: the scrubber reports those; carry on
+            current_app.logger.warning(f"Could not move video {video_id} to cold storage: {e}")
+    return rows[-1][0], moved, moved_bytes
+
+def run_tiering(cutoff, batch_size=None, pause=None, max_batches=None, echo=lambda message: None):
+    """Demote every video idle since `cutoff`, on every video database. Returns `(videos, bytes)`."""
+    hot_root, cold_root = current_app.config['UPLOAD_FOLDER'], current_app.config['COLD_STORAGE_FOLDER']
+    pause = TIER_PAUSE_SECONDS if pause is None else pause
+    videos = moved_bytes = 0
+    for bind_key in video_binds():
+        for table in TIERED_TABLES.values():
+            batches, after_id = 0, 0
+            with on_shard(bind_key):
+                while max_batches is None or batches < max_batches:
+                    after_id, moved, batch_bytes = demote_batch(table, after_id, cutoff, hot_root, cold_root, batch_size)
+                    if after_id is None:
+                        break
+                    videos += moved
+                    moved_bytes += batch_bytes
+                    batches += 1
+                    echo(f"Moved {videos} videos ({moved_bytes} bytes) to cold storage")
+                    time.sleep(pause)
+    return videos, moved_bytes
+
+def promote_video(bind_key, table_name, video_id):
+    """Move a cold video's file back to the hot root. Returns True if it moved."""
+    from .uploads import _free_bytes, disk_space
+    hot_root, cold_root = current_app.config['UPLOAD_FOLDER'], current_app.config['COLD_STORAGE_FOLDER']
+    table = TIERED_TABLES[table_name]
+    with on_shard(bind_key):
+        row = db.session.execute(select(table.c.user_id, table.c.file_path, table.c.total_size)
+                                 .where(table.c.id == video_id)).first()
+        db.session.rollback()
+        if row is None or not _under(row.file_path, cold_root):
+            return False
+        if _free_bytes(hot_root) - (row.total_size or 0) < disk_space.min_free:
+            return False # Keep the hot root's headroom for uploads; it stays cold for now
+        return move_video_file(table, video_id, row.user_id, row.file_path, _relocate(row.file_path, cold_root, hot_root))
+
+
+class Promoter:
+    """Promotes cold videos on a background thread, at most one move per video at a time."""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_progress = {} # (bind key, table name, video ID) -> future
+        self.promoted = 0
+        self.failed = 0
+
+    def submit(self, video, bind_key):
+        key = (bind_key, video.__table__.name, video.id)
+        app = current_app._get_current_object()
+        with self._lock:
+            if key in self._in_progress:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tier-promote')
+            self._in_progress[key] = self._executor.submit(self._promote, app, key)
+
+    def _promote(self, app, key):
+        try:
+            with app.app_context():
+                if promote_video(*key):
+                    self.promoted += 1
+        except Exception as e:
+            self.failed += 1
+            app.logger.warning(f"Could not promote video {key[2]} to hot storage: {e}")
+        finally:
+            with self._lock:
+                self._in_progress.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Block until the promotions submitted so far have finished."""
+        with self._lock:
+            futures = list(self._in_progress.values())
+        wait(futures, timeout=timeout)
+
+
+promoter = Promoter()
+
+def is_cold(file_path):
+    return _under(file_path, current_app.config.get('COLD_STORAGE_FOLDER'))
+
+def tiering_stats():
+    return dict(access_stats.stats(), promoted=promoter.promoted, promotion_failures=promoter.failed,
+                cold_storage_folder=current_app.config.get('COLD_STORAGE_FOLDER'))
+
+
+# --- CLI ---
+
+tiering_cli = AppGroup('tiering', help='Move video files between hot and cold storage.')
+
+@tiering_cli.command('run')
+@click.option('--cold-after-days', type=float, default=None,
+              help='Demote videos not streamed for this many days (default: TIER_COLD_AFTER_DAYS).')
+@click.option('--batch-size', default=TIER_BATCH_SIZE, show_default=True, help='Videos considered per batch.')
+@click.option('--pause', default=TIER_PAUSE_SECONDS, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per table.')
+def run_command(cold_after_days, batch_size, pause, max_batches):
+    """Move files of videos that have gone cold to COLD_STORAGE_FOLDER."""
+    if not current_app.config.get('COLD_STORAGE_FOLDER'):
+        raise click.UsageError("COLD_STORAGE_FOLDER is not set.")
+    access_stats.flush() # Nothing this process has seen should count as idle
+    days = cold_after_days if cold_after_days is not None else current_app.config['TIER_COLD_AFTER_DAYS']
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    started = time.monotonic()
+    videos, moved_bytes = run_tiering(cutoff, batch_size, pause, max_batches, echo=click.echo)
+    click.echo(f"Done. {videos} videos ({moved_bytes} bytes) moved to cold storage in {time.monotonic() - started:.1f}s.")
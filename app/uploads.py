@@ -0,0 +1,410 @@
+import errno
+import hashlib
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from functools import wraps
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+
+# Upload admission control.
+#
+# Before an upload's body is read, `disk_space.reserve()` claims its declared size against the
+# free space of the filesystem holding UPLOAD_FOLDER, counting every other upload still in
+# flight: an upload is admitted only if
+#
+#     free space - bytes reserved by in-flight uploads - size >= UPLOAD_MIN_FREE_BYTES
+#
+# and is otherwise answered 507 without reading a byte of it. Reservations are held until the
+# request ends. They live in a small SQLite ledger shared by all workers on the host ('sqlite',
+# the default) or per process ('memory'); a reservation whose worker died is ignored once it is
+# UPLOAD_RESERVATION_TTL_SECONDS old.
+#
+# The file itself is written with `save_preallocated`, which asks the filesystem for all of its
+# blocks up front (posix_fallocate): fewer fragments, and a full disk surfaces before the copy.
+#
+# Upload concurrency is capped as well (`@upload_slots.limit`): at most UPLOAD_MAX_CONCURRENT
+# uploads run on the host, and at most UPLOAD_MAX_CONCURRENT_PER_USER for any one user. An
+# upload over either cap waits up to UPLOAD_QUEUE_TIMEOUT_SECONDS for a slot, then gets a 429
+# with Retry-After. Slots are kept in the same store as the space reservations.
+
+COPY_BUFFER_SIZE = 1024 * 1024
+SLOT_POLL_MAX_SECONDS = 0.25 # Longest sleep between attempts while queued for a slot
+UPLOAD_RETRY_AFTER_SECONDS = 5
+
+class InsufficientStorage(Exception):
+    """Raised when an upload does not fit in the free space left on the upload filesystem."""
+
+    def __init__(self, requested, available):
+        super().__init__(f"Upload of {requested} bytes does not fit ({available} bytes available)")
+        self.requested = requested
+        self.available = available
+
+
+def _free_bytes(folder):
+    return shutil.disk_usage(folder).free # Space available to this (unprivileged) process
+
+
+class MemoryLedger:
+    def __init__(self):
+        self._reservations = {} # id -> (device, bytes, expires)
+        self._lock = threading.Lock()
+
+    def reserve(self, device, nbytes, admit, ttl, now):
+        with self._lock:
+            self._reservations = {k: r for k, r in self._reservations.items() if r[2] > now}
+            reserved = sum(r[1] for r in self._reservations.values() if r[0] == device)
+            if not admit(reserved):
+                return None, reserved
+            reservation_id = uuid.uuid4().hex
+            self._reservations[reservation_id] = (device, nbytes, now + ttl)
+            return reservation_id, reserved
+
+    def release(self, reservation_id):
+        with self._lock:
+            self._reservations.pop(reservation_id, None)
+
+    def reserved(self, device, now):
+        with self._lock:
+            return sum(r[1] for r in self._reservations.values() if r[0] == device and r[2] > now)
+
+
+class _SQLiteFile:
+    # One SQLite file shared by the workers on the host; each thread keeps its own connection
+    SCHEMA = ()
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+class SQLiteLedger(_SQLiteFile):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS upload_reservations "
+              "(id TEXT PRIMARY KEY, device INTEGER NOT NULL, bytes INTEGER NOT NULL, expires REAL NOT NULL)",)
+
+    def reserve(self, device, nbytes, admit, ttl, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE") # Check and claim atomically with respect to other workers
+        try:
+            conn.execute("DELETE FROM upload_reservations WHERE expires <= ?", (now,))
+            reserved = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM upload_reservations WHERE device = ?",
+                                    (device,)).fetchone()[0]
+            reservation_id = None
+            if admit(reserved):
+                reservation_id = uuid.uuid4().hex
+                conn.execute("INSERT INTO upload_reservations (id, device, bytes, expires) VALUES (?, ?, ?, ?)",
+                             (reservation_id, device, nbytes, now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return reservation_id, reserved
+
+    def release(self, reservation_id):
+        self._connect().execute("DELETE FROM upload_reservations WHERE id = ?", (reservation_id,))
+
+    def reserved(self, device, now):
+        return self._connect().execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM upload_reservations WHERE device = ? AND expires > ?",
+            (device, now)).fetchone()[0]
+
+
+class MemorySlots:
+    def __init__(self):
+        self._slots = {} # id -> (user key, expires)
+        self._lock = threading.Lock()
+
+    def acquire(self, user, global_cap, user_cap, ttl, now):
+        with self._lock:
+            self._slots = {k: slot for k, slot in self._slots.items() if slot[1] > now}
+            if len(self._slots) >= global_cap or sum(1 for u, _ in self._slots.values() if u == user) >= user_cap:
+                return None
+            slot_id = uuid.uuid4().hex
+            self._slots[slot_id] = (user, now + ttl)
+            return slot_id
+
+    def release(self, slot_id):
+        with self._lock:
+            self._slots.pop(slot_id, None)
+
+    def occupancy(self, now):
+        with self._lock:
+            return sum(1 for _, expires in self._slots.values() if expires > now)
+
+
+class SQLiteSlots(_SQLiteFile):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS upload_slots (id TEXT PRIMARY KEY, user TEXT NOT NULL, expires REAL NOT NULL)",
+              "CREATE INDEX IF NOT EXISTS ix_upload_slots_user ON upload_slots (user)")
+
+    def acquire(self, user, global_cap, user_cap, ttl, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE") # Count and claim atomically with respect to other workers
+        try:
+            conn.execute("DELETE FROM upload_slots WHERE expires <= ?", (now,))
+            in_flight = conn.execute("SELECT COUNT(*) FROM upload_slots").fetchone()[0]
+            slot_id = None
+            if in_flight < global_cap and \
+                    conn.execute("SELECT COUNT(*) FROM upload_slots WHERE user = ?", (user,)).fetchone()[0] < user_cap:
+                slot_id = uuid.uuid4().hex
+                conn.execute("INSERT INTO upload_slots (id, user, expires) VALUES (?, ?, ?)", (slot_id, user, now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return slot_id
+
+    def release(self, slot_id):
+        self._connect().execute("DELETE FROM upload_slots WHERE id = ?", (slot_id,))
+
+    def occupancy(self, now):
+        return self._connect().execute("SELECT COUNT(*) FROM upload_slots WHERE expires > ?", (now,)).fetchone()[0]
+
+
+class DiskSpaceAdmission:
+    def __init__(self, app=None):
+        self.ledger = None
+        self.min_free = 0
+        self.ttl = 3600.0
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        store = app.config.get('UPLOAD_RESERVATION_STORE', 'sqlite')
+        if store == 'sqlite':
+            path = app.config.get('UPLOAD_RESERVATION_PATH') or os.path.join(app.instance_path, 'upload_reservations.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.ledger = SQLiteLedger(path)
+        elif store == 'memory':
+            self.ledger = MemoryLedger()
+        else:
+            raise ValueError(f"Unknown UPLOAD_RESERVATION_STORE: {store}")
+        self.min_free = app.config.get('UPLOAD_MIN_FREE_BYTES', 0)
+        self.ttl = app.config.get('UPLOAD_RESERVATION_TTL_SECONDS', 3600.0)
+        self._reset_stats()
+        app.extensions['disk_space'] = self
+        if self._release_request not in app.teardown_request_funcs.get(None, []):
+            app.teardown_request(self._release_request)
+
+    def _reset_stats(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.ledger_errors = 0
+
+    def reserve(self, nbytes, folder=None):
+        """Reserve `nbytes` on the upload filesystem for the rest of this request.
+
+        Raises InsufficientStorage if the upload would not fit next to the in-flight ones.
+        """
+        folder = folder or current_app.config['UPLOAD_FOLDER']
+        device = os.stat(folder).st_dev
+        free = _free_bytes(folder)
+        admit = lambda reserved: free - reserved - nbytes >= self.min_free
+        try:
+            reservation_id, reserved = self.ledger.reserve(device, nbytes, admit, self.ttl, time.time())
+            admitted = reservation_id is not None
+        except sqlite3.Error as e:
+            # Ledger locked or unavailable: still refuse what plainly cannot fit, ignoring other uploads
+            self.ledger_errors += 1
+            current_app.logger.warning(f"Upload reservation ledger unavailable: {e}")
+            reservation_id, reserved = None, 0
+            admitted = admit(0)
+        if not admitted:
+            self.rejected += 1
+            raise InsufficientStorage(nbytes, max(0, free - reserved - self.min_free))
+        self.admitted += 1
+        if reservation_id is not None:
+            g.setdefault('upload_reservations', []).append(reservation_id)
+
+    def _release_request(self, exc):
+        for reservation_id in g.pop('upload_reservations', ()):
+            try:
+                self.ledger.release(reservation_id)
+            except sqlite3.Error as e: # It expires on its own after UPLOAD_RESERVATION_TTL_SECONDS
+                current_app.logger.warning(f"Could not release upload reservation: {e}")
+
+    def stats(self, folder=None):
+        folder = folder or current_app.config['UPLOAD_FOLDER']
+        return {
+            "store": type(self.ledger).__name__ if self.ledger else None,
+            "free_bytes": _free_bytes(folder),
+            "reserved_bytes": self.ledger.reserved(os.stat(folder).st_dev, time.time()) if self.ledger else 0,
+            "min_free_bytes": self.min_free,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "ledger_errors": self.ledger_errors,
+        }
+
+
+disk_space = DiskSpaceAdmission()
+
+
+class UploadsBusy(Exception):
+    """Raised when no upload slot frees up within the queue timeout."""
+
+
+class UploadConcurrency:
+    def __init__(self, app=None):
+        self.slots = None
+        self.max_concurrent = 8
+        self.max_per_user = 2
+        self.queue_timeout = 2.0
+        self.ttl = 3600.0
+        self._lock = threading.Lock()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        store = app.config.get('UPLOAD_RESERVATION_STORE', 'sqlite')
+        if store == 'sqlite':
+            path = app.config.get('UPLOAD_RESERVATION_PATH') or os.path.join(app.instance_path, 'upload_reservations.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.slots = SQLiteSlots(path)
+        elif store == 'memory':
+            self.slots = MemorySlots()
+        else:
+            raise ValueError(f"Unknown UPLOAD_RESERVATION_STORE: {store}")
+        self.max_concurrent = app.config.get('UPLOAD_MAX_CONCURRENT', 8)
+        self.max_per_user = app.config.get('UPLOAD_MAX_CONCURRENT_PER_USER', 2)
+        self.queue_timeout = app.config.get('UPLOAD_QUEUE_TIMEOUT_SECONDS', 2.0)
+        self.ttl = app.config.get('UPLOAD_RESERVATION_TTL_SECONDS', 3600.0)
+        self._reset_stats()
+        app.extensions['upload_slots'] = self
+
+    def _reset_stats(self):
+        self.admitted = 0
+        self.queued = 0 # Admitted after waiting
+        self.rejected = 0
+        self.waiting = 0
+        self.store_errors = 0
+        self.wait_seconds = 0.0
+
+    def _try_acquire(self, user):
+        try:
+            return self.slots.acquire(user, self.max_concurrent, self.max_per_user, self.ttl, time.time())
+        except sqlite3.Error as e: # Fail open, like the rate limiter
+            self.store_errors += 1
+            current_app.logger.warning(f"Upload slot store unavailable, admitting upload: {e}")
+            return ''
+
+    def acquire(self, user):
+        """Return a slot ID for an upload by `user`, waiting up to the queue timeout for one."""
+        slot_id = self._try_acquire(user)
+        if slot_id is not None:
+            self.admitted += 1
+            return slot_id
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        delay = 0.01
+        with self._lock:
+            self.waiting += 1
+        try:
+            while slot_id is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise UploadsBusy()
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, SLOT_POLL_MAX_SECONDS)
+                slot_id = self._try_acquire(user)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        self.admitted += 1
+        self.queued += 1
+        self.wait_seconds += time.monotonic() - started
+        return slot_id
+
+    def release(self, slot_id):
+        if not slot_id:
+            return
+        try:
+            self.slots.release(slot_id)
+        except sqlite3.Error as e: # It expires on its own after UPLOAD_RESERVATION_TTL_SECONDS
+            current_app.logger.warning(f"Could not release upload slot: {e}")
+
+    def limit(self, view):
+        """Decorator for upload views (inside @jwt_required): run the view only while holding a slot."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user = str(get_jwt_identity() or request.remote_addr)
+            try:
+                slot_id = self.acquire(user)
+            except UploadsBusy:
+                return jsonify({"msg": "Too many uploads in progress, please retry shortly"}), 429, \
+                    {'Retry-After': str(max(UPLOAD_RETRY_AFTER_SECONDS, math.ceil(self.queue_timeout)))}
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.release(slot_id)
+        return wrapper
+
+    def stats(self):
+        return {
+            "store": type(self.slots).__name__ if self.slots else None,
+            "in_flight": self.slots.occupancy(time.time()) if self.slots else 0,
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "waiting": self.waiting, # In this worker
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "avg_wait_ms": self.wait_seconds / self.queued * 1000 if self.queued else 0.0,
+            "store_errors": self.store_errors,
+        }
+
+
+upload_slots = UploadConcurrency()
+
+
+def _stream_size(stream):
+    try:
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError): # Not seekable
+        return None
+
+def save_preallocated(file, path, size_hint=None):
+    """Write an uploaded FileStorage to `path`, allocating its blocks before copying.
+
+    Returns `(bytes written, SHA-256 hex digest)`. Raises InsufficientStorage if the filesystem
+    cannot allocate them; the caller removes the file.
+    """
+    size = _stream_size(file.stream) or size_hint
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(out.fileno(), 0, size)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise InsufficientStorage(size, _free_bytes(os.path.dirname(path)))
+                # EOPNOTSUPP/EINVAL: the filesystem can't preallocate; just write
+        while True:
+            chunk = file.stream.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk) # Baseline for the integrity scrubber, while the bytes are in memory anyway
+            out.write(chunk)
+        written = out.tell()
+        out.truncate(written) # Drop any preallocated tail if the size hint was generous
+    return written, digest.hexdigest()
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+from . import db
+from .models import User, UserStats
+
+# Bulk user provisioning.
+#
+# `flask users import` reads a CSV (username,email,password header) or NDJSON file as a stream
+# and works through it in chunks: validate, check uniqueness against the database with one
+# IN query per column, hash the surviving passwords on a process pool, then insert the chunk
+# with a single executemany in its own transaction. A bad row is reported and skipped; it never
+# aborts the rest of the import.
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'ndjson')
+REQUIRED_FIELDS = ('username', 'email', 'password')
+
+def iter_records(stream, fmt):
+    """Yield `(line_number, record)` from a text stream; unparseable lines yield an error string."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+        yield line_number, record if isinstance(record, dict) else "Expected a JSON object"
+
+def _chunks(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UserImporter:
+    def __init__(self, hash_method, workers, chunk_size=None, on_error=lambda line, message: None):
+        self.hash_method = hash_method
+        self.workers = workers
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.on_error = on_error
+        self.imported = 0
+        self.failed = 0
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _error(self, line_number, message):
+        self.failed += 1
+        self.on_error(line_number, message)
+
+    def _hash_all(self, passwords):
+        hash_one = partial(generate_password_hash, method=self.hash_method)
+        if self._pool is None:
+            return [hash_one(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(hash_one, passwords, chunksize=chunksize))
+
+    def _existing(self, column, values):
+        if not values:
+            return set()
+        return {row[0] for row in db.session.execute(select(column).where(column.in_(values)))}
+
+    def _validate(self, chunk):
+        """Return the rows of `chunk` that can be inserted, reporting the rest."""
+        candidates = []
+        seen_usernames, seen_emails = set(), set()
+        for line_number, record in chunk:
+            if isinstance(record, str):
+                self._error(line_number, record)
+                continue
+            values = {name: str(record.get(name) or '').strip() for name in REQUIRED_FIELDS}
+            values['password'] = str(record.get('password') or '') # Passwords are taken verbatim
+            missing = [name for name in REQUIRED_FIELDS if not values[name]]
+            if missing:
+                self._error(line_number, f"Missing {', '.join(missing)}")
+            elif values['username'] in seen_usernames or values['email'] in seen_emails:
+                self._error(line_number, "Duplicate username or email within the file")
+            else:
+                seen_usernames.add(values['username'])
+                seen_emails.add(values['email'])
+                candidates.append((line_number, values))
+
+        taken_usernames = self._existing(User.username, [values['username'] for _, values in candidates])
+        taken_emails = self._existing(User.email, [values['email'] for _, values in candidates])
+        rows = []
+        for line_number, values in candidates:
+            if values['username'] in taken_usernames or values['email'] in taken_emails:
+                self._error(line_number, "Username or email already exists")
+            else:
+                rows.append((line_number, values))
+        return rows
+
+    def _insert(self, rows):
+        """Insert `[(line_number, values)]` in one transaction; returns the new user IDs."""
+        from .sharding import is_sharded
+        users = User.__table__
+        result = db.session.execute(insert(users).returning(users.c.id),
+                                    [{"username": v['username'], "email": v['email'],
+                                      "password_hash": v['password_hash']} for _, v in rows])
+        user_ids = [row[0] for row in result]
+        # Bulk inserts skip the ORM hooks, so create the counter rows here as the User hook would
+        # (when sharded, place_users creates them on each user's shard instead)
+        if not is_sharded():
+            db.session.execute(insert(UserStats.__table__), [{"user_id": user_id} for user_id in user_ids])
+        db.session.commit()
+        return user_ids
+
+    def import_chunk(self, chunk):
+        rows = self._validate(chunk)
+        db.session.rollback() # End the read transaction before the (possibly long) hashing step
+        if not rows:
+            return []
+        for (_, values), password_hash in zip(rows, self._hash_all([values['password'] for _, values in rows])):
+            values['password_hash'] = password_hash
+        try:
+            user_ids = self._insert(rows)
+        except IntegrityError:
+            # Someone signed up with one of these names since the check; retry row by row to find out who
+            db.session.rollback()
+            user_ids = []
+            for line_number, values in rows:
+                try:
+                    user_ids += self._insert([(line_number, values)])
+                except IntegrityError:
+                    db.session.rollback()
+                    self._error(line_number, "Username or email already exists")
+        self.imported += len(user_ids)
+        return user_ids
+
+    def run(self, records, on_chunk=lambda importer: None):
+        from .sharding import place_users
+        for chunk in _chunks(records, self.chunk_size):
+            place_users(self.import_chunk(chunk)) # No-op unless sharded
+            on_chunk(self)
+        return self.imported, self.failed
+
+
+# --- CLI ---
+
+users_cli = AppGroup('users', help='Manage user accounts.')
+
+@users_cli.command('import')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='Input format (default: from the file extension, csv for stdin).')
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Users inserted per transaction.')
+@click.option('--workers', type=int, default=None, help='Hashing processes (default: all cores; 0 hashes inline).')
+def import_command(source, fmt, chunk_size, workers):
+    """Create users from SOURCE, a CSV (username,email,password) or NDJSON file ('-' for stdin)."""
+    if fmt is None:
+        fmt = 'ndjson' if source.endswith(('.ndjson', '.jsonl')) else 'csv'
+    if workers is None:
+        workers = os.cpu_count() or 1
+    started = time.monotonic()
+
+    def report_error(line_number, message):
+        click.echo(f"line {line_number}: {message}", err=True)
+
+    def report_progress(importer):
+        elapsed = time.monotonic() - started
+        click.echo(f"Imported {importer.imported} users, {importer.failed} errors "
+                   f"({importer.imported / elapsed if elapsed else 0:.0f} users/s)")
+
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if source == '-' else open(source, newline='', encoding='utf-8')
+    try:
+        with UserImporter(current_app.config['PASSWORD_HASH_METHOD'], workers, chunk_size, report_error) as importer:
+            imported, failed = importer.run(iter_records(stream, fmt), report_progress)
+    finally:
+        if source != '-':
+            stream.close()
+    click.echo(f"Done. {imported} users imported, {failed} rows rejected in {time.monotonic() - started:.1f}s.")
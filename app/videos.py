@@ -1,17 +1,37 @@
+import datetime
 import os
 import uuid
 import os
 import uuid
-from flask import Blueprint, request, jsonify, current_app, send_file, abort
+from flask import Blueprint, request, jsonify, current_app, abort, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_login import login_required, current_user # Added for session auth
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
-from .models import Video, User
+from .models import Video
 from . import db
+from .serializers import parse_fields, serialize_row, serialize_rows, dumps, json_response
+from .cache import metadata_cache
+from .search import search_all_shards
+from .changes import iter_changes, FEED_MAX_LIMIT
+from .export import iter_export, EXPORT_FORMATS
+from .stats import get_user_stats
+from .sharding import (on_shard, on_user_shard, bind_for_user, find_video, allocate_video_id, is_user_moving,
+                       placement_changed, is_sharded, video_binds)
+from .archive import fetch_video_rows, user_video_rows, find_video_anywhere, restore_video
+from .storage import tombstone_videos
+from .blockcache import block_cache
+from .pacing import stream_pacer, PacingBusy, PACING_RETRY_AFTER_SECONDS
+from .tiering import access_stats, promoter, is_cold, tiering_stats
+from .uploads import disk_space, upload_slots, save_preallocated, InsufficientStorage
 
 videos_bp = Blueprint('videos', __name__)
 
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
+MAX_MULTI_GET_IDS = 500 # Keeps the IN list under SQLite's bound-parameter limit
+SEARCH_DEFAULT_PER_PAGE = 20
+SEARCH_MAX_PER_PAGE = 100
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -19,6 +39,7 @@ def allowed_file(filename):
 
 @videos_bp.route('/upload_video', methods=['POST']) # Changed route to match form and plan
 @jwt_required()
+@upload_slots.limit # Caps concurrent uploads on this host and per user
 def upload_video_route(): # Renamed function to avoid conflict if we had an import named upload_video
     user_id_str = get_jwt_identity()
     try:
@@ -26,6 +47,18 @@ def upload_video_route(): # Renamed function to avoid conflict if we had an impo
     except ValueError:
         return jsonify({"msg": "Invalid user identity in token"}), 400
 
+    if is_user_moving(user_id): # Shard rebalance cutover in progress; it takes a few seconds
+        return jsonify({"msg": "Your videos are being moved, please retry shortly"}), 503, {'Retry-After': '5'}
+
+    # Claim disk space for the upload before reading its body (request.files reads all of it)
+    declared_size = request.content_length or request.headers.get('X-Upload-Size', type=int)
+    if not declared_size:
+        return jsonify({"msg": "Content-Length or X-Upload-Size header required"}), 411
+    try:
+        disk_space.reserve(declared_size)
+    except InsufficientStorage:
+        return jsonify({"msg": "Not enough storage space for this upload"}), 507
+
     if 'video' not in request.files: # Changed 'file' to 'video' to match form
         return jsonify({"msg": "No video file part"}), 400
 
@@ -58,8 +91,7 @@ def upload_video_route(): # Renamed function to avoid conflict if we had an impo
         file_path = os.path.join(user_upload_folder, stored_filename)
 
         try:
-            file.save(file_path)
-            file_size = os.path.getsize(file_path)
+            file_size, content_digest = save_preallocated(file, file_path, declared_size)
 
             new_video = Video(
                 title=title,
@@ -67,19 +99,32 @@ def upload_video_route(): # Renamed function to avoid conflict if we had an impo
                 filename=original_filename, # Original filename from upload
                 file_path=file_path, # Path where it's stored
                 total_size=file_size,
+                content_digest=content_digest,
                 user_id=user_id
             )
-            db.session.add(new_video)
-            db.session.commit()
+            new_video.id = allocate_video_id() # Globally unique ID when sharded, else None (autoincrement)
+            bind_key = bind_for_user(user_id)
+            with on_shard(bind_key):
+                db.session.add(new_video)
+                db.session.flush()
+                if placement_changed(user_id, bind_key): # A shard move began while the body was being read
+                    db.session.rollback()
+                    os.remove(file_path)
+                    return jsonify({"msg": "Your videos are being moved, please retry shortly"}), 503, {'Retry-After': '5'}
+                db.session.commit()
 
-            # It's good practice to return the ID of the created resource
-            return jsonify({
-                "msg": "Video uploaded successfully",
-                "video_id": new_video.id,
-                "title": new_video.title,
-                "file_path": new_video.file_path
-            }), 201
+                # It's good practice to return the ID of the created resource
+                return jsonify({
+                    "msg": "Video uploaded successfully",
+                    "video_id": new_video.id,
+                    "title": new_video.title,
+                    "file_path": new_video.file_path
+                }), 201
 
+        except InsufficientStorage:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return jsonify({"msg": "Not enough storage space for this upload"}), 507
         except Exception as e:
             # Clean up uploaded file if database commit fails
             if os.path.exists(file_path):
@@ -108,9 +153,22 @@ def format_video_metadata(video):
 @videos_bp.route('/<int:video_id>', methods=['GET'])
 @jwt_required()
 def get_video_metadata(video_id):
-    video = Video.query.get(video_id)
-    if not video:
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if metadata_cache.enabled:
+        cache_key = metadata_cache.video_key(video_id, fields)
+        body = metadata_cache.get(cache_key)
+        if body is not None:
+            return json_response(body, 200)
+
+    # Lookup by global ID: asks every shard (just the one database when unsharded), then the archive
+    rows = fetch_video_rows([video_id], fields)
+    if not rows:
         return jsonify({"msg": "Video not found"}), 404
+    row = rows[0][1:]
 
     # Optionally, you might want to restrict access so users can only see their own videos
     # or make it public, depending on requirements. For now, any authenticated user can see any video metadata by ID.
@@ -119,7 +177,116 @@ def get_video_metadata(video_id):
     # if video.user_id != current_user_id:
     #     return jsonify({"msg": "Unauthorized to view this video's metadata"}), 403
 
-    return jsonify(format_video_metadata(video)), 200
+    body = dumps(serialize_row(row, fields))
+    if metadata_cache.enabled:
+        metadata_cache.set(cache_key, body)
+    return json_response(body, 200)
+
+@videos_bp.route('/<int:video_id>', methods=['PATCH'])
+@jwt_required()
+def update_video_metadata(video_id):
+    try:
+        user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity in token"}), 400
+
+    video, bind_key = find_video(video_id)
+    if not video and restore_video(video_id): # Archived videos become hot again when edited
+        video, bind_key = find_video(video_id)
+    if not video:
+        return jsonify({"msg": "Video not found"}), 404
+    if video.user_id != user_id:
+        return jsonify({"msg": "Unauthorized to edit this video"}), 403
+    if is_user_moving(user_id):
+        return jsonify({"msg": "Your videos are being moved, please retry shortly"}), 503, {'Retry-After': '5'}
+
+    data = request.get_json(silent=True) or {}
+    if 'title' in data:
+        if not data['title']:
+            return jsonify({"msg": "Missing title"}), 400
+    with on_shard(bind_key):
+        if 'title' in data:
+            video.title = data['title']
+        if 'description' in data:
+            video.description = data['description']
+        db.session.commit() # Search index and metadata cache are updated from the commit hooks
+
+        return jsonify(format_video_metadata(video)), 200
+
+@videos_bp.route('/<int:video_id>', methods=['DELETE'])
+@jwt_required()
+def delete_video(video_id):
+    try:
+        user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity in token"}), 400
+    if is_user_moving(user_id):
+        return jsonify({"msg": "Your videos are being moved, please retry shortly"}), 503, {'Retry-After': '5'}
+
+    # The row goes now; the file is removed later by `flask storage reclaim`
+    deleted, forbidden, _ = tombstone_videos(user_id, [video_id])
+    if forbidden:
+        return jsonify({"msg": "Unauthorized to delete this video"}), 403
+    if not deleted:
+        return jsonify({"msg": "Video not found"}), 404
+    return jsonify({"msg": "Video deleted", "video_id": video_id}), 202
+
+@videos_bp.route('/delete', methods=['POST'])
+@jwt_required()
+def delete_videos():
+    # POST /videos/delete {"ids": [1, 2, 3]}: deletes the caller's videos among them in one transaction
+    try:
+        user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity in token"}), 400
+    if is_user_moving(user_id):
+        return jsonify({"msg": "Your videos are being moved, please retry shortly"}), 503, {'Retry-After': '5'}
+
+    raw_ids = (request.get_json(silent=True) or {}).get('ids')
+    if not raw_ids:
+        return jsonify({"msg": "Missing ids"}), 400
+    if not isinstance(raw_ids, list):
+        return jsonify({"msg": "ids must be a list"}), 400
+    if len(raw_ids) > MAX_MULTI_GET_IDS:
+        return jsonify({"msg": f"Too many ids (max {MAX_MULTI_GET_IDS})"}), 400
+    try:
+        video_ids = list(dict.fromkeys(int(i) for i in raw_ids))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid video id"}), 400
+
+    deleted, forbidden, not_found = tombstone_videos(user_id, video_ids)
+    return jsonify({"deleted": deleted, "forbidden": forbidden, "not_found": not_found}), 202
+
+@videos_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_videos():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"msg": "Missing search query"}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', SEARCH_DEFAULT_PER_PAGE)), 1), SEARCH_MAX_PER_PAGE)
+    except ValueError:
+        return jsonify({"msg": "Invalid page or per_page"}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # Fetch one extra hit to know whether there is a next page without counting every match
+    hits = search_all_shards(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    has_more = len(hits) > per_page
+    hits = hits[:per_page]
+
+    results = []
+    if hits:
+        rows = fetch_video_rows([video_id for video_id, _ in hits], fields)
+        by_id = {row[0]: serialize_row(row[1:], fields) for row in rows}
+        for video_id, rank in hits:
+            if video_id in by_id:
+                results.append(dict(by_id[video_id], rank=rank))
+
+    return json_response({"results": results, "page": page, "per_page": per_page, "has_more": has_more}, 200)
 
 @videos_bp.route('/user', methods=['GET']) # Changed from /user_videos to /user for brevity
 @jwt_required()
@@ -130,18 +297,221 @@ def get_user_videos():
     except ValueError:
         return jsonify({"msg": "Invalid user identity in token"}), 400
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"msg": "User not found"}), 404 # Should not happen if JWT is valid
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
 
-    videos = Video.query.filter_by(user_id=user_id).order_by(Video.created_at.desc()).all()
+    if metadata_cache.enabled:
+        cache_key = metadata_cache.user_key(user_id, fields)
+        body = metadata_cache.get(cache_key)
+        if body is not None:
+            return json_response(body, 200)
 
-    return jsonify([format_video_metadata(video) for video in videos]), 200
+    # One projected query with the uploader joined in, instead of loading Video objects
+    # and lazily fetching video.uploader for every row. Archived videos come from the same query.
+    with on_user_shard(user_id):
+        rows = user_video_rows(user_id, fields)
+
+    body = dumps(serialize_rows(rows, fields))
+    if metadata_cache.enabled:
+        metadata_cache.set(cache_key, body)
+    return json_response(body, 200)
+
+@videos_bp.route('', methods=['GET', 'POST'])
+@jwt_required()
+def get_videos_metadata():
+    # GET /videos?ids=1,2,3 for short lists, POST /videos {"ids": [1, 2, 3]} for long ones
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        raw_ids = data.get('ids')
+        if isinstance(raw_ids, list) and not all(isinstance(i, (int, str)) and not isinstance(i, bool) for i in raw_ids):
+            return jsonify({"msg": "Invalid video id"}), 400
+        if 'fields' in data:
+            raw_fields = data['fields']
+            if not isinstance(raw_fields, list) or not all(isinstance(f, str) for f in raw_fields):
+                return jsonify({"msg": "fields must be a list of strings"}), 400
+            raw_fields = ','.join(raw_fields)
+        else:
+            raw_fields = request.args.get('fields')
+    else:
+        raw_ids = request.args.get('ids')
+        raw_fields = request.args.get('fields')
+
+    if not raw_ids:
+        return jsonify({"msg": "Missing ids"}), 400
+    if isinstance(raw_ids, str):
+        raw_ids = [i for i in raw_ids.split(',') if i.strip()]
+    if not isinstance(raw_ids, list):
+        return jsonify({"msg": "ids must be a list"}), 400
+    if len(raw_ids) > MAX_MULTI_GET_IDS:
+        return jsonify({"msg": f"Too many ids (max {MAX_MULTI_GET_IDS})"}), 400
+    try:
+        video_ids = [int(i) for i in raw_ids]
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid video id"}), 400
+
+    try:
+        fields = parse_fields(raw_fields)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # Serve what we can from the per-video cache entries, then fetch the rest in one IN query.
+    bodies = {}
+    cache_keys = {}
+    if metadata_cache.enabled:
+        for video_id in set(video_ids):
+            cache_keys[video_id] = metadata_cache.video_key(video_id, fields)
+            body = metadata_cache.get(cache_keys[video_id])
+            if body is not None:
+                bodies[video_id] = body
+
+    missing = [video_id for video_id in set(video_ids) if video_id not in bodies]
+    if missing:
+        # Always select the id so rows can be matched back to the requested order
+        rows = fetch_video_rows(missing, fields)
+        for row in rows:
+            body = dumps(serialize_row(row[1:], fields))
+            bodies[row[0]] = body
+            if metadata_cache.enabled:
+                metadata_cache.set(cache_keys[row[0]], body)
+
+    # Splice the encoded objects together rather than decoding and re-encoding them
+    parts = [bodies.get(video_id) or dumps({"id": video_id, "msg": "Video not found"}) for video_id in video_ids]
+    return json_response(b'[' + b','.join(parts) + b']', 200)
+
+@videos_bp.route('/user/stats', methods=['GET'])
+@jwt_required()
+def get_user_video_stats():
+    try:
+        user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"msg": "Invalid user identity in token"}), 400
+
+    with on_user_shard(user_id):
+        return jsonify(get_user_stats(user_id)), 200
+
+@videos_bp.route('/changes', methods=['GET'])
+@jwt_required()
+def video_changes():
+    # Poll with ?since=<seq of the last line you saw>. An empty body means you are caught up.
+    try:
+        since = max(int(request.args.get('since', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 1000)), 1), FEED_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"msg": "Invalid since or limit"}), 400
+
+    # Each shard has its own change log and cursor, so sharded mirrors poll every shard separately
+    bind_key = request.args.get('shard')
+    if is_sharded() and bind_key not in video_binds():
+        return jsonify({"msg": f"Missing or unknown shard (one of: {', '.join(video_binds())})"}), 400
+
+    settle_seconds = current_app.config.get('CHANGE_FEED_SETTLE_SECONDS')
+    def generate():
+        with on_shard(bind_key if is_sharded() else None):
+            yield from iter_changes(since, limit, settle_seconds=settle_seconds)
+
+    return current_app.response_class(stream_with_context(generate()), status=200, mimetype='application/x-ndjson')
+
+@videos_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_videos():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"msg": f"Unknown export format: {fmt}"}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    filename = f"videos.{fmt}" + ('.gz' if compress else '')
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = current_app.response_class(stream_with_context(iter_export(fields, fmt, compress)), status=200, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@videos_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def metadata_cache_stats():
+    return jsonify(metadata_cache.stats()), 200
+
+@videos_bp.route('/storage/stats', methods=['GET'])
+@jwt_required()
+def storage_stats():
+    return jsonify(disk_space.stats()), 200
+
+@videos_bp.route('/uploads/stats', methods=['GET'])
+@jwt_required()
+def upload_concurrency_stats():
+    return jsonify(upload_slots.stats()), 200
+
+@videos_bp.route('/tiering/stats', methods=['GET'])
+@jwt_required()
+def storage_tiering_stats():
+    return jsonify(tiering_stats()), 200
+
+@videos_bp.route('/stream/cache/stats', methods=['GET'])
+@jwt_required()
+def stream_cache_stats():
+    return jsonify(block_cache.stats()), 200
+
+@videos_bp.route('/stream/pacing/stats', methods=['GET'])
+@jwt_required()
+def stream_pacing_stats():
+    return jsonify(stream_pacer.stats()), 200
+
+def _file_response(video, mimetype):
+    """Serve a video's file, or the single byte range requested, through the block cache and pacer.
+
+    Conditional requests are honoured like send_file does: a matching If-None-Match or
+    If-Modified-Since gets a 304, and a Range whose If-Range no longer matches gets the whole file.
+    """
+    f = open(video.file_path, 'rb') # Held open, so a tier move during the response doesn't cut it short
+    try:
+        stat = os.fstat(f.fileno())
+        etag = f"{video.id}-{stat.st_mtime_ns}-{stat.st_size}"
+        last_modified = datetime.datetime.fromtimestamp(int(stat.st_mtime), datetime.timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            f.close()
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+        if_range = request.if_range
+        byte_range = request.range
+        if (if_range.etag is not None and if_range.etag != etag) or (if_range.date is not None and if_range.date != last_modified):
+            byte_range = None # The client holds another version of the file; partial bytes would mix the two
+        start, stop = 0, stat.st_size
+        if byte_range is not None:
+            start_stop = byte_range.range_for_length(stat.st_size)
+            if start_stop is None:
+                raise RequestedRangeNotSatisfiable(length=stat.st_size)
+            start, stop = start_stop
+        body = stream_pacer.pace(block_cache.iter_range(f, (video.id, stat.st_mtime_ns), start, stop), current_user.id)
+        response = current_app.response_class(body, status=206 if byte_range is not None else 200, mimetype=mimetype)
+    except BaseException:
+        f.close()
+        raise
+    response.call_on_close(f.close)
+    response.content_length = stop - start
+    response.accept_ranges = 'bytes'
+    if byte_range is not None:
+        response.content_range = byte_range.to_content_range_header(stat.st_size)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Content-Disposition'] = f'inline; filename={os.path.basename(video.file_path)}'
+    return response
 
 @videos_bp.route('/stream/<int:video_id>')
 @login_required # Use Flask-Login for session authentication for web page embedding
 def stream_video(video_id):
-    video = Video.query.get_or_404(video_id)
+    video, bind_key = find_video_anywhere(video_id)
+    if video is None:
+        abort(404)
 
     if video.user_id != current_user.id:
         # Optional: Allow admins to view any video, or implement more complex sharing logic later
@@ -149,6 +519,10 @@ def stream_video(video_id):
         current_app.logger.warning(f"Unauthorized attempt to stream video ID {video_id} by user {current_user.id}. Video owner: {video.user_id}")
         abort(403) # Forbidden
 
+    if not os.path.exists(video.file_path):
+        # The tiering job may have moved the file since the row was read; the row has its new home
+        with on_shard(bind_key):
+            db.session.refresh(video)
     if not os.path.exists(video.file_path):
         current_app.logger.error(f"Video file not found for video ID {video_id} at path {video.file_path}")
         abort(404) # Or perhaps 500 if this indicates an internal inconsistency
@@ -163,8 +537,17 @@ def stream_video(video_id):
             mimetype = 'video/ogg'
         # Add other mimetypes as needed
 
+    access_stats.record(video, bind_key)
+    if is_cold(video.file_path):
+        promoter.submit(video, bind_key) # Served from cold storage this time; moved back in the background
+
     try:
-        return send_file(video.file_path, mimetype=mimetype, as_attachment=False) # as_attachment=False for embedding
+        return _file_response(video, mimetype) # Always through the pacer, so egress is metered even unpaced
+    except PacingBusy:
+        return jsonify({"msg": "Too many streams in progress, please retry shortly"}), 503, \
+            {'Retry-After': str(PACING_RETRY_AFTER_SECONDS)}
+    except RequestedRangeNotSatisfiable:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error sending file for video ID {video_id}: {e}")
         abort(500)
@@ -0,0 +1,32 @@
+"""Add content digest and integrity status to videos
+
+Revision ID: 2c7e5a9d4f18
+Revises: 9b4d7e1f3a62
+Create Date: 2026-10-19 17:35:12.604281
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7e5a9d4f18'
+down_revision = '9b4d7e1f3a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ('videos', 'videos_archive'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_digest', sa.String(length=64), nullable=True))
+            batch_op.add_column(sa.Column('integrity_status', sa.String(length=16), nullable=True))
+            batch_op.add_column(sa.Column('verified_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table_name in ('videos_archive', 'videos'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('verified_at')
+            batch_op.drop_column('integrity_status')
+            batch_op.drop_column('content_digest')
@@ -0,0 +1,23 @@
+"""Index revoked_tokens.revoked_at for the overlapping revocation sync
+
+Revision ID: 3e7a1c5f9b02
+Revises: f2b6d9a4c831
+Create Date: 2026-10-19 21:31:08.664190
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7a1c5f9b02'
+down_revision = 'f2b6d9a4c831'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_revoked_tokens_revoked_at'), 'revoked_tokens', ['revoked_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_tokens_revoked_at'), table_name='revoked_tokens')
@@ -0,0 +1,35 @@
+"""Add full-text search index for videos
+
+Revision ID: 4b1f6a2d9c3e
+Revises: cdc5ca307095
+Create Date: 2026-10-19 09:12:41.305518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1f6a2d9c3e'
+down_revision = 'cdc5ca307095'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 virtual table on SQLite, tsvector + GIN index on PostgreSQL.
+    # Run `flask search reindex` afterwards to index existing videos.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS video_search ("
+            "video_id INTEGER PRIMARY KEY REFERENCES videos (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_video_search_document ON video_search USING GIN (document)")
+    else:
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(title, description, tokenize='unicode61')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TABLE IF EXISTS video_search")
+    else:
+        op.execute("DROP TABLE IF EXISTS videos_fts")
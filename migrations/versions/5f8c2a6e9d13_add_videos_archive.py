@@ -0,0 +1,41 @@
+"""Add archive table for old videos
+
+Revision ID: 5f8c2a6e9d13
+Revises: e3a9b7c2d415
+Create Date: 2026-10-19 15:22:40.118356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f8c2a6e9d13'
+down_revision = 'e3a9b7c2d415'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('videos_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('filename', sa.String(length=200), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('file_path', sa.String(length=512), nullable=False),
+    sa.Column('total_size', sa.BigInteger(), nullable=True),
+    sa.Column('is_processed', sa.Boolean(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_videos_archive_user_id_created_at', 'videos_archive',
+                    ['user_id', sa.text('created_at DESC'), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_videos_archive_user_id_created_at', table_name='videos_archive')
+    op.drop_table('videos_archive')
@@ -0,0 +1,25 @@
+"""Index video file paths for storage reconciliation
+
+Revision ID: 6a1d8f3b7e20
+Revises: 2c7e5a9d4f18
+Create Date: 2026-10-19 18:02:47.319560
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1d8f3b7e20'
+down_revision = '2c7e5a9d4f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_videos_file_path', 'videos', ['file_path'], unique=False)
+    op.create_index('ix_videos_archive_file_path', 'videos_archive', ['file_path'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_videos_archive_file_path', table_name='videos_archive')
+    op.drop_index('ix_videos_file_path', table_name='videos')
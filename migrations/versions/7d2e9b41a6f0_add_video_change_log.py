@@ -0,0 +1,42 @@
+"""Add video change log for the change feed
+
+Revision ID: 7d2e9b41a6f0
+Revises: 4b1f6a2d9c3e
+Create Date: 2026-10-19 10:03:17.842907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e9b41a6f0'
+down_revision = '4b1f6a2d9c3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('video_changes',
+    sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('video_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted', sa.Boolean(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    with op.batch_alter_table('video_changes', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_video_changes_video_id'), ['video_id'], unique=False)
+
+    # Seed the log with every existing video so mirrors can bootstrap from since=0
+    op.execute(
+        "INSERT INTO video_changes (video_id, user_id, deleted, changed_at) "
+        "SELECT id, user_id, false, COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) FROM videos ORDER BY id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('video_changes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_video_changes_video_id'))
+
+    op.drop_table('video_changes')
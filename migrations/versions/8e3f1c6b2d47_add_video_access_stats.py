@@ -0,0 +1,30 @@
+"""Add sampled access statistics to videos for storage tiering
+
+Revision ID: 8e3f1c6b2d47
+Revises: d84b2f6c1a95
+Create Date: 2026-10-19 19:16:33.270914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3f1c6b2d47'
+down_revision = 'd84b2f6c1a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ('videos', 'videos_archive'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+            batch_op.add_column(sa.Column('access_count', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    for table_name in ('videos_archive', 'videos'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('access_count')
+            batch_op.drop_column('last_accessed_at')
@@ -0,0 +1,40 @@
+"""Add materialized per-user usage counters
+
+Revision ID: a93c5e7f1b28
+Revises: 7d2e9b41a6f0
+Create Date: 2026-10-19 11:26:05.117334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93c5e7f1b28'
+down_revision = '7d2e9b41a6f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('video_count', sa.Integer(), nullable=False),
+    sa.Column('total_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('processed_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Initial values; `flask stats reconcile` repairs any drift from here on
+    op.execute(
+        "INSERT INTO user_stats (user_id, video_count, total_bytes, processed_count, updated_at) "
+        "SELECT u.id, COUNT(v.id), COALESCE(SUM(v.total_size), 0), "
+        "COALESCE(SUM(CASE WHEN v.is_processed THEN 1 ELSE 0 END), 0), CURRENT_TIMESTAMP "
+        "FROM users u LEFT OUTER JOIN videos v ON v.user_id = u.id GROUP BY u.id"
+    )
+
+
+def downgrade():
+    op.drop_table('user_stats')
@@ -0,0 +1,26 @@
+"""Add composite index for per-user video listings
+
+Revision ID: c51f0d8e2a47
+Revises: a93c5e7f1b28
+Create Date: 2026-10-19 12:40:52.664190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51f0d8e2a47'
+down_revision = 'a93c5e7f1b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (user_id, created_at DESC, id): filter_by(user_id).order_by(created_at desc) without a sort
+    op.create_index('ix_videos_user_id_created_at', 'videos',
+                    ['user_id', sa.text('created_at DESC'), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_videos_user_id_created_at', table_name='videos')
@@ -0,0 +1,32 @@
+"""Add tombstones for deleted videos awaiting file reclamation
+
+Revision ID: d84b2f6c1a95
+Revises: 6a1d8f3b7e20
+Create Date: 2026-10-19 18:41:09.847123
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd84b2f6c1a95'
+down_revision = '6a1d8f3b7e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('video_tombstones',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('video_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('file_path', sa.String(length=512), nullable=False),
+    sa.Column('total_size', sa.BigInteger(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('video_tombstones')
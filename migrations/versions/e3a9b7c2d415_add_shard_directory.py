@@ -0,0 +1,35 @@
+"""Add shard directory and global video ID allocator
+
+Revision ID: e3a9b7c2d415
+Revises: c51f0d8e2a47
+Create Date: 2026-10-19 14:05:17.301842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9b7c2d415'
+down_revision = 'c51f0d8e2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('bind_key', sa.String(length=64), nullable=False),
+    sa.Column('moving', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('video_id_allocations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('video_id_allocations')
+    op.drop_table('user_shards')
@@ -0,0 +1,35 @@
+"""Drop the video_search foreign key so archived videos stay searchable
+
+Revision ID: f2b6d9a4c831
+Revises: 8e3f1c6b2d47
+Create Date: 2026-10-19 21:04:52.418307
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d9a4c831'
+down_revision = '8e3f1c6b2d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL only: the SQLite FTS5 table never had a foreign key.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("ALTER TABLE video_search DROP CONSTRAINT IF EXISTS video_search_video_id_fkey")
+    # The cascade removed the entries of videos archived so far; index them again
+    op.execute(
+        "INSERT INTO video_search (video_id, document) "
+        "SELECT id, setweight(to_tsvector('english', title), 'A') || to_tsvector('english', COALESCE(description, '')) "
+        "FROM videos_archive ON CONFLICT (video_id) DO NOTHING")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DELETE FROM video_search WHERE video_id NOT IN (SELECT id FROM videos)")
+    op.execute("ALTER TABLE video_search ADD CONSTRAINT video_search_video_id_fkey "
+               "FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE")
@@ -7,6 +7,11 @@ os.environ['DATABASE_URL'] = 'sqlite:///./test_app.db'
 # Ensure JWT_SECRET_KEY is set for tests, can be a simple one for testing
 os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret-key'
 os.environ['SECRET_KEY'] = 'test-secret-key'
+# Tests sign up and log in far faster than any real client; tests/test_ratelimit.py enables limits itself
+os.environ['RATE_LIMIT_STORE'] = 'none'
+os.environ['CHANGE_FEED_SETTLE_SECONDS'] = '0' # Feed tests read their own writes at once; tests/test_changes.py covers settling
+os.environ['UPLOAD_RESERVATION_STORE'] = 'memory' # tests/test_uploads.py covers the SQLite ledger
+os.environ['PASSWORD_HASH_WORKERS'] = '0' # Hash inline rather than spawning a pool; tests/test_passwords.py covers the pool
 # Ensure UPLOAD_FOLDER is set and exists for tests
 TEST_UPLOAD_FOLDER = os.path.join(os.getcwd(), 'test_uploads')
 os.environ['UPLOAD_FOLDER'] = TEST_UPLOAD_FOLDER
@@ -64,6 +69,19 @@ def db(app):
         # but create_all/drop_all is simpler for now.
         _db.drop_all()
         _db.create_all()
+        # IDs are reused after drop_all/create_all, so cached responses must not outlive the test
+        from app.cache import metadata_cache
+        from app.identity import identity_cache
+        from app.revocation import token_denylist
+        from app.tiering import access_stats
+        from app.blockcache import block_cache
+        from app.pacing import stream_pacer
+        metadata_cache.clear()
+        identity_cache.clear()
+        token_denylist.clear()
+        access_stats.clear()
+        block_cache.clear()
+        stream_pacer.clear()
 
 
 @pytest.fixture
@@ -110,3 +128,20 @@ def auth_data(client, db): # Renamed from auth_client
     user_info = {'username': user.username, 'email': user.email, 'id': user.id}
 
     return client, access_token, user_info
+
+
+@pytest.fixture
+def upload():
+    """Uploads a video through the API and returns its ID: `upload(client, access_token, title)`."""
+    import io
+
+    def upload(client, access_token, title='Test Video', content=b"video bytes", description=None):
+        data = {'title': title, 'video': (io.BytesIO(content), f"{title.replace(' ', '_')}.mp4")}
+        if description is not None:
+            data['description'] = description
+        response = client.post('/videos/upload_video', data=data, content_type='multipart/form-data',
+                               headers={"Authorization": f"Bearer {access_token}"})
+        assert response.status_code == 201, f"Setup failed for {title}: {response.data.decode()}"
+        return response.get_json()['video_id']
+
+    return upload
@@ -0,0 +1,101 @@
+import datetime
+import json
+from app.archive import archive_batch, restore_video, run_archival
+from app.models import ArchivedVideo, Video
+from app.search import POSTGRES_DDL, unindex_video
+
+
+def _age(db, video_id, days, processed=True):
+    video = db.session.get(Video, video_id)
+    video.created_at = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    video.is_processed = processed
+    db.session.commit()
+
+
+def _cutoff(days=30):
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+
+def test_archival_moves_only_old_processed_videos(auth_data, db, upload):
+    """Test that only processed videos older than the cutoff leave the hot table."""
+    client, access_token, _ = auth_data
+    old_id = upload(client, access_token, 'Old Processed')
+    unprocessed_id = upload(client, access_token, 'Old Unprocessed')
+    new_id = upload(client, access_token, 'New Processed')
+    _age(db, old_id, 400)
+    _age(db, unprocessed_id, 400, processed=False)
+    _age(db, new_id, 1)
+
+    assert run_archival(_cutoff(), pause=0) == 1
+    db.session.expire_all()
+    assert db.session.get(Video, old_id) is None
+    assert db.session.get(ArchivedVideo, old_id).title == 'Old Processed'
+    assert {v.id for v in Video.query.all()} == {unprocessed_id, new_id}
+    assert archive_batch(_cutoff()) == 0
+
+
+def test_reads_fall_back_to_archive(auth_data, db, upload):
+    """Test that metadata, listings, search and multi-get still find archived videos."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    old_id = upload(client, access_token, 'Vintage Clip')
+    new_id = upload(client, access_token, 'Recent Clip')
+    _age(db, old_id, 400)
+    run_archival(_cutoff(), pause=0)
+
+    response = client.get(f'/videos/{old_id}', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'Vintage Clip'
+    assert [v['id'] for v in client.get('/videos/user', headers=headers).get_json()] == [new_id, old_id]
+    assert [v['title'] for v in client.get(f'/videos?ids={old_id},{new_id}&fields=title', headers=headers).get_json()] == \
+        ['Vintage Clip', 'Recent Clip']
+    assert [hit['id'] for hit in client.get('/videos/search?q=vintage', headers=headers).get_json()['results']] == [old_id]
+    assert client.get('/videos/user/stats', headers=headers).get_json()['video_count'] == 2
+    # Archiving is not a delete as far as catalog mirrors are concerned
+    feed = [json.loads(line) for line in client.get('/videos/changes', headers=headers).get_data(as_text=True).splitlines()]
+    assert {change['op'] for change in feed} == {'upsert'}
+    assert {change['video']['id'] for change in feed} == {old_id, new_id}
+
+
+def test_editing_archived_video_restores_it(auth_data, db, upload):
+    """Test that a PATCH on an archived video moves it back to the hot table."""
+    client, access_token, _ = auth_data
+    old_id = upload(client, access_token, 'Dusty Clip')
+    _age(db, old_id, 400)
+    run_archival(_cutoff(), pause=0)
+
+    response = client.patch(f'/videos/{old_id}', json={"title": "Dusted Off"},
+                            headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert db.session.get(ArchivedVideo, old_id) is None
+    assert db.session.get(Video, old_id).title == 'Dusted Off'
+
+
+def test_restored_video_is_searchable(auth_data, db, upload):
+    """Test that a video stays searchable through archive and restore, even if its index entry was lost."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    old_id = upload(client, access_token, 'Forgotten Reel')
+    _age(db, old_id, 400)
+    run_archival(_cutoff(), pause=0)
+    assert [hit['id'] for hit in client.get('/videos/search?q=forgotten', headers=headers).get_json()['results']] == [old_id]
+    assert not any('REFERENCES videos' in statement for statement in POSTGRES_DDL) # No cascade from archival deletes
+
+    with db.engine.begin() as connection:
+        unindex_video(connection, old_id) # As an ON DELETE CASCADE used to on PostgreSQL
+    assert restore_video(old_id)
+    assert [hit['id'] for hit in client.get('/videos/search?q=forgotten', headers=headers).get_json()['results']] == [old_id]
+
+
+def test_archive_cli_respects_max_batches(auth_data, db, runner, upload):
+    """Test that `flask archive run` works in batches and can stop early."""
+    client, access_token, _ = auth_data
+    for i in range(3):
+        _age(db, upload(client, access_token, f'Batch {i}'), 400)
+
+    result = runner.invoke(args=['archive', 'run', '--older-than-days', '30', '--batch-size', '2',
+                                 '--pause', '0', '--max-batches', '1'])
+    assert result.exit_code == 0, result.output
+    assert "Done. 2 videos" in result.output
+    assert ArchivedVideo.query.count() == 2 and Video.query.count() == 1
@@ -0,0 +1,86 @@
+import threading
+import time
+from app.blockcache import BlockCache, block_cache
+
+
+def _small_cache(blocks, block_size=4):
+    cache = BlockCache()
+    cache.max_bytes, cache.block_size = blocks * block_size, block_size
+    cache.clear()
+    return cache
+
+
+def test_admission_keeps_hot_blocks():
+    """Test that a scan of one-off blocks does not evict blocks that are requested repeatedly."""
+    cache = _small_cache(2)
+    for _ in range(3):
+        for key in ('hot-a', 'hot-b'):
+            cache.get_block(key, lambda: b"HOT!")
+    for n in range(20):
+        cache.get_block(f"scan-{n}", lambda: b"scan")
+
+    reads = []
+    for key in ('hot-a', 'hot-b'):
+        cache.get_block(key, lambda: reads.append(key) or b"HOT!")
+    assert reads == []
+    stats = cache.stats()
+    assert (stats['rejected'], stats['evictions'], stats['blocks']) == (20, 0, 2)
+    assert stats['bytes_saved'] == 4 * 6
+
+
+def test_concurrent_misses_share_one_read():
+    """Test that requests missing the same block at once wait for a single read."""
+    cache = _small_cache(4)
+    reads = []
+
+    def slow_read():
+        reads.append(1)
+        time.sleep(0.2)
+        return b"data"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_block('viral', slow_read))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(reads) == 1 and results == [b"data"] * 5
+    assert (cache.stats()['misses'], cache.stats()['coalesced']) == (1, 4)
+
+
+def test_stream_ranges_from_cache(auth_data, db, monkeypatch, upload):
+    """Test that streams and range requests are served from aligned cached blocks."""
+    client, access_token, _ = auth_data
+    content = bytes(range(48))
+    video_id = upload(client, access_token, 'Viral', content=content)
+    client.post('/auth/login', data={'identifier': 'testuser', 'password': 'password123'})
+    monkeypatch.setattr(block_cache, 'block_size', 16)
+
+    response = client.get(f'/videos/stream/{video_id}')
+    assert response.status_code == 200 and response.data == content
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    response = client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=10-20'})
+    assert response.status_code == 206 and response.data == content[10:21]
+    assert response.headers['Content-Range'] == 'bytes 10-20/48'
+    assert client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=100-'}).status_code == 416
+
+    stats = client.get('/videos/stream/cache/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert (stats['misses'], stats['hits']) == (3, 2) # Blocks 0 and 1 again for the range
+    assert stats['bytes_saved'] == 32 and stats['hit_ratio'] == 0.4
+
+
+def test_stream_conditional_requests(auth_data, db, upload):
+    """Test that cached streams answer revalidation with 304 and ignore ranges of a stale If-Range."""
+    client, access_token, _ = auth_data
+    content = b"conditional video bytes"
+    video_id = upload(client, access_token, 'Conditional', content=content)
+    client.post('/auth/login', data={'identifier': 'testuser', 'password': 'password123'})
+
+    first = client.get(f'/videos/stream/{video_id}')
+    etag, last_modified = first.headers['ETag'], first.headers['Last-Modified']
+    assert client.get(f'/videos/stream/{video_id}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/videos/stream/{video_id}', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    stale = client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale-etag"'})
+    assert stale.status_code == 200 and stale.data == content
+    current = client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert current.status_code == 206 and current.data == content[:10]
@@ -0,0 +1,91 @@
+from app.cache import LRUBackend, SQLiteBackend, metadata_cache
+
+
+def test_video_metadata_served_from_cache(auth_data, db, upload):
+    """Test that a repeated metadata request is a cache hit with the same body."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Cached Video')
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    first = client.get(f'/videos/{video_id}', headers=headers)
+    second = client.get(f'/videos/{video_id}', headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert metadata_cache.hits == 1
+    assert metadata_cache.misses == 1
+
+
+def test_upload_invalidates_user_listing(auth_data, db, upload):
+    """Test that uploading a video invalidates the cached listing for its owner."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    upload(client, access_token, 'First Video')
+
+    assert len(client.get('/videos/user', headers=headers).get_json()) == 1
+    upload(client, access_token, 'Second Video')
+    assert len(client.get('/videos/user', headers=headers).get_json()) == 2
+
+
+def test_processing_update_invalidates_video(auth_data, db, upload):
+    """Test that committing a change to a Video evicts its cached metadata."""
+    from app.models import Video
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    video_id = upload(client, access_token, 'Processing Video')
+
+    assert client.get(f'/videos/{video_id}', headers=headers).get_json()['is_processed'] is False
+    video = db.session.get(Video, video_id)
+    video.is_processed = True
+    db.session.commit()
+    assert client.get(f'/videos/{video_id}', headers=headers).get_json()['is_processed'] is True
+
+
+def test_cache_stats_endpoint(auth_data, db):
+    """Test that the cache counters are exposed."""
+    client, access_token, _ = auth_data
+    response = client.get('/videos/cache/stats', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert stats['backend'] == 'LRUBackend'
+    assert {'hits', 'misses', 'evictions', 'hit_ratio', 'size_bytes'} <= set(stats)
+
+
+def test_lru_backend_evicts_least_recently_used():
+    """Test that the LRU stays under its byte cap by dropping the coldest entry."""
+    backend = LRUBackend(max_bytes=10)
+    assert backend.set('a', b'aaaa') == 0
+    assert backend.set('b', b'bbbb') == 0
+    backend.get('a') # 'b' is now least recently used
+    assert backend.set('c', b'cccc') == 1
+    assert backend.get('b') is None
+    assert backend.get('a') == b'aaaa'
+    assert backend.size() <= 10
+
+
+def test_lru_backend_expires_entries_and_versions(monkeypatch):
+    """Test that entries expire after the TTL, and version counters are forgotten once nothing under them can be live."""
+    clock = [1000.0]
+    monkeypatch.setattr('app.cache.time.monotonic', lambda: clock[0])
+    backend = LRUBackend(max_bytes=1024, ttl=30)
+    backend.bump('video:1')
+    backend.set('video:1:v1', b'old')
+    clock[0] += 31
+    assert backend.get('video:1:v1') is None # Another worker's edit is picked up within the TTL
+    assert backend.size() == 0
+
+    backend.bump('video:2') # Forgets video:1, last bumped more than a TTL ago
+    assert list(backend._versions) == ['video:2']
+    assert backend.version('video:1') == 0
+    backend.bump('video:1')
+    assert backend.version('video:1') == 3 # Never a version it had before
+
+
+def test_sqlite_backend_shared_between_instances(tmp_path):
+    """Test that two backends on the same file (e.g. two workers) see each other's writes."""
+    path = str(tmp_path / 'cache.db')
+    worker_a = SQLiteBackend(path, max_bytes=1024)
+    worker_b = SQLiteBackend(path, max_bytes=1024)
+    worker_a.set('video:1:v0:id', b'{"id":1}')
+    assert worker_b.get('video:1:v0:id') == b'{"id":1}'
+    worker_b.bump('user:1')
+    assert worker_a.version('user:1') == 1
@@ -0,0 +1,76 @@
+import datetime
+import json
+from app.models import Video, VideoChange
+
+
+def _feed(client, access_token, query=''):
+    response = client.get(f'/videos/changes{query}', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.data.splitlines()]
+
+
+def test_change_feed_lists_uploads_in_order(auth_data, db, upload):
+    """Test that uploads appear in the feed as upserts with full metadata."""
+    client, access_token, user_info = auth_data
+    first_id = upload(client, access_token, 'Feed One')
+    second_id = upload(client, access_token, 'Feed Two')
+
+    changes = _feed(client, access_token)
+    assert [c['video']['id'] for c in changes] == [first_id, second_id]
+    assert all(c['op'] == 'upsert' for c in changes)
+    assert changes[0]['video']['uploader_username'] == user_info['username']
+    assert changes[0]['seq'] < changes[1]['seq']
+
+
+def test_change_feed_resumes_from_cursor(auth_data, db, upload):
+    """Test that ?since= only returns later changes, and an edit shows up again."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Cursor Video')
+    cursor = _feed(client, access_token)[-1]['seq']
+    assert _feed(client, access_token, f'?since={cursor}') == []
+
+    client.patch(f'/videos/{video_id}', json={'title': 'Renamed'}, headers={"Authorization": f"Bearer {access_token}"})
+    changes = _feed(client, access_token, f'?since={cursor}')
+    assert len(changes) == 1
+    assert changes[0]['video']['title'] == 'Renamed'
+
+
+def test_change_feed_tombstones_deleted_videos(auth_data, db, upload):
+    """Test that deleting a Video row emits a delete tombstone."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Doomed Video')
+    db.session.delete(db.session.get(Video, video_id))
+    db.session.commit()
+
+    changes = _feed(client, access_token)
+    assert changes == [{"seq": changes[0]['seq'], "op": "delete", "id": video_id}]
+
+
+def test_change_feed_limit_and_batches(auth_data, db, monkeypatch, upload):
+    """Test that limit caps the response even when it spans several batches."""
+    import app.changes
+    monkeypatch.setattr(app.changes, 'FEED_BATCH_SIZE', 2)
+    client, access_token, _ = auth_data
+    for i in range(5):
+        upload(client, access_token, f'Batch Video {i}')
+
+    assert len(_feed(client, access_token, '?limit=3')) == 3
+    assert len(_feed(client, access_token)) == 5
+
+
+def test_change_feed_holds_cursor_behind_recent_changes(app, auth_data, db, monkeypatch, upload):
+    """Test that the feed stops at the first change that may still have slower transactions behind it."""
+    monkeypatch.setitem(app.config, 'CHANGE_FEED_SETTLE_SECONDS', 60)
+    client, access_token, _ = auth_data
+    ids = [upload(client, access_token, f'Settling {n}') for n in range(3)]
+    changes = {change.video_id: change for change in VideoChange.query.all()}
+    an_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    changes[ids[0]].changed_at = changes[ids[2]].changed_at = an_hour_ago # The middle one is still recent
+    db.session.commit()
+
+    feed = _feed(client, access_token)
+    assert [c['video']['id'] for c in feed] == [ids[0]] # Not past the recent change, though the next one is old
+    changes[ids[1]].changed_at = an_hour_ago
+    db.session.commit()
+    assert [c['video']['id'] for c in _feed(client, access_token, f"?since={feed[-1]['seq']}")] == ids[1:]
@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, text
+from app.engine import apply_sqlite_pragmas, postgres_engine_options
+
+
+def test_sqlite_pragmas_applied_on_connect(db):
+    """Test that the app's SQLite connections run with the tuned pragmas."""
+    connection = db.session.connection()
+    assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+    assert connection.execute(text('PRAGMA synchronous')).scalar() == 1 # NORMAL
+    assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+
+
+def test_default_profile_leaves_sqlite_alone(tmp_path):
+    """Test that the default profile keeps SQLite's rollback journal."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'plain.db'}")
+    apply_sqlite_pragmas(engine, 'default')
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'delete'
+    engine.dispose()
+
+
+def test_postgres_pool_options_from_env(monkeypatch):
+    """Test that pool settings come from the profile with environment overrides."""
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'false')
+    options = postgres_engine_options('tuned')
+    assert options['pool_size'] == 3
+    assert options['pool_pre_ping'] is False
+    assert options['max_overflow'] == 20
@@ -0,0 +1,60 @@
+import csv
+import gzip
+import io
+import json
+from app.export import iter_export
+
+
+def test_export_ndjson(auth_data, db, upload):
+    """Test that the export streams one JSON object per video, in id order."""
+    client, access_token, _ = auth_data
+    ids = [upload(client, access_token, f'Export {i}') for i in range(3)]
+
+    response = client.get('/videos/export', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename=videos.ndjson'
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [row['id'] for row in rows] == ids
+
+
+def test_export_csv_gzip_with_fields(auth_data, db, upload):
+    """Test CSV output with a field subset, gzipped on the fly."""
+    client, access_token, _ = auth_data
+    upload(client, access_token, 'Comma, in title')
+
+    response = client.get('/videos/export?format=csv&gzip=1&fields=id,title',
+                          headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    rows = list(csv.reader(io.StringIO(gzip.decompress(response.data).decode('utf-8'))))
+    assert rows[0] == ['id', 'title']
+    assert rows[1][1] == 'Comma, in title'
+
+
+def test_export_rejects_unknown_format(auth_data, db):
+    """Test that an unsupported format is rejected before streaming starts."""
+    client, access_token, _ = auth_data
+    response = client.get('/videos/export?format=xml', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 400
+
+
+def test_export_chunks_are_bounded(auth_data, db, upload):
+    """Test that output is flushed in chunks rather than built up in one piece."""
+    client, access_token, _ = auth_data
+    for i in range(5):
+        upload(client, access_token, f'Chunk {i}')
+    chunks = list(iter_export(['id', 'title'], 'ndjson', chunk_size=40))
+    assert len(chunks) > 1
+    assert len(b''.join(chunks).splitlines()) == 5
+
+
+def test_export_cli(auth_data, db, runner, tmp_path, upload):
+    """Test `flask export videos` writes the file."""
+    client, access_token, _ = auth_data
+    upload(client, access_token, 'CLI Export')
+    output = tmp_path / 'videos.ndjson'
+
+    result = runner.invoke(args=['export', 'videos', '-o', str(output)])
+    assert result.exit_code == 0, result.output
+    assert json.loads(output.read_text().splitlines()[0])['title'] == 'CLI Export'
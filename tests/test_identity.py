@@ -0,0 +1,54 @@
+from sqlalchemy import event
+from app.identity import identity_cache
+from app.models import User
+
+
+def _user_selects(db, action):
+    """Run `action` and return how many SELECTs against users it issued."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM users' in statement:
+            statements.append(statement)
+    engine = db.engines[None]
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        action()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def test_jwt_requests_reuse_cached_identity(auth_data, db):
+    """Test that only the first authenticated request loads the user from the database."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    client.get('/videos/user/stats', headers=headers)
+    before = identity_cache.stats()
+
+    assert _user_selects(db, lambda: [client.get('/videos/user/stats', headers=headers) for _ in range(3)]) == 0
+    stats = client.get('/auth/cache/stats', headers=headers).get_json()
+    assert stats['hits'] >= before['hits'] + 3
+    assert stats['saved_query_ms'] > 0
+
+
+def test_user_update_invalidates_identity(auth_data, db):
+    """Test that a committed change to the user row is visible on the next lookup."""
+    _, _, user_info = auth_data
+    assert identity_cache.get_user(user_info['id']).username == 'testuser'
+    db.session.remove()
+
+    user = db.session.get(User, user_info['id'])
+    user.username = 'renamed'
+    db.session.commit()
+    db.session.remove()
+
+    assert identity_cache.get_user(user_info['id']).username == 'renamed'
+
+
+def test_expired_identity_is_reloaded(auth_data, db, monkeypatch):
+    """Test that entries older than the TTL are not served."""
+    _, _, user_info = auth_data
+    monkeypatch.setattr(identity_cache, 'ttl', -1) # Every entry is born expired
+    identity_cache.get_user(user_info['id'])
+    db.session.remove()
+    assert _user_selects(db, lambda: identity_cache.get_user(user_info['id'])) == 1
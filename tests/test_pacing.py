@@ -0,0 +1,113 @@
+import pytest
+from app.blockcache import block_cache
+from app.pacing import TokenBucket, stream_pacer
+
+CONTENT = bytes(range(48))
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping advances the clock instantly."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+def test_token_bucket_burst_then_rate():
+    """Test that a bucket lets its burst through at once and charges anything beyond it in time."""
+    bucket = TokenBucket(rate=10, burst=20)
+    assert bucket.take(20, bucket.updated) == 0.0
+    assert bucket.take(5, bucket.updated) == 0.5
+    assert bucket.take(5, bucket.updated + 1) == 0.0 # Refilled 10 while waiting
+    assert TokenBucket(0, 0).take(10 ** 9, 0) == 0.0
+
+
+@pytest.fixture
+def paced(auth_data, monkeypatch, upload):
+    """A logged-in client with one 48-byte video, pacing on and a fake clock."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Paced', content=CONTENT)
+    client.post('/auth/login', data={'identifier': 'testuser', 'password': 'password123'})
+    monkeypatch.setattr(stream_pacer, 'enabled', True)
+    monkeypatch.setattr(stream_pacer, 'burst_seconds', 1)
+    monkeypatch.setattr(block_cache, 'block_size', 16)
+    clock = FakeClock()
+    monkeypatch.setattr('app.pacing.time', clock)
+    stream_pacer.clear() # Buckets on the fake clock
+    return client, access_token, video_id, clock
+
+
+def test_connection_paced_to_bitrate_after_burst(paced, monkeypatch):
+    """Test that a range response goes out at the bitrate once the startup burst is spent."""
+    client, access_token, video_id, clock = paced
+    monkeypatch.setattr(stream_pacer, 'bitrate', 64) # 8 bytes/s, 8 bytes of burst
+    monkeypatch.setattr(stream_pacer, 'pace_factor', 1)
+    monkeypatch.setattr(stream_pacer, 'user_rate', 0)
+
+    response = client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=0-23'})
+    assert response.status_code == 206 and response.data == CONTENT[:24]
+    assert clock.slept == 2.0 # 16 bytes past the burst
+    stats = client.get('/videos/stream/pacing/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert stats['bytes_sent'] == 24 and stats['active_streams'] == 0
+    assert stats['egress_bytes_per_second'] > 0
+
+
+def test_user_bucket_shared_across_connections(paced, monkeypatch):
+    """Test that reconnecting does not reset a user's allowance, with or without the block cache."""
+    client, _, video_id, clock = paced
+    monkeypatch.setattr(stream_pacer, 'pace_factor', 0) # No per-connection limit
+    monkeypatch.setattr(stream_pacer, 'user_rate', 8)
+    monkeypatch.setattr(block_cache, 'max_bytes', 0)
+
+    assert client.get(f'/videos/stream/{video_id}', headers={'Range': 'bytes=0-15'}).data == CONTENT[:16]
+    assert clock.slept == 1.0
+    assert client.get(f'/videos/stream/{video_id}').data == CONTENT
+    assert clock.slept == 7.0 # (16 + 48 - 8) / 8
+
+
+def test_egress_ceiling(paced, monkeypatch):
+    """Test that the process-wide ceiling holds even with per-connection and per-user limits off."""
+    client, _, video_id, clock = paced
+    monkeypatch.setattr(stream_pacer, 'pace_factor', 0)
+    monkeypatch.setattr(stream_pacer, 'user_rate', 0)
+    monkeypatch.setattr(stream_pacer, 'max_egress', 8)
+    stream_pacer.clear()
+
+    assert client.get(f'/videos/stream/{video_id}').data == CONTENT
+    assert clock.slept == 5.0 # One second's worth up front, the other 40 bytes at 8 bytes/s
+
+
+def test_egress_metered_with_pacing_and_cache_off(paced, monkeypatch):
+    """Test that plain streams are still counted in the egress stats."""
+    client, access_token, video_id, clock = paced
+    monkeypatch.setattr(stream_pacer, 'enabled', False)
+    monkeypatch.setattr(block_cache, 'max_bytes', 0)
+
+    response = client.get(f'/videos/stream/{video_id}')
+    assert response.status_code == 200 and response.data == CONTENT
+    assert clock.slept == 0.0
+    stats = client.get('/videos/stream/pacing/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert stats['bytes_sent'] == len(CONTENT) and stats['streams'] == 1
+
+
+def test_paced_streams_capped(paced, monkeypatch):
+    """Test that paced streams beyond the cap get a 503 and that closing a stream frees its slot."""
+    client, access_token, video_id, clock = paced
+    monkeypatch.setattr(stream_pacer, 'max_paced', 1)
+
+    first = client.get(f'/videos/stream/{video_id}', buffered=False)
+    assert first.status_code == 200
+    busy = client.get(f'/videos/stream/{video_id}')
+    assert busy.status_code == 503 and busy.headers['Retry-After']
+    first.close() # Before a single chunk was read, as after a HEAD or a dropped client
+    with client.get(f'/videos/stream/{video_id}') as response:
+        assert response.data == CONTENT
+    stats = client.get('/videos/stream/pacing/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert stats['paced_streams'] == 0 and stats['rejected_streams'] == 1
@@ -0,0 +1,61 @@
+from werkzeug.security import check_password_hash, generate_password_hash
+from app.models import User
+from app.passwords import password_hasher
+
+
+def _login(client, password="password123"):
+    return client.post('/auth/login', json={"identifier": "testuser", "password": password})
+
+
+def test_login_rehashes_outdated_hash(auth_data, db):
+    """Test that a hash made with old parameters is upgraded on the next successful login."""
+    client, _, user_info = auth_data
+    user = db.session.get(User, user_info['id'])
+    user.password_hash = generate_password_hash("password123", method='pbkdf2:sha256:1000')
+    db.session.commit()
+
+    assert _login(client, "wrong password").status_code == 401
+    assert db.session.get(User, user_info['id']).password_hash.startswith('pbkdf2:sha256:1000$')
+
+    assert _login(client).status_code == 200
+    db.session.expire_all()
+    upgraded = db.session.get(User, user_info['id']).password_hash
+    assert upgraded.split('$', 1)[0] == password_hasher.prefix
+    assert not password_hasher.needs_rehash(upgraded)
+    assert _login(client).status_code == 200
+
+
+def test_hashing_on_process_pool(monkeypatch):
+    """Test that with PASSWORD_HASH_WORKERS set, hashes and checks run on the spawned pool."""
+    monkeypatch.setattr(password_hasher, 'workers', 1)
+    password_hasher.shutdown()
+    try:
+        hashed = password_hasher.hash("pooled")
+        assert password_hasher._pool is not None
+        assert check_password_hash(hashed, "pooled")
+        assert password_hasher.verify(hashed, "pooled") and not password_hasher.verify(hashed, "wrong")
+    finally:
+        password_hasher.shutdown()
+
+
+def test_login_rejected_fast_when_hashing_saturated(auth_data, db):
+    """Test that logins get a 503 with Retry-After while every hashing slot is taken."""
+    client, access_token, _ = auth_data
+    taken = 0
+    while password_hasher._slots.acquire(blocking=False):
+        taken += 1
+    try:
+        response = _login(client)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert client.post('/auth/signup', json={"username": "late", "email": "late@example.com",
+                                                 "password": "pw"}).status_code == 503
+    finally:
+        for _ in range(taken):
+            password_hasher._slots.release()
+
+    assert _login(client).status_code == 200
+    stats = client.get('/auth/hashing/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert stats['rejected'] >= 2
+    assert stats['calls'] >= 2 # Signup and logins in this test
+    assert stats['hash']['max_ms'] > 0
@@ -0,0 +1,105 @@
+import datetime
+import io
+import time
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from app.ratelimit import DEFAULT_POLICIES, MemoryStore, Policy, SQLiteStore, gcra, rate_limiter
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Enable the limiter on the test app with an in-memory store and the given policies."""
+    def enable(**policies):
+        monkeypatch.setattr(rate_limiter, 'store', MemoryStore())
+        monkeypatch.setattr(rate_limiter, 'policies', {endpoint: Policy.parse(spec) for endpoint, spec in policies.items()})
+        rate_limiter._reset_stats()
+    return enable
+
+
+def _login(client):
+    return client.post('/auth/login', json={"identifier": "testuser", "password": "password123"})
+
+
+def test_login_limited_per_ip(auth_data, limits):
+    """Test that logins beyond the burst get a 429 with Retry-After."""
+    client, _, _ = auth_data
+    limits(**{'auth.login': '2/minute @ip'})
+    assert [_login(client).status_code for _ in range(3)] == [200, 200, 429]
+    assert int(_login(client).headers['Retry-After']) >= 1
+    assert rate_limiter.stats()['limited'] == 2
+
+
+def test_limits_are_per_user(auth_data, limits):
+    """Test that @user policies give every JWT user their own allowance."""
+    client, access_token, _ = auth_data
+    client.post('/auth/signup', json={"username": "other", "email": "other@example.com", "password": "pw"})
+    other_token = client.post('/auth/login', json={"identifier": "other", "password": "pw"}).get_json()['access_token']
+    limits(**{'auth.protected': '1/minute @user'})
+
+    first = {"Authorization": f"Bearer {access_token}"}
+    second = {"Authorization": f"Bearer {other_token}"}
+    assert client.get('/auth/protected', headers=first).status_code == 200
+    assert client.get('/auth/protected', headers=first).status_code == 429
+    assert client.get('/auth/protected', headers=second).status_code == 200
+
+
+def test_user_key_needs_no_lookup(app, auth_data, db):
+    """Test that @user keys come from the token alone: no database access, expired tokens still count."""
+    _, _, user_info = auth_data
+    policy = Policy.parse('1/minute @user')
+    expired = create_access_token(identity=str(user_info['id']), expires_delta=datetime.timedelta(seconds=-1))
+    statements = []
+    record = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        with app.test_request_context(headers={"Authorization": f"Bearer {expired}"}):
+            assert rate_limiter._client_key(policy) == f"user:{user_info['id']}"
+        with app.test_request_context(headers={"Authorization": "Bearer forged"}, environ_base={'REMOTE_ADDR': '10.0.0.9'}):
+            assert rate_limiter._client_key(policy) == "ip:10.0.0.9"
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert statements == []
+
+
+def test_default_policy_limits_uploads(auth_data, limits):
+    """Test that the default upload policy applies to the upload route: ten quick uploads, then 429."""
+    client, access_token, _ = auth_data
+    limits(**DEFAULT_POLICIES)
+    statuses = [client.post('/videos/upload_video', data={
+        'title': f"Burst {n}", 'video': (io.BytesIO(b"x"), f"burst_{n}.mp4")
+    }, content_type='multipart/form-data', headers={"Authorization": f"Bearer {access_token}"}).status_code for n in range(11)]
+    assert statuses == [201] * 10 + [429]
+
+
+def test_store_failure_fails_open(auth_data, limits, monkeypatch):
+    """Test that requests are allowed when the limit store errors."""
+    client, _, _ = auth_data
+    limits(**{'auth.login': '1/minute @ip'})
+    def broken(*args):
+        raise OSError("disk I/O error")
+    monkeypatch.setattr(rate_limiter.store, 'hit', broken)
+    assert [_login(client).status_code for _ in range(3)] == [200, 200, 200]
+    assert rate_limiter.stats()['store_errors'] == 3
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    """Test that two store instances (as two workers would have) share one budget."""
+    policy = Policy.parse('3/minute')
+    first, second = SQLiteStore(str(tmp_path / 'limits.db')), SQLiteStore(str(tmp_path / 'limits.db'))
+    now = time.time()
+    results = [store.hit('k', policy, now)[0] for store in (first, second, first, second)]
+    assert results == [True, True, True, False]
+
+
+def test_gcra_refills_at_the_sustained_rate():
+    """Test burst then steady-state behaviour of the algorithm."""
+    policy = Policy.parse('60/minute burst 2') # One request per second, bursts of two
+    tat, now = None, 1000.0
+    allowed = []
+    for _ in range(3):
+        ok, tat, _ = gcra(tat, now, policy)
+        allowed.append(ok)
+    assert allowed == [True, True, False]
+    ok, tat, _ = gcra(tat, now + 1.0, policy)
+    assert ok
@@ -0,0 +1,80 @@
+import datetime
+from flask_jwt_extended import decode_token
+from app.models import RevokedToken
+from app.revocation import BloomFilter, TokenDenylist, token_denylist
+
+
+def _second_worker(app):
+    """A denylist with its own filter, as another worker process would have."""
+    other = TokenDenylist()
+    other.init_app(app)
+    other.sync_interval = 0
+    app.extensions['token_denylist'] = token_denylist
+    return other
+
+
+def test_revoked_token_is_rejected(auth_data, db):
+    """Test that a revoked token stops working while a fresh one still does."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get('/auth/protected', headers=headers).status_code == 200
+
+    assert client.post('/auth/revoke', headers=headers).status_code == 200
+    response = client.get('/auth/protected', headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()['sub_status'] == 45
+
+    fresh = client.post('/auth/login', json={"identifier": "testuser", "password": "password123"}).get_json()['access_token']
+    assert client.get('/auth/protected', headers={"Authorization": f"Bearer {fresh}"}).status_code == 200
+    stats = client.get('/auth/revocation/stats', headers={"Authorization": f"Bearer {fresh}"}).get_json()
+    assert stats['entries'] == 1
+    assert stats['possible_matches'] >= 1
+
+
+def test_revocation_syncs_to_other_workers(app, auth_data, db):
+    """Test that another worker picks up a revocation and skips the database for other tokens."""
+    _, access_token, _ = auth_data
+    other = _second_worker(app)
+    payload = decode_token(access_token)
+    assert other.is_revoked(payload) is False
+    assert other.possible_matches == 0 # Answered by the filter alone
+
+    token_denylist.revoke(payload)
+    assert other.is_revoked(payload) is True
+    assert other.syncs >= 1 and other.rebuilds == 1
+
+
+def test_rebuild_drops_expired_revocations(app, db):
+    """Test that revocations of tokens past their expiry are purged when the filter is rebuilt."""
+    past = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    db.session.add(RevokedToken(jti='expired-jti', expires_at=past))
+    db.session.commit()
+
+    other = _second_worker(app)
+    assert other.is_revoked({'jti': 'expired-jti'}) is False
+    assert RevokedToken.query.count() == 0
+    assert other.stats()['entries'] == 0
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test the filter's guarantees: every added item matches, and few others do."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f'jti-{i}')
+    assert all(f'jti-{i}' in bloom for i in range(1000))
+    false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+    assert false_positives < 300 # ~1% expected
+
+
+def test_sync_catches_revocations_committed_out_of_order(app, db):
+    """Test that a revocation whose ID is below a worker's cursor is still picked up."""
+    other = _second_worker(app)
+    db.session.add(RevokedToken(id=100, jti='committed-first'))
+    db.session.commit()
+    assert other.is_revoked({'jti': 'committed-first'}) is True
+    assert other._cursor == 100
+
+    db.session.add(RevokedToken(id=50, jti='committed-late')) # Took its ID earlier, committed later
+    db.session.commit()
+    assert other.is_revoked({'jti': 'committed-late'}) is True
+    assert other.stats()['entries'] == 2 # Re-read rows are not counted twice
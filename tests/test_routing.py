@@ -0,0 +1,82 @@
+import io
+import pytest
+from sqlalchemy import insert, select
+from app import create_app, db as _db
+from app.cache import metadata_cache
+from app.models import User, Video
+
+
+@pytest.fixture
+def replica_app(app, tmp_path, monkeypatch):
+    """An app with a primary and one replica, as two separate SQLite files that never sync."""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setenv('METADATA_CACHE_BACKEND', 'none') # Every read must reach a database
+    replica_app = create_app()
+    with replica_app.app_context():
+        _db.create_all()
+        _db.metadata.create_all(_db.engines['replica_0'])
+        yield replica_app
+        _db.session.remove()
+        for engine in _db.engines.values():
+            engine.dispose()
+    # init_app registered an (empty) metadata for the replica bind; the session-wide app has no such bind
+    _db.metadatas.pop('replica_0', None)
+    metadata_cache.init_app(app) # Restore the cache used by the rest of the suite
+
+
+def _signed_up_client(replica_app):
+    """Sign up on the primary, copy the user to the replica, and return a client and token."""
+    client = replica_app.test_client()
+    assert client.post('/auth/signup', json={"username": "reader", "email": "reader@example.com", "password": "pw"}).status_code == 201
+    token = client.post('/auth/login', json={"identifier": "reader", "password": "pw"}).get_json()['access_token']
+    users = User.__table__
+    with _db.engines[None].connect() as primary, _db.engines['replica_0'].begin() as replica:
+        replica.execute(insert(users), [dict(row._mapping) for row in primary.execute(select(users))])
+    return client, token
+
+
+def _seed_video(bind_key, title):
+    with _db.engines[bind_key].begin() as connection:
+        connection.execute(insert(Video.__table__).values(
+            id=100, title=title, filename='x.mp4', file_path='/tmp/x.mp4', user_id=1))
+
+
+def test_reads_go_to_replica(replica_app):
+    """Test that a GET request reads from the replica."""
+    client, token = _signed_up_client(replica_app)
+    _seed_video(None, 'primary copy')
+    _seed_video('replica_0', 'replica copy')
+
+    response = client.get('/videos/100', headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'replica copy'
+
+
+def test_reads_stick_to_primary_after_upload(replica_app):
+    """Test read-your-writes: right after an upload, the uploader reads from the primary."""
+    client, token = _signed_up_client(replica_app)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get('/videos/user', headers=headers).get_json() == []
+
+    upload = client.post('/videos/upload_video', data={
+        'title': 'Fresh upload', 'video': (io.BytesIO(b"fresh"), "fresh.mp4")
+    }, content_type='multipart/form-data', headers=headers)
+    assert upload.status_code == 201
+
+    # The replica never receives the row, so seeing it proves the read went to the primary
+    assert [v['title'] for v in client.get('/videos/user', headers=headers).get_json()] == ['Fresh upload']
+
+
+def test_lagging_replica_falls_back_to_primary(replica_app):
+    """Test that a replica lagging past the threshold is skipped."""
+    client, token = _signed_up_client(replica_app)
+    _seed_video(None, 'primary copy')
+    _seed_video('replica_0', 'replica copy')
+    router = replica_app.extensions['replica_router']
+    router.lag_probe = lambda engine: 60.0
+    router._lag.clear()
+
+    response = client.get('/videos/100', headers={"Authorization": f"Bearer {token}"})
+    assert response.get_json()['title'] == 'primary copy'
+    assert router.stats()['replicas'] == {'replica_0': 60.0}
@@ -0,0 +1,84 @@
+from app import create_app, db as _db
+from app.models import Video
+
+
+def test_search_requires_query(auth_data, db):
+    """Test that an empty search is rejected."""
+    client, access_token, _ = auth_data
+    response = client.get('/videos/search?q=', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 400
+
+
+def test_search_ranks_title_matches_first(auth_data, db, upload):
+    """Test that uploads are indexed and title matches outrank description matches."""
+    client, access_token, _ = auth_data
+    in_description = upload(client, access_token, 'Holiday clip', description='We saw a sunset on the beach')
+    in_title = upload(client, access_token, 'Sunset timelapse', description='Filmed from the balcony')
+    upload(client, access_token, 'Unrelated', description='Nothing to see here')
+
+    response = client.get('/videos/search?q=sunset', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert [r['id'] for r in json_data['results']] == [in_title, in_description]
+    assert json_data['has_more'] is False
+
+
+def test_search_paginates(auth_data, db, upload):
+    """Test that per_page and page slice the ranked results."""
+    client, access_token, _ = auth_data
+    for i in range(3):
+        upload(client, access_token, f'Cooking episode {i}')
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    first = client.get('/videos/search?q=cooking&per_page=2', headers=headers).get_json()
+    second = client.get('/videos/search?q=cooking&per_page=2&page=2', headers=headers).get_json()
+    assert len(first['results']) == 2 and first['has_more'] is True
+    assert len(second['results']) == 1 and second['has_more'] is False
+
+
+def test_search_index_follows_edits(auth_data, db, upload):
+    """Test that editing a title re-indexes the video."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    video_id = upload(client, access_token, 'Old name')
+
+    response = client.patch(f'/videos/{video_id}', json={'title': 'Brand new name'}, headers=headers)
+    assert response.status_code == 200
+    assert client.get('/videos/search?q=old', headers=headers).get_json()['results'] == []
+    assert [r['id'] for r in client.get('/videos/search?q=brand', headers=headers).get_json()['results']] == [video_id]
+
+
+def test_search_ignores_query_syntax(auth_data, db, upload):
+    """Test that FTS operators in user input are treated as plain words."""
+    client, access_token, _ = auth_data
+    upload(client, access_token, 'Robots NEAR the lake')
+    response = client.get('/videos/search?q=robots" NEAR(', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 1
+
+
+def test_reindex_command_backfills(auth_data, db, runner):
+    """Test that `flask search reindex` indexes videos written without the hooks."""
+    client, access_token, user_info = auth_data
+    _db.session.execute(Video.__table__.insert().values(
+        title='Backfilled documentary', filename='b.mp4', file_path='/tmp/b.mp4', user_id=user_info['id']))
+    _db.session.commit()
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get('/videos/search?q=documentary', headers=headers).get_json()['results'] == []
+
+    result = runner.invoke(args=['search', 'reindex'])
+    assert result.exit_code == 0, result.output
+    assert len(client.get('/videos/search?q=documentary', headers=headers).get_json()['results']) == 1
+
+
+def test_autogenerate_ignores_search_index(app, tmp_path, monkeypatch):
+    """Test that after `flask db upgrade` autogenerate sees no diff, so it never drops the raw-DDL index."""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'migrated.db'}")
+    migrated = create_app()
+    with migrated.app_context(): # The CLI would otherwise run against the session-wide app
+        runner = migrated.test_cli_runner()
+        result = runner.invoke(args=['db', 'upgrade'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(args=['db', 'check'])
+        assert result.exit_code == 0, result.output
+        _db.session.remove()
@@ -0,0 +1,207 @@
+import io
+import os
+import pytest
+from sqlalchemy import func, select
+from app import create_app, db as _db
+from app.cache import metadata_cache
+from app.models import User, UserStats, Video
+from app.sharding import create_shard_schema, move_user
+
+SHARD_KEYS = ('shard_0', 'shard_1')
+
+
+@pytest.fixture
+def shard_app(app, tmp_path, monkeypatch):
+    """An app with a primary and two video shards, all separate SQLite files."""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv('VIDEO_SHARD_URLS', ','.join(f"sqlite:///{tmp_path / key}.db" for key in SHARD_KEYS))
+    monkeypatch.setenv('SHARD_DIRECTORY_TTL_SECONDS', '0') # No directory caching, so moves need no waiting
+    monkeypatch.setenv('METADATA_CACHE_BACKEND', 'none')
+    shard_app = create_app()
+    with shard_app.app_context():
+        _db.create_all()
+        for key in SHARD_KEYS:
+            create_shard_schema(_db.engines[key])
+        yield shard_app
+        _db.session.remove()
+        for engine in _db.engines.values():
+            engine.dispose()
+    for key in SHARD_KEYS: # The session-wide app has no shard binds
+        _db.metadatas.pop(key, None)
+    metadata_cache.init_app(app)
+
+
+def _signed_up_client(shard_app, username):
+    client = shard_app.test_client()
+    assert client.post('/auth/signup', json={"username": username, "email": f"{username}@example.com", "password": "pw"}).status_code == 201
+    token = client.post('/auth/login', json={"identifier": username, "password": "pw"}).get_json()['access_token']
+    return client, {"Authorization": f"Bearer {token}"}
+
+
+def _upload(client, headers, title):
+    response = client.post('/videos/upload_video', data={
+        'title': title, 'video': (io.BytesIO(b"shard bytes"), f"{title.replace(' ', '_')}.mp4")
+    }, content_type='multipart/form-data', headers=headers)
+    assert response.status_code == 201, response.data
+    return response.get_json()['video_id']
+
+
+def _video_count(bind_key, user_id):
+    with _db.engines[bind_key].connect() as connection:
+        return connection.execute(select(func.count()).select_from(Video.__table__)
+                                  .where(Video.__table__.c.user_id == user_id)).scalar()
+
+
+def _user_id(username):
+    return User.query.filter_by(username=username).one().id
+
+
+def test_videos_live_on_owner_shard(shard_app):
+    """Test that uploads land on the owner's shard only and are found by global ID."""
+    router = shard_app.extensions['shard_router']
+    client, headers = _signed_up_client(shard_app, 'sharded')
+    user_id = _user_id('sharded')
+    home = router.lookup(user_id)[0]
+    other = next(key for key in SHARD_KEYS if key != home)
+
+    first = _upload(client, headers, 'First Shard Video')
+    second = _upload(client, headers, 'Second Shard Video')
+    assert first != second
+    assert (_video_count(home, user_id), _video_count(other, user_id), _video_count(None, user_id)) == (2, 0, 0)
+
+    response = client.get(f'/videos/{first}', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['uploader_username'] == 'sharded'
+    assert sorted(v['id'] for v in client.get('/videos/user', headers=headers).get_json()) == [first, second]
+    assert client.get('/videos/user/stats', headers=headers).get_json()['video_count'] == 2
+    assert [hit['id'] for hit in client.get('/videos/search?q=second', headers=headers).get_json()['results']] == [second]
+
+
+def test_signup_creates_counters_on_home_shard(shard_app):
+    """Test that a new user's usage counters are created on their shard, not on the primary."""
+    router = shard_app.extensions['shard_router']
+    _signed_up_client(shard_app, 'counted')
+    user_id = _user_id('counted')
+    home = router.lookup(user_id)[0]
+    counters = {}
+    for bind_key in (None,) + SHARD_KEYS:
+        with _db.engines[bind_key].connect() as connection:
+            counters[bind_key] = connection.execute(select(UserStats.__table__.c.video_count)
+                                                    .where(UserStats.__table__.c.user_id == user_id)).scalars().all()
+    assert counters == {None: [], home: [0], next(key for key in SHARD_KEYS if key != home): []}
+
+
+def test_video_ids_are_unique_across_shards(shard_app):
+    """Test that two users on different shards never get the same video ID."""
+    router = shard_app.extensions['shard_router']
+    ids = []
+    for username, key in (('left', 'shard_0'), ('right', 'shard_1')):
+        client, headers = _signed_up_client(shard_app, username)
+        router.assign(_user_id(username), key)
+        ids.append(_upload(client, headers, f'{username} video'))
+    assert len(set(ids)) == 2
+
+    response = client.get(f'/videos?ids={ids[0]},{ids[1]}', headers=headers)
+    assert response.status_code == 200
+    assert [v['id'] for v in response.get_json()] == ids
+
+
+def test_move_user_to_other_shard(shard_app):
+    """Test that a rebalance moves every video and the API keeps serving them."""
+    router = shard_app.extensions['shard_router']
+    client, headers = _signed_up_client(shard_app, 'mover')
+    user_id = _user_id('mover')
+    source = router.lookup(user_id)[0]
+    target = next(key for key in SHARD_KEYS if key != source)
+    video_id = _upload(client, headers, 'Moving Video')
+
+    move_user(user_id, target)
+
+    assert router.lookup(user_id) == (target, False)
+    assert (_video_count(source, user_id), _video_count(target, user_id)) == (0, 1)
+    assert client.get(f'/videos/{video_id}', headers=headers).get_json()['title'] == 'Moving Video'
+    assert client.get('/videos/user/stats', headers=headers).get_json()['video_count'] == 1
+    assert client.patch(f'/videos/{video_id}', json={"title": "Moved"}, headers=headers).status_code == 200
+    assert [hit['id'] for hit in client.get('/videos/search?q=moved', headers=headers).get_json()['results']] == [video_id]
+
+
+def test_writes_paused_while_moving(shard_app):
+    """Test that uploads are rejected with 503 during a rebalance cutover."""
+    router = shard_app.extensions['shard_router']
+    client, headers = _signed_up_client(shard_app, 'paused')
+    user_id = _user_id('paused')
+    router.assign(user_id, router.lookup(user_id)[0], moving=True)
+
+    response = client.post('/videos/upload_video', data={
+        'title': 'Too Early', 'video': (io.BytesIO(b"x"), "early.mp4")
+    }, content_type='multipart/form-data', headers=headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_upload_rejected_if_move_starts_mid_body(shard_app, monkeypatch):
+    """Test that an upload whose body was still being read when a move began is not committed to the source."""
+    import app.videos
+    router = shard_app.extensions['shard_router']
+    client, headers = _signed_up_client(shard_app, 'racer')
+    user_id = _user_id('racer')
+    home = router.lookup(user_id)[0]
+    saved = []
+    save = app.videos.save_preallocated
+
+    def save_then_cutover(file, path, size):
+        saved.append(path)
+        result = save(file, path, size)
+        router.assign(user_id, home, moving=True) # Another process; this worker's directory cache is stale
+        router._directory[user_id] = (float('inf'), home, False)
+        return result
+    monkeypatch.setattr(app.videos, 'save_preallocated', save_then_cutover)
+    router.directory_ttl = float('inf')
+
+    response = client.post('/videos/upload_video', data={
+        'title': 'Racing', 'video': (io.BytesIO(b"race"), "race.mp4")
+    }, content_type='multipart/form-data', headers=headers)
+    assert response.status_code == 503 and response.headers['Retry-After']
+    assert _video_count(home, user_id) == 0
+    assert not os.path.exists(saved[0])
+
+
+def test_move_user_copies_late_uploads(shard_app, monkeypatch):
+    """Test that an upload committed to the source after the final sync is copied before the purge."""
+    import app.sharding
+    router = shard_app.extensions['shard_router']
+    client, headers = _signed_up_client(shard_app, 'latecomer')
+    user_id = _user_id('latecomer')
+    source = router.lookup(user_id)[0]
+    target = next(key for key in SHARD_KEYS if key != source)
+    first = _upload(client, headers, 'Before Move')
+    late = []
+    rebuild = app.sharding._rebuild_stats
+
+    def rebuild_then_late_commit(engine, user_id):
+        rebuild(engine, user_id)
+        if not late: # A write that passed its directory check just before `moving` was set
+            with _db.engines[source].begin() as connection:
+                row = dict(connection.execute(select(Video.__table__).where(Video.__table__.c.id == first)).one()._mapping)
+                row.update(id=first + 1000, title='Late Upload')
+                connection.execute(Video.__table__.insert().values(row))
+            late.append(row['id'])
+    monkeypatch.setattr(app.sharding, '_rebuild_stats', rebuild_then_late_commit)
+
+    move_user(user_id, target)
+
+    assert (_video_count(source, user_id), _video_count(target, user_id)) == (0, 2)
+    assert client.get(f'/videos/{late[0]}', headers=headers).get_json()['title'] == 'Late Upload'
+    assert client.get('/videos/user/stats', headers=headers).get_json()['video_count'] == 2
+
+
+def test_change_feed_requires_shard(shard_app):
+    """Test that the change feed is read per shard."""
+    client, headers = _signed_up_client(shard_app, 'feeder')
+    user_id = _user_id('feeder')
+    home = shard_app.extensions['shard_router'].lookup(user_id)[0]
+    video_id = _upload(client, headers, 'Feed Video')
+
+    assert client.get('/videos/changes', headers=headers).status_code == 400
+    lines = client.get(f'/videos/changes?shard={home}', headers=headers).get_data(as_text=True).splitlines()
+    assert len(lines) == 1 and f'"id":{video_id}' in lines[0].replace(' ', '')
@@ -0,0 +1,59 @@
+from app.models import Video, UserStats
+from app.stats import apply_delta
+
+
+def _stats(client, access_token):
+    response = client.get('/videos/user/stats', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_stats_start_at_zero(auth_data, db):
+    """Test that a new user has an all-zero counter row."""
+    client, access_token, _ = auth_data
+    assert _stats(client, access_token) == {"video_count": 0, "total_bytes": 0, "processed_count": 0}
+
+
+def test_stats_follow_upload_processing_and_delete(auth_data, db, upload):
+    """Test that counters move with uploads, processing and deletion."""
+    client, access_token, _ = auth_data
+    first_id = upload(client, access_token, 'Stats Video', content=b"1234567890")
+    upload(client, access_token, 'Stats Video', content=b"12345")
+    assert _stats(client, access_token) == {"video_count": 2, "total_bytes": 15, "processed_count": 0}
+
+    video = db.session.get(Video, first_id)
+    video.is_processed = True
+    db.session.commit()
+    assert _stats(client, access_token)['processed_count'] == 1
+
+    db.session.delete(db.session.get(Video, first_id))
+    db.session.commit()
+    assert _stats(client, access_token) == {"video_count": 1, "total_bytes": 5, "processed_count": 0}
+
+
+def test_reconcile_repairs_drift(auth_data, db, runner, upload):
+    """Test that `flask stats reconcile` recomputes counters that drifted."""
+    client, access_token, user_info = auth_data
+    upload(client, access_token, 'Stats Video', content=b"123")
+    stats = db.session.get(UserStats, user_info['id'])
+    stats.video_count = 42
+    stats.total_bytes = 0
+    db.session.commit()
+
+    result = runner.invoke(args=['stats', 'reconcile'])
+    assert result.exit_code == 0, result.output
+    assert "repaired 1" in result.output
+    db.session.expire_all()
+    assert _stats(client, access_token) == {"video_count": 1, "total_bytes": 3, "processed_count": 0}
+
+
+def test_first_delta_creates_counter_row(auth_data, db):
+    """Test that a user without a counter row gets one from a single upsert, which later deltas add to."""
+    client, access_token, user_info = auth_data
+    db.session.delete(db.session.get(UserStats, user_info['id'])) # A user that predates the counters
+    db.session.commit()
+
+    with db.engine.begin() as connection:
+        apply_delta(connection, user_info['id'], 1, 10, 0)
+        apply_delta(connection, user_info['id'], 1, 5, 1)
+    assert _stats(client, access_token) == {"video_count": 2, "total_bytes": 15, "processed_count": 1}
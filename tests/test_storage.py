@@ -0,0 +1,199 @@
+import json
+import os
+import time
+import pytest
+from app.archive import run_archival
+from app.models import ArchivedVideo, Video, VideoTombstone
+from app.storage import Throttle, _sorted_files, check_file, reconcile, run_scrub
+
+
+@pytest.fixture
+def state_path(app, tmp_path, monkeypatch):
+    path = tmp_path / 'scrub_state.json'
+    monkeypatch.setitem(app.config, 'SCRUB_STATE_PATH', str(path))
+    return path
+
+
+def test_upload_records_digest(auth_data, db, upload):
+    """Test that uploads store the SHA-256 of their content as the scrub baseline."""
+    client, access_token, _ = auth_data
+    video = db.session.get(Video, upload(client, access_token, 'Digest'))
+    assert video.content_digest == check_file(video.file_path, None, None)[1]
+
+
+def test_scrub_flags_damaged_files(auth_data, db, runner, state_path, upload):
+    """Test that missing, truncated and bit-rotted files are flagged and reported."""
+    client, access_token, _ = auth_data
+    ids = {name: upload(client, access_token, name) for name in ('Fine', 'Gone', 'Short', 'Rotten', 'Legacy')}
+    paths = {name: db.session.get(Video, video_id).file_path for name, video_id in ids.items()}
+    os.remove(paths['Gone'])
+    with open(paths['Short'], 'r+b') as f:
+        f.truncate(3)
+    with open(paths['Rotten'], 'r+b') as f:
+        f.write(b"S") # Same size, different bytes
+    legacy = db.session.get(Video, ids['Legacy'])
+    legacy.content_digest = None # Uploaded before digests were recorded
+    db.session.commit()
+    updated_at = legacy.updated_at
+
+    result = runner.invoke(args=['storage', 'scrub', '--rate', '0'])
+    assert result.exit_code == 0, result.output
+    assert "Pass complete. 5 videos checked, 3 problems found" in result.output
+    db.session.expire_all()
+    statuses = {name: db.session.get(Video, video_id).integrity_status for name, video_id in ids.items()}
+    assert statuses == {'Fine': 'ok', 'Gone': 'missing', 'Short': 'size_mismatch', 'Rotten': 'corrupt', 'Legacy': 'ok'}
+    legacy = db.session.get(Video, ids['Legacy'])
+    assert legacy.content_digest is not None
+    assert legacy.updated_at == updated_at # Scrubbing is not an edit
+
+    listing = runner.invoke(args=['storage', 'problems']).output
+    assert f"video {ids['Gone']}: missing" in listing and "3 videos with problems." in listing
+
+
+def test_scrub_resumes_after_stop(auth_data, db, state_path, upload):
+    """Test that a stopped pass continues from its saved cursor, including archived rows."""
+    client, access_token, _ = auth_data
+    ids = [upload(client, access_token, f"Clip {n}") for n in range(3)]
+    archived = db.session.get(Video, ids[0])
+    archived.is_processed = True
+    archived.created_at = archived.created_at.replace(year=2000)
+    db.session.commit()
+    run_archival(archived.created_at.replace(year=2001), pause=0)
+
+    assert run_scrub(str(state_path), batch_size=1, max_batches=1)[2] is False
+    assert json.loads(state_path.read_text())['cursors'] == {'default/videos': ids[1]}
+    checked, problems, finished = run_scrub(str(state_path), batch_size=1)
+    assert (checked, problems, finished) == (2, 0, True) # The rest of videos, then the archive
+    assert db.session.get(ArchivedVideo, ids[0]).integrity_status == 'ok'
+    assert json.loads(state_path.read_text())['cursors'] == {} # Next run starts a new pass
+
+
+def test_throttle_paces_reads(monkeypatch):
+    """Test that the throttle sleeps off reads that run ahead of the rate."""
+    slept = []
+    monkeypatch.setattr('app.storage.time.sleep', slept.append)
+    throttle = Throttle(1000)
+    throttle.consume(2000)
+    assert 1.9 < sum(slept) <= 2.0
+    Throttle(0).consume(10 ** 9)
+    assert len(slept) == 1
+
+
+def _age_file(path, hours):
+    then = time.time() - hours * 3600
+    os.utime(path, (then, then))
+
+
+@pytest.fixture
+def upload_root(app, tmp_path, monkeypatch):
+    """An empty UPLOAD_FOLDER, so files left by other tests don't show up as orphans."""
+    root = tmp_path / 'uploads'
+    root.mkdir()
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(root))
+    monkeypatch.setitem(app.config, 'RECONCILE_QUARANTINE_DIR', str(tmp_path / 'quarantine'))
+    return root
+
+
+def test_sorted_files_match_string_order(tmp_path):
+    """Test that the directory walk yields paths in the same order a sort of the strings would."""
+    for relative in ('a/x', 'a-b', 'a.c/y', 'b', 'a/z/1', 'A'):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    paths = [entry.path for entry in _sorted_files(str(tmp_path))]
+    assert paths == sorted(paths) and len(paths) == 6
+
+
+def test_reconcile_reports_orphans_and_dangling_rows(auth_data, db, runner, upload_root, tmp_path, upload):
+    """Test that unreferenced files and rows without files are found, sparing recent orphans."""
+    client, access_token, user_info = auth_data
+    kept_id = upload(client, access_token, 'Kept')
+    gone_id = upload(client, access_token, 'Gone')
+    os.remove(db.session.get(Video, gone_id).file_path)
+    user_folder = upload_root / str(user_info['id'])
+    old_orphan, new_orphan = user_folder / 'crashed.mp4', user_folder / 'uploading.mp4'
+    old_orphan.write_bytes(b"left behind")
+    new_orphan.write_bytes(b"in progress")
+    _age_file(old_orphan, 48)
+
+    result = runner.invoke(args=['storage', 'reconcile', '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert f"orphan (report): {old_orphan} (11 bytes)" in result.output
+    assert f"dangling: video {gone_id}" in result.output
+    assert "3 files checked: 1 orphans (11 bytes), 1 within the grace period, 1 dangling rows" in result.output
+    assert old_orphan.exists()
+
+    runner.invoke(args=['storage', 'reconcile', '--action', 'quarantine'])
+    assert not old_orphan.exists() and new_orphan.exists()
+    assert (tmp_path / 'quarantine' / str(user_info['id']) / 'crashed.mp4').read_bytes() == b"left behind"
+    assert os.path.exists(db.session.get(Video, kept_id).file_path)
+
+
+def test_reconcile_delete_spares_archived_files(auth_data, db, upload_root, upload):
+    """Test that files of archived videos count as referenced and only true orphans are deleted."""
+    client, access_token, user_info = auth_data
+    video_id = upload(client, access_token, 'Archived')
+    video = db.session.get(Video, video_id)
+    video.is_processed = True
+    video.created_at = video.created_at.replace(year=2000)
+    db.session.commit()
+    run_archival(video.created_at.replace(year=2001), pause=0)
+    orphan = upload_root / str(user_info['id']) / 'orphan.mp4'
+    orphan.write_bytes(b"x")
+    _age_file(orphan, 48)
+
+    counts = reconcile(str(upload_root), 3600, 'delete')
+    assert (counts['orphans'], counts['dangling_rows']) == (1, 0)
+    assert not orphan.exists()
+    assert os.path.exists(db.session.get(ArchivedVideo, video_id).file_path)
+
+
+def test_delete_video_tombstones_and_reclaims(auth_data, db, runner, upload):
+    """Test that deleting hides the video and frees the owner's usage at once, and the files later."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    video_id = upload(client, access_token, 'Doomed', content=b"scrub me please")
+    kept_id = upload(client, access_token, 'Kept')
+    file_path = db.session.get(Video, video_id).file_path
+    thumbnail = os.path.splitext(file_path)[0] + '_thumb.jpg'
+    with open(thumbnail, 'wb') as f:
+        f.write(b"jpeg")
+    assert client.get(f'/videos/{video_id}', headers=headers).status_code == 200 # Cached now
+
+    response = client.delete(f'/videos/{video_id}', headers=headers)
+    assert response.status_code == 202
+    assert client.get(f'/videos/{video_id}', headers=headers).status_code == 404
+    assert [v['id'] for v in client.get('/videos/user', headers=headers).get_json()] == [kept_id]
+    assert client.get('/videos/user/stats', headers=headers).get_json()['video_count'] == 1
+    assert client.get('/videos/search?q=doomed', headers=headers).get_json()['results'] == []
+    assert os.path.exists(file_path) # Not yet reclaimed
+
+    result = runner.invoke(args=['storage', 'reclaim', '--pause', '0'])
+    assert "1 deleted videos reclaimed, 19 bytes freed" in result.output
+    assert not os.path.exists(file_path) and not os.path.exists(thumbnail)
+    assert os.path.exists(db.session.get(Video, kept_id).file_path)
+    assert VideoTombstone.query.count() == 0
+
+
+def test_bulk_delete(auth_data, db, upload):
+    """Test that bulk delete removes the caller's videos, archived ones included, and reports the rest."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    mine = [upload(client, access_token, f"Mine {n}") for n in range(2)]
+    archived = db.session.get(Video, mine[0]) # Not the newest, whose ID SQLite would hand out again
+    archived.is_processed = True
+    archived.created_at = archived.created_at.replace(year=2000)
+    db.session.commit()
+    run_archival(archived.created_at.replace(year=2001), pause=0)
+    client.post('/auth/signup', json={"username": "other", "email": "other@example.com", "password": "pw"})
+    other_token = client.post('/auth/login', json={"identifier": "other", "password": "pw"}).get_json()['access_token']
+    theirs = upload(client, other_token, 'Theirs')
+
+    response = client.post('/videos/delete', json={"ids": mine + [theirs, 999]}, headers=headers)
+    assert response.status_code == 202
+    assert response.get_json() == {"deleted": mine, "forbidden": [theirs], "not_found": [999]}
+    assert Video.query.filter(Video.id.in_(mine)).count() == 0
+    assert db.session.get(ArchivedVideo, mine[0]) is None
+    assert VideoTombstone.query.count() == 2
+    assert client.delete(f'/videos/{theirs}', headers=headers).status_code == 403
+    assert client.get('/videos/user/stats', headers=headers).get_json()['total_bytes'] == 0
@@ -0,0 +1,105 @@
+import datetime
+import os
+import shutil
+import pytest
+from app.models import Video
+from app.tiering import access_stats, promoter
+
+
+@pytest.fixture
+def tiers(app, tmp_path, monkeypatch):
+    """Hot and cold roots in a temporary directory, with every stream recorded."""
+    hot, cold = tmp_path / 'hot', tmp_path / 'cold'
+    hot.mkdir()
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(hot))
+    monkeypatch.setitem(app.config, 'COLD_STORAGE_FOLDER', str(cold))
+    monkeypatch.setattr(access_stats, 'sample_rate', 1.0)
+    monkeypatch.setattr(access_stats, 'flush_interval', 3600)
+    access_stats._reset_stats()
+    return hot, cold
+
+
+def _upload_and_login(upload, client, access_token, title='Tiered'):
+    video_id = upload(client, access_token, title, content=b"cold storage bytes")
+    client.post('/auth/login', data={'identifier': 'testuser', 'password': 'password123'}) # Session for /videos/stream
+    return video_id
+
+
+def _go_idle(db, video_id, days=60):
+    video = db.session.get(Video, video_id)
+    video.created_at = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    db.session.commit()
+
+
+def test_access_stats_are_batched(auth_data, db, tiers, upload):
+    """Test that streams are buffered and written out in one batch without touching updated_at."""
+    client, access_token, _ = auth_data
+    video_id = _upload_and_login(upload, client, access_token)
+    updated_at = db.session.get(Video, video_id).updated_at
+    for _ in range(3):
+        assert client.get(f'/videos/stream/{video_id}').status_code == 200
+    db.session.expire_all()
+    assert db.session.get(Video, video_id).access_count in (0, None) # Still buffered
+
+    access_stats.flush()
+    db.session.expire_all()
+    video = db.session.get(Video, video_id)
+    assert video.access_count == 3
+    assert video.last_accessed_at is not None
+    assert video.updated_at == updated_at
+    assert access_stats.stats()['flushes'] == 1
+
+
+def test_idle_videos_move_to_cold_and_back(auth_data, db, runner, tiers, upload):
+    """Test that idle files are demoted, still stream from the cold root, and are promoted back."""
+    client, access_token, _ = auth_data
+    hot, cold = tiers
+    headers = {"Authorization": f"Bearer {access_token}"}
+    idle_id = _upload_and_login(upload, client, access_token, 'Idle')
+    busy_id = _upload_and_login(upload, client, access_token, 'Busy')
+    _go_idle(db, idle_id)
+    hot_path = db.session.get(Video, idle_id).file_path
+    assert client.get(f'/videos/{idle_id}', headers=headers).get_json()['file_path'] == hot_path # Cached
+
+    result = runner.invoke(args=['tiering', 'run', '--pause', '0'])
+    assert result.exit_code == 0, result.output
+    assert "1 videos (18 bytes) moved to cold storage" in result.output
+    db.session.expire_all()
+    cold_path = db.session.get(Video, idle_id).file_path
+    assert cold_path == os.path.join(str(cold), os.path.relpath(hot_path, str(hot)))
+    assert not os.path.exists(hot_path) and os.path.exists(cold_path)
+    assert db.session.get(Video, busy_id).file_path.startswith(str(hot))
+    assert client.get(f'/videos/{idle_id}', headers=headers).get_json()['file_path'] == cold_path
+
+    response = client.get(f'/videos/stream/{idle_id}')
+    assert response.status_code == 200 and response.data == b"cold storage bytes"
+    response.close()
+    promoter.wait(timeout=5)
+    db.session.expire_all()
+    assert db.session.get(Video, idle_id).file_path == hot_path
+    assert os.path.exists(hot_path) and not os.path.exists(cold_path)
+
+
+def test_stream_survives_concurrent_move(auth_data, db, tiers, monkeypatch, upload):
+    """Test that a stream that read the row just before a move follows the file to its new root."""
+    client, access_token, _ = auth_data
+    hot, cold = tiers
+    video_id = _upload_and_login(upload, client, access_token)
+    import app.videos as videos_module
+    find = videos_module.find_video_anywhere
+
+    def find_then_move(requested_id):
+        video, bind_key = find(requested_id) # Row read with the hot path...
+        new_path = os.path.join(str(cold), os.path.relpath(video.file_path, str(hot)))
+        os.makedirs(os.path.dirname(new_path))
+        shutil.copy2(video.file_path, new_path)
+        with db.engines[None].begin() as connection: # ...then the tiering job switches it and unlinks the old copy
+            connection.execute(Video.__table__.update().where(Video.id == requested_id).values(file_path=new_path))
+        os.remove(video.file_path)
+        return video, bind_key
+    monkeypatch.setattr(videos_module, 'find_video_anywhere', find_then_move)
+
+    response = client.get(f'/videos/stream/{video_id}')
+    assert response.status_code == 200 and response.data == b"cold storage bytes"
+    response.close()
+    promoter.wait(timeout=5)
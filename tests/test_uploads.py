@@ -0,0 +1,145 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from app.models import Video
+from app.uploads import MemoryLedger, MemorySlots, SQLiteLedger, SQLiteSlots, disk_space, save_preallocated, upload_slots
+
+
+@pytest.fixture
+def free_space(monkeypatch):
+    """Pretend the upload filesystem has `nbytes` free, with a fresh ledger and no safety margin."""
+    def set_free(nbytes):
+        monkeypatch.setattr('app.uploads._free_bytes', lambda folder: nbytes)
+        monkeypatch.setattr(disk_space, 'ledger', MemoryLedger())
+        monkeypatch.setattr(disk_space, 'min_free', 0)
+        disk_space._reset_stats()
+    return set_free
+
+
+def _upload(client, access_token, payload=b"fake video data"):
+    data = {'title': 'Space Test', 'video': (io.BytesIO(payload), "space.mp4")}
+    return client.post('/videos/upload_video', data=data, content_type='multipart/form-data',
+                       headers={"Authorization": f"Bearer {access_token}"})
+
+
+def test_upload_rejected_when_disk_full(auth_data, free_space, app):
+    """Test that an upload larger than the free space gets a 507 and leaves nothing behind."""
+    client, access_token, user_info = auth_data
+    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(user_info['id']))
+    files_before = set(os.listdir(user_folder)) if os.path.isdir(user_folder) else set()
+    free_space(100)
+    response = _upload(client, access_token, b"x" * 1000)
+    assert response.status_code == 507
+    assert Video.query.count() == 0
+    assert (set(os.listdir(user_folder)) if os.path.isdir(user_folder) else set()) == files_before
+    assert disk_space.stats()['rejected'] == 1
+
+
+def test_in_flight_reservations_count(auth_data, free_space, app):
+    """Test that space reserved by other uploads in flight is not handed out twice."""
+    client, access_token, _ = auth_data
+    free_space(10000)
+    device = os.stat(app.config['UPLOAD_FOLDER']).st_dev
+    disk_space.ledger.reserve(device, 9500, lambda reserved: True, 60, time.time()) # Another worker's upload
+    assert _upload(client, access_token, b"x" * 1000).status_code == 507
+    free_space(100000)
+    assert _upload(client, access_token, b"x" * 1000).status_code == 201
+    # The reservation is released when the request ends
+    assert disk_space.ledger.reserved(device, time.time()) == 0
+
+
+def test_upload_preallocates_and_truncates(auth_data, free_space, tmp_path):
+    """Test that uploads are stored at their real size even though more was reserved."""
+    client, access_token, _ = auth_data
+    free_space(10 ** 9)
+    response = _upload(client, access_token, b"y" * 5000)
+    assert response.status_code == 201
+    assert os.path.getsize(response.get_json()['file_path']) == 5000
+
+    # A stream that can't report its size is preallocated from the hint, then truncated
+    unseekable = SimpleNamespace(stream=SimpleNamespace(read=io.BytesIO(b"z" * 10).read))
+    path = tmp_path / 'out.bin'
+    assert save_preallocated(unseekable, str(path), size_hint=4096) == (10, hashlib.sha256(b"z" * 10).hexdigest())
+    assert path.read_bytes() == b"z" * 10
+
+
+def test_missing_size_rejected(auth_data):
+    """Test that uploads without a declared size are refused before the body is read."""
+    client, access_token, _ = auth_data
+    response = client.post('/videos/upload_video', data=b'', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 411
+
+
+def test_sqlite_ledger_is_shared(tmp_path):
+    """Test that two ledgers on one file (as two workers would have) see each other's reservations."""
+    first, second = SQLiteLedger(str(tmp_path / 'r.db')), SQLiteLedger(str(tmp_path / 'r.db'))
+    fits = lambda reserved: 1000 - reserved - 600 >= 0
+    now = time.time()
+    reservation_id, _ = first.reserve(1, 600, fits, 60, now)
+    assert reservation_id is not None
+    assert second.reserve(1, 600, fits, 60, now) == (None, 600)
+    assert second.reserve(2, 600, fits, 60, now)[0] is not None # Other filesystems are separate
+    first.release(reservation_id)
+    assert second.reserve(1, 600, fits, 60, now)[0] is not None
+    # Reservations of dead workers expire
+    assert first.reserved(1, now + 61) == 0
+
+
+def test_storage_stats(auth_data):
+    client, access_token, _ = auth_data
+    stats = client.get('/videos/storage/stats', headers={"Authorization": f"Bearer {access_token}"}).get_json()
+    assert stats['store'] == 'MemoryLedger'
+    assert stats['free_bytes'] > 0
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    """Fresh in-memory upload slots with the given caps and queue timeout."""
+    def configure(max_concurrent=8, max_per_user=2, queue_timeout=0.05):
+        monkeypatch.setattr(upload_slots, 'slots', MemorySlots())
+        monkeypatch.setattr(upload_slots, 'max_concurrent', max_concurrent)
+        monkeypatch.setattr(upload_slots, 'max_per_user', max_per_user)
+        monkeypatch.setattr(upload_slots, 'queue_timeout', queue_timeout)
+        upload_slots._reset_stats()
+        return upload_slots.slots
+    return configure
+
+
+def test_per_user_upload_cap(auth_data, slots):
+    """Test that a user over their concurrent-upload cap gets a 429 once the queue timeout passes."""
+    client, access_token, user_info = auth_data
+    store = slots(max_per_user=1)
+    store.acquire(str(user_info['id']), 8, 1, 60, time.time()) # An upload of theirs still running
+    response = _upload(client, access_token)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    # Other users are under their own cap
+    store.acquire('someone-else', 8, 1, 60, time.time())
+    assert upload_slots.stats()['in_flight'] == 2
+    assert upload_slots.stats()['rejected'] == 1
+
+
+def test_global_cap_queues_until_slot_frees(auth_data, slots):
+    """Test that an upload over the global cap waits for a slot instead of failing."""
+    client, access_token, _ = auth_data
+    store = slots(max_concurrent=1, queue_timeout=5)
+    slot_id = store.acquire('another-user', 1, 2, 60, time.time())
+    threading.Timer(0.1, store.release, (slot_id,)).start()
+    assert _upload(client, access_token).status_code == 201
+    stats = upload_slots.stats()
+    assert (stats['queued'], stats['rejected'], stats['in_flight']) == (1, 0, 0) # Released after the upload
+
+
+def test_sqlite_slots_are_shared(tmp_path):
+    """Test that slot caps hold across two stores on one file."""
+    first, second = SQLiteSlots(str(tmp_path / 'r.db')), SQLiteSlots(str(tmp_path / 'r.db'))
+    now = time.time()
+    assert first.acquire('1', 3, 1, 60, now) is not None
+    assert second.acquire('1', 3, 1, 60, now) is None # Per-user cap
+    assert second.acquire('2', 3, 1, 60, now) is not None
+    assert first.acquire('3', 2, 1, 60, now) is None # Global cap
+    assert second.occupancy(now) == 2
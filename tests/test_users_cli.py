@@ -0,0 +1,42 @@
+from app.models import User, UserStats
+
+
+def test_import_csv_reports_bad_rows(auth_data, db, runner, tmp_path):
+    """Test that a CSV import creates valid users and reports every rejected row."""
+    client, _, _ = auth_data
+    source = tmp_path / 'users.csv'
+    source.write_text(
+        "username,email,password\n"
+        "alice,alice@example.com,alice-pw\n"
+        "alice,alice2@example.com,again\n"         # line 3: duplicate within the file (same chunk)
+        "testuser,new@example.com,taken-name\n"   # line 4: exists in the database
+        "carol,carol@example.com,\n"               # line 5: no password
+        "bob,bob@example.com,bob-pw\n"
+        "dave,dave@example.com,dave-pw\n")
+
+    result = runner.invoke(args=['users', 'import', str(source), '--chunk-size', '2', '--workers', '0'])
+    assert result.exit_code == 0, result.output
+    assert "Done. 3 users imported, 3 rows rejected" in result.output
+    assert "line 4: Username or email already exists" in result.output
+    assert "line 5: Missing password" in result.output
+    assert "line 3: Duplicate username or email within the file" in result.output
+    assert "users/s" in result.output
+
+    alice = User.query.filter_by(username='alice').one()
+    assert db.session.get(UserStats, alice.id).video_count == 0
+    assert client.post('/auth/login', json={"identifier": "dave", "password": "dave-pw"}).status_code == 200
+
+
+def test_import_ndjson_with_hashing_pool(db, runner, tmp_path):
+    """Test an NDJSON import that hashes on worker processes."""
+    source = tmp_path / 'users.ndjson'
+    source.write_text(
+        '{"username": "erin", "email": "erin@example.com", "password": "erin-pw"}\n'
+        'not json\n'
+        '{"username": "frank", "email": "frank@example.com", "password": "frank-pw"}\n')
+
+    result = runner.invoke(args=['users', 'import', str(source), '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert "Done. 2 users imported, 1 rows rejected" in result.output
+    assert "line 2: Invalid JSON" in result.output
+    assert User.query.filter_by(username='frank').one().check_password('frank-pw')
@@ -320,3 +320,93 @@ def test_stream_video_file_not_found_on_disk(client, db, app, mocker):
 
     response = client.get(f'/videos/stream/{video_id}')
     assert response.status_code == 404 # As per current route logic
+
+
+# --- Tests for projected / sparse metadata serialization ---
+
+def test_get_user_videos_sparse_fields(auth_data, db, upload):
+    """Test that ?fields= limits the keys returned for each video."""
+    client, access_token, _ = auth_data
+    upload(client, access_token, 'Sparse Video', content=b"12345")
+
+    response = client.get('/videos/user?fields=id,title,total_size', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert len(json_data) == 1
+    assert set(json_data[0]) == {'id', 'title', 'total_size'}
+    assert json_data[0]['title'] == 'Sparse Video'
+    assert json_data[0]['total_size'] == 5
+
+
+def test_get_video_metadata_unknown_field(auth_data, db, upload):
+    """Test that an unknown field name is rejected with 400."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Field Video')
+
+    response = client.get(f'/videos/{video_id}?fields=id,password_hash', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == "Unknown field(s): password_hash"
+
+
+def test_get_user_videos_single_query(auth_data, db, upload, monkeypatch):
+    """Test that listing videos with uploader names, archived ones included, costs a single statement."""
+    from sqlalchemy import event
+    from app.revocation import token_denylist
+    client, access_token, user_info = auth_data
+    monkeypatch.setattr(token_denylist, 'sync_interval', 3600) # Its periodic sync is not part of the request
+    for i in range(3):
+        upload(client, access_token, f'Query Video {i}')
+
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get('/videos/user', headers={"Authorization": f"Bearer {access_token}"})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert response.status_code == 200
+    assert all(v['uploader_username'] == user_info['username'] for v in response.get_json())
+    assert len(statements) == 1 and 'FROM videos' in statements[0]
+
+
+# --- Tests for multi-get metadata ---
+
+def test_multi_get_preserves_order_and_marks_missing(auth_data, db, upload):
+    """Test that /videos?ids= returns videos in the requested order with not-found markers."""
+    client, access_token, user_info = auth_data
+    first_id = upload(client, access_token, 'Batch One')
+    second_id = upload(client, access_token, 'Batch Two')
+
+    response = client.get(f'/videos?ids={second_id},9999,{first_id}', headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert [v['id'] for v in json_data] == [second_id, 9999, first_id]
+    assert json_data[0]['title'] == 'Batch Two'
+    assert json_data[0]['uploader_username'] == user_info['username']
+    assert json_data[1] == {"id": 9999, "msg": "Video not found"}
+    assert json_data[2]['title'] == 'Batch One'
+
+
+def test_multi_get_post_with_fields(auth_data, db, upload):
+    """Test the POST variant with a sparse fieldset that omits the id."""
+    client, access_token, _ = auth_data
+    video_id = upload(client, access_token, 'Posted Batch')
+
+    response = client.post('/videos', json={"ids": [video_id], "fields": ["title"]}, headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.get_json() == [{"title": "Posted Batch"}]
+
+
+def test_multi_get_invalid_ids(auth_data, db):
+    """Test that missing or malformed ids are rejected."""
+    client, access_token, _ = auth_data
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get('/videos', headers=headers).status_code == 400
+    assert client.get('/videos?ids=1,abc', headers=headers).status_code == 400
+    too_many = ','.join(str(i) for i in range(501))
+    assert client.post('/videos', json={"ids": too_many}, headers=headers).status_code == 400
+    for body in ({"ids": [1.5]}, {"ids": [True]}, {"ids": [[1]]}, {"ids": [1], "fields": [1]}, {"ids": [1], "fields": "title"}):
+        assert client.post('/videos', json=body, headers=headers).status_code == 400, body